@@ -2,7 +2,7 @@ from pathlib import Path
 
 import humanfriendly
 from pydantic import BaseModel, AnyUrl
-from typing import List
+from typing import List, Literal
 from dotenv import load_dotenv
 import os
 
@@ -30,10 +30,41 @@ class Config(BaseModel):
     MAX_UPLOAD_FILES: int
     STORAGE_PATH: Path
     IMPORTS_PATH: Path
+    STORAGE_LAYOUT: Literal["collections", "blobs"]
+    UPLOAD_WINDOW_SIZE: int
+    UPLOAD_MEMORY_BUDGET: int
+    MAX_IMAGE_PIXELS: int
+    DECODE_PIXEL_BUDGET: int
+    INGESTION_WORKER_ENABLED: bool
+    INGESTION_WORKER_JOBS: int
+    INGESTION_WINDOW_SIZE: int
+    INGESTION_POLL_INTERVAL: float
+    INGESTION_JOB_LEASE: int
+    INGESTION_MAX_ATTEMPTS: int
+    GC_ENABLED: bool
+    GC_BATCH_SIZE: int
+    GC_INTERVAL: float
+    GC_RECONCILE_INTERVAL: float
+    GC_RECONCILE_DIRECTORIES: int
+    GC_GRACE_PERIOD: int
+    IMAGE_CACHE_CONTROL: str
+    DERIVATIVE_WIDTHS: List[int]
+    DERIVATIVE_QUALITY: int
+    DERIVATIVE_CACHE_MAX_BYTES: int
+    DERIVATIVE_EAGER_WIDTH: int
+    DERIVATIVE_EAGER_FORMAT: Literal["webp", "jpeg", "png"]
 
     # Similarity Parameters
     PHASH_BIT_DIFF_TOLERANCE: int
     EMBEDDING_SIMILARITY_THRESHOLD: float
+    EMBEDDING_KNN_K: int
+    EMBEDDING_HNSW_EF_SEARCH: int
+    EMBEDDING_HNSW_ITERATIVE_SCAN: str
+
+    # Fingerprint Cache
+    FINGERPRINT_CACHE_MAX_BYTES: int
+    FINGERPRINT_CACHE_TTL: int
+    FINGERPRINT_CACHE_EMBEDDING_DTYPE: Literal["float32", "float16"]
 
     # Triton
     TRITON_HOST: str
@@ -41,6 +72,31 @@ class Config(BaseModel):
     TRITON_GRPC_PORT: int
     TRITON_METRICS_PORT: int
     TRITON_URL: str
+    TRITON_INFER_TIMEOUT: float
+    TRITON_HEALTH_TIMEOUT: float
+    TRITON_MAX_IN_FLIGHT: int
+    TRITON_SHARED_MEMORY: bool
+    TRITON_SHM_MAX_BATCH: int
+    TRITON_SHM_POOL_SIZE: int
+
+    # Embedding Backend
+    EMBEDDING_BACKEND: Literal["triton", "onnxruntime"]
+    EMBEDDING_INPUT_FORMAT: Literal["float32", "uint8"]
+    ONNX_MODEL_PATH: Path
+    ONNX_INTRA_OP_THREADS: int
+    ONNX_INTER_OP_THREADS: int
+    ONNX_SESSION_POOL_SIZE: int
+    EMBEDDING_HEALTH_INTERVAL: float
+    EMBEDDING_HEALTH_MAX_BACKOFF: float
+
+    # Preprocessing
+    PREPROCESS_WORKERS: int
+    PREPROCESS_MAX_BATCH: int
+    PREPROCESS_BUFFERS: int
+
+    # Embedding Batching
+    EMBEDDING_MAX_BATCH_SIZE: int
+    EMBEDDING_MAX_QUEUE_DELAY_MS: float
 
     # FastAPI
     FASTAPI_HOST: str
@@ -68,15 +124,67 @@ config = Config(
     MAX_UPLOAD_FILES=int(os.environ["MAX_UPLOAD_FILES"]),
     STORAGE_PATH=Path(os.environ["STORAGE_PATH"]),
     IMPORTS_PATH=Path(os.environ["IMPORTS_PATH"]),
+    STORAGE_LAYOUT=os.environ["STORAGE_LAYOUT"],
+    UPLOAD_WINDOW_SIZE=int(os.environ["UPLOAD_WINDOW_SIZE"]),
+    UPLOAD_MEMORY_BUDGET=humanfriendly.parse_size(os.environ["UPLOAD_MEMORY_BUDGET"]),
+    MAX_IMAGE_PIXELS=humanfriendly.parse_size(os.environ["MAX_IMAGE_PIXELS"]),
+    DECODE_PIXEL_BUDGET=humanfriendly.parse_size(os.environ["DECODE_PIXEL_BUDGET"]),
+    INGESTION_WORKER_ENABLED=os.environ["INGESTION_WORKER_ENABLED"],
+    INGESTION_WORKER_JOBS=int(os.environ["INGESTION_WORKER_JOBS"]),
+    INGESTION_WINDOW_SIZE=int(os.environ["INGESTION_WINDOW_SIZE"]),
+    INGESTION_POLL_INTERVAL=float(os.environ["INGESTION_POLL_INTERVAL"]),
+    INGESTION_JOB_LEASE=int(os.environ["INGESTION_JOB_LEASE"]),
+    INGESTION_MAX_ATTEMPTS=int(os.environ["INGESTION_MAX_ATTEMPTS"]),
+    GC_ENABLED=os.environ["GC_ENABLED"],
+    GC_BATCH_SIZE=int(os.environ["GC_BATCH_SIZE"]),
+    GC_INTERVAL=float(os.environ["GC_INTERVAL"]),
+    GC_RECONCILE_INTERVAL=float(os.environ["GC_RECONCILE_INTERVAL"]),
+    GC_RECONCILE_DIRECTORIES=int(os.environ["GC_RECONCILE_DIRECTORIES"]),
+    GC_GRACE_PERIOD=int(os.environ["GC_GRACE_PERIOD"]),
+    IMAGE_CACHE_CONTROL=os.environ["IMAGE_CACHE_CONTROL"],
+    DERIVATIVE_WIDTHS=[int(width) for width in os.environ["DERIVATIVE_WIDTHS"].split(",")],
+    DERIVATIVE_QUALITY=int(os.environ["DERIVATIVE_QUALITY"]),
+    DERIVATIVE_CACHE_MAX_BYTES=humanfriendly.parse_size(os.environ["DERIVATIVE_CACHE_MAX_BYTES"]),
+    DERIVATIVE_EAGER_WIDTH=int(os.environ["DERIVATIVE_EAGER_WIDTH"]),
+    DERIVATIVE_EAGER_FORMAT=os.environ["DERIVATIVE_EAGER_FORMAT"],
 
     PHASH_BIT_DIFF_TOLERANCE=int(os.environ["PHASH_BIT_DIFF_TOLERANCE"]),
     EMBEDDING_SIMILARITY_THRESHOLD=float(os.environ["EMBEDDING_SIMILARITY_THRESHOLD"]),
+    EMBEDDING_KNN_K=int(os.environ["EMBEDDING_KNN_K"]),
+    EMBEDDING_HNSW_EF_SEARCH=int(os.environ["EMBEDDING_HNSW_EF_SEARCH"]),
+    EMBEDDING_HNSW_ITERATIVE_SCAN=os.environ["EMBEDDING_HNSW_ITERATIVE_SCAN"],
+
+    FINGERPRINT_CACHE_MAX_BYTES=humanfriendly.parse_size(os.environ["FINGERPRINT_CACHE_MAX_BYTES"]),
+    FINGERPRINT_CACHE_TTL=int(os.environ["FINGERPRINT_CACHE_TTL"]),
+    FINGERPRINT_CACHE_EMBEDDING_DTYPE=os.environ["FINGERPRINT_CACHE_EMBEDDING_DTYPE"],
 
     TRITON_HOST=os.environ["TRITON_HOST"],
     TRITON_HTTP_PORT=int(os.environ["TRITON_HTTP_PORT"]),
     TRITON_GRPC_PORT=int(os.environ["TRITON_GRPC_PORT"]),
     TRITON_METRICS_PORT=int(os.environ["TRITON_METRICS_PORT"]),
     TRITON_URL=os.environ["TRITON_URL"],
+    TRITON_INFER_TIMEOUT=float(os.environ["TRITON_INFER_TIMEOUT"]),
+    TRITON_HEALTH_TIMEOUT=float(os.environ["TRITON_HEALTH_TIMEOUT"]),
+    TRITON_MAX_IN_FLIGHT=int(os.environ["TRITON_MAX_IN_FLIGHT"]),
+    TRITON_SHARED_MEMORY=os.environ["TRITON_SHARED_MEMORY"],
+    TRITON_SHM_MAX_BATCH=int(os.environ["TRITON_SHM_MAX_BATCH"]),
+    TRITON_SHM_POOL_SIZE=int(os.environ["TRITON_SHM_POOL_SIZE"]),
+
+    EMBEDDING_BACKEND=os.environ["EMBEDDING_BACKEND"],
+    EMBEDDING_INPUT_FORMAT=os.environ["EMBEDDING_INPUT_FORMAT"],
+    ONNX_MODEL_PATH=Path(os.environ["ONNX_MODEL_PATH"]),
+    ONNX_INTRA_OP_THREADS=int(os.environ["ONNX_INTRA_OP_THREADS"]),
+    ONNX_INTER_OP_THREADS=int(os.environ["ONNX_INTER_OP_THREADS"]),
+    ONNX_SESSION_POOL_SIZE=int(os.environ["ONNX_SESSION_POOL_SIZE"]),
+    EMBEDDING_HEALTH_INTERVAL=float(os.environ["EMBEDDING_HEALTH_INTERVAL"]),
+    EMBEDDING_HEALTH_MAX_BACKOFF=float(os.environ["EMBEDDING_HEALTH_MAX_BACKOFF"]),
+
+    PREPROCESS_WORKERS=int(os.environ["PREPROCESS_WORKERS"]),
+    PREPROCESS_MAX_BATCH=int(os.environ["PREPROCESS_MAX_BATCH"]),
+    PREPROCESS_BUFFERS=int(os.environ["PREPROCESS_BUFFERS"]),
+
+    EMBEDDING_MAX_BATCH_SIZE=int(os.environ["EMBEDDING_MAX_BATCH_SIZE"]),
+    EMBEDDING_MAX_QUEUE_DELAY_MS=float(os.environ["EMBEDDING_MAX_QUEUE_DELAY_MS"]),
 
     FASTAPI_HOST=os.environ["FASTAPI_HOST"],
     FASTAPI_PORT=int(os.environ["FASTAPI_PORT"]),
@@ -1,4 +1,6 @@
 from .base import Base
-from .models import collection, image, user, refresh_token, image_fingerprint
+from .models import blob, collection, file_tombstone, image, user, refresh_token, image_fingerprint, ingestion_job
 
-__all__ = ["Base", "collection", "image", "user", "refresh_token", "image_fingerprint"]
+__all__ = [
+    "Base", "blob", "collection", "file_tombstone", "image", "user", "refresh_token", "image_fingerprint", "ingestion_job"
+]
@@ -0,0 +1,15 @@
+import sqlalchemy as sa
+
+from finder.db.base import Base
+
+
+class Blob(Base):
+    # A stored file in the content-addressed layout, shared by every image with the same bytes.
+    # `ref_count` is maintained by the `images_blob_ref_count` trigger; rows at 0 are unreferenced.
+    __tablename__ = "blobs"
+
+    sha256 = sa.Column(sa.String(64), primary_key=True)
+    size_bytes = sa.Column(sa.BigInteger, nullable=False)
+    ref_count = sa.Column(sa.Integer, nullable=False, server_default=sa.text("0"))
+
+    created_at = sa.Column(sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False)
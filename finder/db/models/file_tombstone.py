@@ -0,0 +1,15 @@
+import sqlalchemy as sa
+
+from finder.db.base import Base
+
+
+class FileTombstone(Base):
+    # A stored file to delete, written by triggers in the same transaction as the row that referenced it
+    # (see `GarbageCollector`). Exactly one of `path` (relative to STORAGE_PATH) and `blob_sha256` is set.
+    __tablename__ = "file_tombstones"
+
+    id = sa.Column(sa.BigInteger, sa.Identity(), primary_key=True)
+    path = sa.Column(sa.Text, nullable=True)
+    blob_sha256 = sa.Column(sa.String(64), nullable=True)
+
+    created_at = sa.Column(sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False)
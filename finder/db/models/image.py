@@ -6,6 +6,12 @@ from finder.db.base import Base
 
 class Image(Base):
     __tablename__ = "images"
+    # Keyset pagination of GET /images/ in (created_at, id) order; the collection index also serves lookups by
+    # collection_id alone
+    __table_args__ = (
+        sa.Index("ix_images_owner_id_created_at_id", "owner_id", "created_at", "id"),
+        sa.Index("ix_images_collection_id_created_at_id", "collection_id", "created_at", "id"),
+    )
 
     id = sa.Column(sa.UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
 
@@ -18,14 +24,15 @@ class Image(Base):
     collection_id = sa.Column(
         sa.UUID(as_uuid=True),
         sa.ForeignKey("collections.id", ondelete="CASCADE"),
-        nullable=False,
-        index=True
+        nullable=False
     )
 
     stored_filename = sa.Column(sa.String(256), nullable=False)
     original_filename = sa.Column(sa.String(256), nullable=False)
     mime_type = sa.Column(sa.String(100), nullable=False)
     size_bytes = sa.Column(sa.BigInteger, nullable=False)
+    # Set when the file is stored in the content-addressed layout (see `finder.utils.storage.stored_path`)
+    blob_sha256 = sa.Column(sa.String(64), sa.ForeignKey("blobs.sha256"), nullable=True, index=True)
 
     tags = sa.Column(sa.ARRAY(sa.String), nullable=False, server_default="{}")
 
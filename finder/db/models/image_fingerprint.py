@@ -1,10 +1,25 @@
+from typing import Tuple
+
 import sqlalchemy as sa
 from pgvector.sqlalchemy import Vector
+from sqlalchemy import event, Connection
+from sqlalchemy.orm import Mapper
+
 from finder.db.base import Base
+from finder.utils.hashing import phash_bands
 
 
 class ImageFingerprint(Base):
     __tablename__ = "image_fingerprints"
+    __table_args__ = (
+        sa.Index(
+            "ix_image_fingerprints_embedding_hnsw",
+            "embedding",
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+            postgresql_ops={"embedding": "vector_cosine_ops"},
+        ),
+    )
 
     image_id = sa.Column(
         sa.UUID(as_uuid=True),
@@ -14,7 +29,31 @@ class ImageFingerprint(Base):
 
     sha256 = sa.Column(sa.String(64), index=True, nullable=False)
     phash = sa.Column(sa.BigInteger, index=True, nullable=False)
+    phash_band_0 = sa.Column(sa.SmallInteger, index=True, nullable=False)
+    phash_band_1 = sa.Column(sa.SmallInteger, index=True, nullable=False)
+    phash_band_2 = sa.Column(sa.SmallInteger, index=True, nullable=False)
+    phash_band_3 = sa.Column(sa.SmallInteger, index=True, nullable=False)
+    phash_band_4 = sa.Column(sa.SmallInteger, index=True, nullable=False)
+    phash_band_5 = sa.Column(sa.SmallInteger, index=True, nullable=False)
     embedding = sa.Column(Vector(512), nullable=False)
 
     created_at = sa.Column(sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False)
     updated_at = sa.Column(sa.DateTime(timezone=True), server_default=sa.func.now(), onupdate=sa.func.now(), nullable=False)
+
+    @classmethod
+    def phash_band_columns(cls) -> Tuple[sa.Column, ...]:
+        return (
+            cls.phash_band_0,
+            cls.phash_band_1,
+            cls.phash_band_2,
+            cls.phash_band_3,
+            cls.phash_band_4,
+            cls.phash_band_5,
+        )
+
+
+@event.listens_for(ImageFingerprint, "before_insert")
+@event.listens_for(ImageFingerprint, "before_update")
+def set_phash_bands(_mapper: Mapper, _connection: Connection, target: ImageFingerprint):
+    for column, band in zip(ImageFingerprint.phash_band_columns(), phash_bands(target.phash)):
+        setattr(target, column.key, band)
@@ -0,0 +1,44 @@
+import uuid
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+
+from finder.db.base import Base
+
+
+class IngestionJob(Base):
+    # An `?async=true` upload; its files are kept under `finder.utils.storage.job_path` until it finishes
+    __tablename__ = "ingestion_jobs"
+    __table_args__ = (
+        sa.Index("ix_ingestion_jobs_status_created_at", "status", "created_at"),
+    )
+
+    id = sa.Column(sa.UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+
+    owner_id = sa.Column(
+        sa.UUID(as_uuid=True),
+        sa.ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True
+    )
+
+    collection_id = sa.Column(
+        sa.UUID(as_uuid=True),
+        sa.ForeignKey("collections.id", ondelete="CASCADE"),
+        nullable=False
+    )
+
+    detect_duplicates = sa.Column(sa.Boolean, nullable=False, server_default=sa.text("false"))
+    # queued -> running -> done | failed
+    status = sa.Column(sa.String(16), nullable=False, server_default="queued")
+    attempts = sa.Column(sa.Integer, nullable=False, server_default=sa.text("0"))
+
+    # Uploaded files in order: filename, content_type, size and sha256
+    files = sa.Column(JSONB, nullable=False)
+    # Per-file outcome and duplicate map, set once the job is done
+    result = sa.Column(JSONB, nullable=True)
+    error = sa.Column(sa.Text, nullable=True)
+
+    created_at = sa.Column(sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False)
+    updated_at = sa.Column(sa.DateTime(timezone=True), server_default=sa.func.now(), onupdate=sa.func.now(), nullable=False)
+    started_at = sa.Column(sa.DateTime(timezone=True), nullable=True)
+    finished_at = sa.Column(sa.DateTime(timezone=True), nullable=True)
@@ -1,15 +1,19 @@
+import json
 import uuid
 from typing import List, Optional
 
 import sqlalchemy as sa
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from finder.db.models.collection import Collection
 from finder.db.models.user import User
-from finder.db.session import get_db
+from finder.db.session import get_db, SessionLocal
 from finder.services.auth_service import AuthService
+from finder.services.fingerprint_cache import FingerprintCache
+from finder.utils.duplicate_sweep import sweep_collection
 
 router = APIRouter(prefix="/collections", tags=["collections"])
 
@@ -88,6 +92,7 @@ async def delete_collection(
     collection_id: uuid.UUID,
     db: AsyncSession = Depends(get_db),
     user: User = Depends(AuthService.get_current_user),
+    fingerprint_cache: FingerprintCache = Depends(FingerprintCache.get_instance),
 ):
     collection = await db.scalar(
         sa.select(Collection).where(
@@ -101,4 +106,32 @@ async def delete_collection(
 
     await db.delete(collection)
     await db.commit()
+    fingerprint_cache.invalidate(collection_id)
     return None
+
+
+@router.get("/{collection_id}/duplicates", status_code=status.HTTP_200_OK)
+async def get_collection_duplicates(
+    collection_id: uuid.UUID,
+    db: AsyncSession = Depends(get_db),
+    user: User = Depends(AuthService.get_current_user),
+):
+    collection = await db.scalar(
+        sa.select(Collection).where(
+            Collection.id == collection_id,
+            Collection.owner_id == user.id
+        )
+    )
+
+    if not collection:
+        raise HTTPException(status_code=404, detail="Collection not found.")
+
+    owner_id = user.id
+
+    async def stream_groups():
+        # The sweep outlives the request's session, so it gets its own
+        async with SessionLocal() as sweep_db:
+            async for image_ids in sweep_collection(sweep_db, owner_id, collection_id):
+                yield json.dumps({"image_ids": [str(image_id) for image_id in image_ids]}) + "\n"
+
+    return StreamingResponse(stream_groups(), media_type="application/x-ndjson")
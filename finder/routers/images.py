@@ -1,15 +1,19 @@
+import asyncio
+import base64
+import datetime as dt
+import json
 import uuid
 from collections import defaultdict
-from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Literal, Optional
+from typing import Any, Dict, List, Literal, Optional, Tuple
 
-import numpy as np
 import sqlalchemy as sa
 from PIL import UnidentifiedImageError
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Query, Response
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Query, Response, Request
 from fastapi import status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from finder.config import config
@@ -17,83 +21,157 @@ from finder.db.models.collection import Collection
 from finder.db.models.image import Image
 from finder.db.models.image_fingerprint import ImageFingerprint
 from finder.db.models.user import User
-from finder.db.session import get_db
+from finder.db.session import get_db, SessionLocal
 from finder.services.auth_service import AuthService
-from finder.services.embedding_service import EmbeddingService
-from finder.utils.duplicates import detect_duplicate_sha256, detect_duplicate_phash, detect_duplicate_embedding
-from finder.utils.files import load_images_from_bytes, read_files_from_upload_file, write_files_bytes, delete_files, \
-    read_file
-from finder.utils.hashing import sha256_many, phash_many
+from finder.services.derivative_cache import DerivativeCache
+from finder.services.embedding_service import EmbeddingService, EmbeddingUnavailableError
+from finder.services.fingerprint_cache import FingerprintCache
+from finder.services.ingestion_service import IngestItem, IngestionService
+from finder.utils.derivatives import DERIVATIVE_MEDIA_TYPES, DerivativeFormat
+from finder.utils.files import FileTooLargeError, spool_upload_files, delete_files, link_files
+from finder.utils.http import file_response
+from finder.utils.preprocess import ImageTooLargeError, check_images
+from finder.utils.storage import image_path, stored_path
 
 router = APIRouter(prefix="/images", tags=["images"])
 
+STREAM_PARTITION_SIZE = 1000
 
-@dataclass
-class FileData:
-    uuid: uuid.UUID
-    file: UploadFile
-    stored_filename: str
-    sha256: str
-    phash: bytes
-    file_content: bytes
-    embedding: Optional[np.ndarray] = None
+IMAGE_SUMMARY_COLUMNS = (
+    Image.id,
+    Image.collection_id,
+    Image.original_filename,
+    Image.mime_type,
+    Image.size_bytes,
+    Image.tags,
+    Image.created_at,
+)
 
 
 @router.get("/{image_id}", status_code=status.HTTP_200_OK)
 async def get_image(
+    request: Request,
     image_id: uuid.UUID,
+    w: Optional[int] = Query(None),
+    format_: Optional[DerivativeFormat] = Query(None, alias="format"),
     db: AsyncSession = Depends(get_db),
     user: User = Depends(AuthService.get_current_user),
+    derivative_cache: DerivativeCache = Depends(DerivativeCache.get_instance),
 ):
-    image: Optional[Image] = await db.scalar(
-        sa.select(Image).where(Image.id == image_id, Image.owner_id == user.id)
-    )
+    if (w is not None or format_ is not None) and w not in derivative_cache.widths:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            detail=f"Unsupported width, expected one of {derivative_cache.widths}."
+        )
+
+    row = (await db.execute(
+        sa.select(Image, ImageFingerprint.sha256)
+        .join(ImageFingerprint, ImageFingerprint.image_id == Image.id)
+        .where(Image.id == image_id, Image.owner_id == user.id)
+    )).first()
 
-    if image is None:
+    if row is None:
         raise HTTPException(
             status.HTTP_404_NOT_FOUND,
             detail="The requested file was not found, or you do not have permission from the owner to access it."
         )
 
-    image_path = config.STORAGE_PATH / "collections" / str(image.owner_id) / str(image.collection_id) / str(image.stored_filename)
+    image, sha256 = row
+    path = stored_path(image)
+    if w is None:
+        # Stored files never change, so their content hash is a strong validator
+        return await file_response(request, path, media_type=image.mime_type, etag=f'"{sha256}"')
+
+    format_ = format_ or "webp"
     try:
-        bytes_ = await read_file(image_path)
-    except (FileNotFoundError, PermissionError):
-        raise HTTPException(
-            status.HTTP_404_NOT_FOUND,
-            detail="The requested file was not found."
-        )
+        derivative_path = await derivative_cache.get(path, sha256, w, format_)
+    except FileNotFoundError:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="The requested file was not found.")
+    except (ImageTooLargeError, UnidentifiedImageError):
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, detail="The image cannot be resized.")
+
+    return await file_response(
+        request, derivative_path, media_type=DERIVATIVE_MEDIA_TYPES[format_], etag=f'"{sha256}-{w}.{format_}"'
+    )
 
-    return Response(content=bytes_, media_type=image.mime_type)
+
+def _encode_cursor(created_at: dt.datetime, image_id: uuid.UUID) -> str:
+    payload = json.dumps([created_at.isoformat(), str(image_id)]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[dt.datetime, uuid.UUID]:
+    try:
+        created_at, image_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return dt.datetime.fromisoformat(created_at), uuid.UUID(image_id)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid cursor.") from e
+
+
+def _image_summary(row: sa.Row) -> Dict[str, Any]:
+    return {
+        "id": str(row.id),
+        "collection_id": str(row.collection_id),
+        "original_filename": row.original_filename,
+        "mime_type": row.mime_type,
+        "size_bytes": row.size_bytes,
+        "tags": row.tags,
+        "created_at": row.created_at.isoformat(),
+    }
 
 
 @router.get("/", status_code=status.HTTP_200_OK)
 async def get_images(
+    collection_id: Optional[uuid.UUID] = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None),
+    stream: bool = Query(False),
     db: AsyncSession = Depends(get_db),
     user: User = Depends(AuthService.get_current_user),
 ):
-    result = await db.execute(
-        sa.select(Image.id, Collection)
-        .join(Collection, Image.collection_id == Collection.id)
+    # Newest first; the (created_at, id) keyset walks ix_images_owner_id_created_at_id or
+    # ix_images_collection_id_created_at_id backwards, so every page costs the same however deep it is
+    stmt = (
+        sa.select(*IMAGE_SUMMARY_COLUMNS)
         .where(Image.owner_id == user.id)
+        .order_by(Image.created_at.desc(), Image.id.desc())
     )
-    rows = result.all()
+    if collection_id is not None:
+        stmt = stmt.where(Image.collection_id == collection_id)
+    if cursor is not None:
+        stmt = stmt.where(sa.tuple_(Image.created_at, Image.id) < sa.tuple_(*_decode_cursor(cursor)))
+
+    if stream:
+        async def stream_images():
+            # Everything after the cursor, one image per line, read through a server-side cursor
+            async with SessionLocal() as stream_db:
+                result = await stream_db.stream(stmt)
+                async for rows in result.partitions(STREAM_PARTITION_SIZE):
+                    yield "".join(json.dumps(_image_summary(row)) + "\n" for row in rows)
+
+        return StreamingResponse(stream_images(), media_type="application/x-ndjson")
 
-    collections_map = defaultdict(list)
-    for image_id, collection in rows:
-        collections_map[str(collection.id)].append(str(image_id))
+    rows = (await db.execute(stmt.limit(limit + 1))).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1].created_at, rows[-1].id)
 
-    return dict(collections_map)
+    return {"images": [_image_summary(row) for row in rows], "next_cursor": next_cursor}
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
 async def upload(
+        request: Request,
+        response: Response,
         files: List[UploadFile] = File(...),
         target_collection_id: uuid.UUID | Literal["DEFAULT"] = Query("DEFAULT"),
         detect_duplicates: bool = Query(False),
+        async_: bool = Query(False, alias="async"),
         db: AsyncSession = Depends(get_db),
         user: User = Depends(AuthService.get_current_user),
-        embedder: EmbeddingService = Depends(EmbeddingService.get_instance)
+        embedder: EmbeddingService = Depends(EmbeddingService.get_instance),
+        ingestion: IngestionService = Depends(IngestionService.get_instance)
 ):
     if not files or not files[0].filename:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "No files were provided.")
@@ -101,7 +179,8 @@ async def upload(
     if len(files) > config.MAX_UPLOAD_FILES:
         raise HTTPException(status.HTTP_413_CONTENT_TOO_LARGE, "Too many files uploaded.")
 
-    if not embedder.is_running():
+    # Async uploads are kept queued until the embedder is back
+    if not async_ and not embedder.healthy:
         raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "Upload service is currently not available.")
 
     for file in files:
@@ -121,13 +200,27 @@ async def upload(
     if not collection_id:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Collection not found.")
 
-    upload_path = config.STORAGE_PATH / "collections" / str(user.id) / str(collection_id)
-    upload_path.mkdir(exist_ok=True, parents=True)
-
-    file_contents = await read_files_from_upload_file(files, config.MAX_FILE_SIZE)
+    # Files are streamed to the storage volume first, so no request holds whole uploads in memory
+    try:
+        spooled = await spool_upload_files(files, config.MAX_FILE_SIZE)
+    except FileTooLargeError as e:
+        raise HTTPException(status.HTTP_413_CONTENT_TOO_LARGE, str(e)) from e
 
+    items = [IngestItem(file.filename, file.content_type, spool) for file, spool in zip(files, spooled)]
     try:
-        pil_images = await load_images_from_bytes(file_contents, [file.filename for file in files])
+        # Header-only checks reject unreadable and oversized images before any decode or queueing
+        headers = await asyncio.to_thread(
+            check_images, [spool.path for spool in spooled], [file.filename for file in files]
+        )
+        for item, header in zip(items, headers):
+            item.header = header
+
+        if async_:
+            job_id = await ingestion.enqueue(db, user.id, collection_id, items, detect_duplicates)
+            response.status_code = status.HTTP_202_ACCEPTED
+            return {"status": "queued", "job_id": job_id}
+
+        result = await ingestion.ingest(db, user.id, collection_id, items, detect_duplicates, request=request)
 
     except UnidentifiedImageError as e:
         raise HTTPException(
@@ -135,115 +228,59 @@ async def upload(
             f"Failed to read image: {e}. The file may be corrupted."
         ) from e
 
-    sha256_list = await sha256_many(file_contents)
-    phash_list = await phash_many(pil_images, hash_size=8)
-    embeddings = await embedder.embed(pil_images)
-
-    file_datas: List[FileData] = []
-    for file, pil_image, sha256, phash, content, embedding in zip(
-            files, pil_images, sha256_list, phash_list, file_contents, embeddings):
-        uuid_ = uuid.uuid4()
-        file_datas.append(FileData(
-            uuid=uuid_,
-            file=file,
-            stored_filename=f"{uuid_}{Path(file.filename).suffix}",
-            sha256=sha256,
-            phash=phash,
-            embedding=embedding,
-            file_content=content
-        ))
-
-    images: List[Image] = []
-    image_fingerprints: List[ImageFingerprint] = []
-    for data in file_datas:
-        images.append(
-            Image(
-                id=data.uuid,
-                owner_id=user.id,
-                collection_id=collection_id,
-                stored_filename=data.stored_filename,
-                original_filename=data.file.filename,
-                mime_type=data.file.content_type,
-                size_bytes=len(data.file_content),
-            )
-        )
-        image_fingerprints.append(
-            ImageFingerprint(
-                image_id=data.uuid,
-                sha256=data.sha256,
-                phash=int.from_bytes(data.phash, signed=True),
-                embedding=data.embedding,
-            )
-        )
+    except ImageTooLargeError as e:
+        raise HTTPException(status.HTTP_413_CONTENT_TOO_LARGE, str(e)) from e
 
-    try:
-        db.add_all(images)
-        db.add_all(image_fingerprints)
-        await db.flush()
-
-        duplicate_map = {}
-        if detect_duplicates:
-            remaining = []
-            for data in file_datas:
-                dup = (
-                        await detect_duplicate_sha256(db, user.id, collection_id, data.uuid)
-                        or await detect_duplicate_phash(db, user.id, collection_id, data.uuid)
-                        or await detect_duplicate_embedding(db, user.id, collection_id, data.uuid)
-                )
+    except EmbeddingUnavailableError as e:
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "Upload service is currently not available.") from e
 
-                if dup:
-                    duplicate_map[str(data.uuid)] = str(dup)
+    except HTTPException:
+        raise
 
-                else:
-                    remaining.append(data)
+    except Exception as e:
+        raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR) from e
 
-            file_datas = remaining
+    finally:
+        await delete_files([spool.path for spool in spooled])
 
-        if not file_datas:
-            await db.rollback()
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail={"message": "All files already exist in the target collection.", "duplicates": duplicate_map}
-            )
+    if not result.files:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": "All files already exist in the target collection.", "duplicates": result.duplicates}
+        )
 
-        for image in images:
-            if str(image.id) in duplicate_map:
-                db.expunge(image)
+    if detect_duplicates and result.duplicates:
+        return {
+            "status": "partial",
+            "files": result.files,
+            "duplicates": result.duplicates
+        }
 
-        for image_fingerprint in image_fingerprints:
-            if str(image_fingerprint.image_id) in duplicate_map:
-                db.expunge(image_fingerprint)
+    return {
+        "status": "created",
+        "files": result.files
+    }
 
-        await db.commit()
 
-        await write_files_bytes([
-            (data.file_content, upload_path / data.stored_filename)
-            for data in file_datas
-        ])
+class ImageUpdate(BaseModel):
+    tags: Optional[List[str]] = None
 
-        if detect_duplicates and duplicate_map:
-            return {
-                "status": "partial",
-                "files": [data.uuid for data in file_datas],
-                "duplicates": duplicate_map
-            }
 
-        return {
-            "status": "created",
-            "files": [data.uuid for data in file_datas]
-        }
+class ImageFilter(BaseModel):
+    collection_id: Optional[uuid.UUID] = None
+    tags: Optional[List[str]] = None
 
-    except HTTPException:
-        raise
 
-    except Exception as e:
-        await db.rollback()
-        await delete_files([upload_path / data.stored_filename for data in file_datas])
-        raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR) from e
+class BulkOperation(BaseModel):
+    action: Literal["delete", "set_tags", "add_tags", "remove_tags", "move"]
+    ids: Optional[List[uuid.UUID]] = None
+    filter: Optional[ImageFilter] = None
+    tags: Optional[List[str]] = None
+    target_collection_id: Optional[uuid.UUID | Literal["DEFAULT"]] = None
 
 
-class ImageUpdate(BaseModel):
-    tags: Optional[List[str]] = None
+class BulkRequest(BaseModel):
+    operations: List[BulkOperation]
 
 
 @router.patch("/{image_id}")
@@ -278,6 +315,7 @@ async def delete_image(
     image_id: uuid.UUID,
     db: AsyncSession = Depends(get_db),
     user: User = Depends(AuthService.get_current_user),
+    fingerprint_cache: FingerprintCache = Depends(FingerprintCache.get_instance),
 ):
     image = await db.scalar(
         sa.select(Image).where(
@@ -291,5 +329,140 @@ async def delete_image(
             detail="File not found."
         )
 
+    collection_id = image.collection_id
     await db.delete(image)
     await db.commit()
+    fingerprint_cache.discard(collection_id, [image_id])
+
+
+def _bulk_conditions(owner_id: uuid.UUID, operation: BulkOperation) -> List[sa.ColumnElement[bool]]:
+    conditions = [Image.owner_id == owner_id]
+    if operation.ids is not None:
+        # A single array parameter, however many ids are given
+        conditions.append(Image.id == sa.any_(sa.literal(operation.ids, postgresql.ARRAY(sa.UUID(as_uuid=True)))))
+        return conditions
+
+    if operation.filter.collection_id is not None:
+        conditions.append(Image.collection_id == operation.filter.collection_id)
+    if operation.filter.tags:
+        conditions.append(Image.tags.op("@>")(sa.literal(operation.filter.tags, postgresql.ARRAY(sa.String))))
+    return conditions
+
+
+def _bulk_tags(operation: BulkOperation) -> sa.ColumnElement:
+    tags = sa.literal(list(dict.fromkeys(operation.tags)), postgresql.ARRAY(sa.String))
+    if operation.action == "set_tags":
+        return tags
+
+    if operation.action == "add_tags":
+        tag = sa.func.unnest(tags).column_valued("tag")
+        return Image.tags + sa.func.array(sa.select(tag).where(tag != sa.all_(Image.tags)).scalar_subquery())
+
+    tag = sa.func.unnest(Image.tags).column_valued("tag")
+    return sa.func.array(sa.select(tag).where(tag != sa.all_(tags)).scalar_subquery())
+
+
+@router.post("/bulk", status_code=status.HTTP_200_OK)
+async def bulk_update_images(
+    bulk: BulkRequest,
+    db: AsyncSession = Depends(get_db),
+    user: User = Depends(AuthService.get_current_user),
+    fingerprint_cache: FingerprintCache = Depends(FingerprintCache.get_instance),
+):
+    targets: Dict[uuid.UUID | Literal["DEFAULT"], uuid.UUID] = {}
+    for operation in bulk.operations:
+        if (operation.ids is None) == (operation.filter is None):
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, "Each operation needs either 'ids' or 'filter'.")
+
+        if operation.filter is not None and operation.filter.collection_id is None and not operation.filter.tags:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, "Filters need a 'collection_id' or 'tags'.")
+
+        if operation.action.endswith("_tags") and operation.tags is None:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, f"'{operation.action}' needs 'tags'.")
+
+        if operation.action == "move":
+            if operation.target_collection_id is None:
+                raise HTTPException(status.HTTP_400_BAD_REQUEST, "'move' needs 'target_collection_id'.")
+
+            if operation.target_collection_id not in targets:
+                stmt = sa.select(Collection.id).where(Collection.owner_id == user.id)
+                if operation.target_collection_id == "DEFAULT":
+                    stmt = stmt.where(Collection.is_default.is_(True))
+                else:
+                    stmt = stmt.where(Collection.id == operation.target_collection_id)
+
+                collection_id = await db.scalar(stmt)
+                if not collection_id:
+                    raise HTTPException(status.HTTP_404_NOT_FOUND, "Collection not found.")
+                targets[operation.target_collection_id] = collection_id
+
+    results = []
+    discarded: Dict[uuid.UUID, List[uuid.UUID]] = defaultdict(list)
+    invalidated = set()
+    # Per moved image with its own file: where the file was before this request and where its row points now
+    sources: Dict[uuid.UUID, Path] = {}
+    destinations: Dict[uuid.UUID, Path] = {}
+    links = []
+    try:
+        for operation in bulk.operations:
+            conditions = _bulk_conditions(user.id, operation)
+
+            if operation.action == "delete":
+                # Stored files are tombstoned by the `images_file_tombstone` trigger
+                rows = (await db.execute(
+                    sa.delete(Image).where(*conditions).returning(Image.id, Image.collection_id)
+                )).all()
+                for image_id, collection_id in rows:
+                    discarded[collection_id].append(image_id)
+                    destinations.pop(image_id, None)
+
+            elif operation.action == "move":
+                target_id = targets[operation.target_collection_id]
+                # The subquery returns each row's collection before the update; fingerprints follow by image_id
+                source = (
+                    sa.select(Image.id, Image.collection_id)
+                    .where(*conditions, Image.collection_id != target_id)
+                    .with_for_update()
+                    .subquery("source")
+                )
+                rows = (await db.execute(
+                    sa.update(Image)
+                    .where(Image.id == source.c.id)
+                    .values(collection_id=target_id)
+                    .returning(Image.id, source.c.collection_id, Image.stored_filename, Image.blob_sha256)
+                )).all()
+
+                invalidated.add(target_id)
+                for image_id, collection_id, stored_filename, blob_sha256 in rows:
+                    discarded[collection_id].append(image_id)
+                    if blob_sha256 is None:
+                        sources.setdefault(image_id, image_path(user.id, collection_id, stored_filename))
+                        destinations[image_id] = image_path(user.id, target_id, stored_filename)
+
+            else:
+                rows = (await db.execute(
+                    sa.update(Image).where(*conditions).values(tags=_bulk_tags(operation)).returning(Image.id)
+                )).all()
+
+            results.append({"action": operation.action, "image_ids": [row[0] for row in rows]})
+
+        links = [
+            (sources[image_id], destination) for image_id, destination in destinations.items()
+            if destination != sources[image_id]
+        ]
+        await link_files(links)
+        await db.commit()
+
+    except BaseException:
+        await db.rollback()
+        await delete_files([destination for _, destination in links])
+        raise
+
+    await delete_files([path for image_id, path in sources.items() if destinations.get(image_id) != path])
+
+    for collection_id, image_ids in discarded.items():
+        fingerprint_cache.discard(collection_id, image_ids)
+    for collection_id in invalidated:
+        fingerprint_cache.invalidate(collection_id)
+
+    return {"operations": results}
@@ -0,0 +1,46 @@
+import uuid
+from typing import Optional
+
+import sqlalchemy as sa
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from finder.db.models.ingestion_job import IngestionJob
+from finder.db.models.user import User
+from finder.db.session import get_db
+from finder.services.auth_service import AuthService
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+
+@router.get("/{job_id}", status_code=status.HTTP_200_OK)
+async def get_job(
+    job_id: uuid.UUID,
+    db: AsyncSession = Depends(get_db),
+    user: User = Depends(AuthService.get_current_user),
+):
+    job: Optional[IngestionJob] = await db.scalar(
+        sa.select(IngestionJob).where(IngestionJob.id == job_id, IngestionJob.owner_id == user.id)
+    )
+    if job is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Job not found.")
+
+    # Until the job is done every file shares its status
+    files = job.result["files"] if job.result else [
+        {"filename": file["filename"], "status": job.status, "image_id": None, "duplicate_of": None}
+        for file in job.files
+    ]
+
+    return {
+        "id": job.id,
+        "status": job.status,
+        "result": job.result["status"] if job.result else None,
+        "collection_id": job.collection_id,
+        "attempts": job.attempts,
+        "error": job.error,
+        "files": files,
+        "duplicates": job.result["duplicates"] if job.result else {},
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
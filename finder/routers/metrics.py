@@ -0,0 +1,29 @@
+from fastapi import APIRouter, Depends, status
+
+from finder.db.models.user import User
+from finder.services.auth_service import AuthService
+from finder.services.derivative_cache import DerivativeCache
+from finder.services.embedding_service import EmbeddingService
+from finder.services.garbage_collector import GarbageCollector
+from finder.services.ingestion_service import IngestionService
+from finder.utils.budget import PIXEL_BUDGET, UPLOAD_BUDGET
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("/", status_code=status.HTTP_200_OK)
+async def get_metrics(
+    embedder: EmbeddingService = Depends(EmbeddingService.get_instance),
+    derivative_cache: DerivativeCache = Depends(DerivativeCache.get_instance),
+    ingestion: IngestionService = Depends(IngestionService.get_instance),
+    garbage_collector: GarbageCollector = Depends(GarbageCollector.get_instance),
+    user: User = Depends(AuthService.get_current_user),
+):
+    return {
+        "embedding": embedder.metrics(),
+        "upload_memory": UPLOAD_BUDGET.metrics(),
+        "decode_pixels": PIXEL_BUDGET.metrics(),
+        "derivative_cache": derivative_cache.metrics(),
+        "ingestion": ingestion.metrics(),
+        "garbage_collector": garbage_collector.metrics(),
+    }
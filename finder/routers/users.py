@@ -11,6 +11,7 @@ from finder.db.models.collection import Collection
 from finder.db.models.user import User
 from finder.db.session import get_db
 from finder.services.auth_service import AuthService
+from finder.services.fingerprint_cache import FingerprintCache
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -41,9 +42,12 @@ async def update_user(
 async def delete_user(
     db: AsyncSession = Depends(get_db),
     user: User = Depends(AuthService.get_current_user),
+    fingerprint_cache: FingerprintCache = Depends(FingerprintCache.get_instance),
 ):
+    user_id = user.id
     await db.delete(user)
     await db.commit()
+    fingerprint_cache.invalidate_owner(user_id)
 
 
 @event.listens_for(User, "after_insert")
@@ -0,0 +1,136 @@
+import asyncio
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from finder.config import config
+from finder.services.preprocess_service import PreprocessService
+from finder.services.singleton_base_service import SingletonBaseService
+from finder.utils.derivatives import DerivativeFormat, render_derivative, write_atomic
+from finder.utils.files import delete_files
+from finder.utils.preprocess import THUMBNAIL_MIN_SIDE, check_image
+
+
+def _scan(root: Path) -> List[Tuple[float, Path, int]]:
+    entries = []
+    for path in root.glob("*/*"):
+        if path.suffix == ".part":
+            continue
+        try:
+            stat_result = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat_result.st_mtime, path, stat_result.st_size))
+
+    return sorted(entries)
+
+
+class DerivativeCache(SingletonBaseService):
+    def __init__(self):
+        if getattr(self, "_initialized", False):
+            return
+
+        # Resized variants keyed by the original's sha256, so identical uploads share them and entries never
+        # go stale; deleted images simply age out of the LRU.
+        self.root: Path = config.STORAGE_PATH / "derivatives"
+        self.max_bytes: int = config.DERIVATIVE_CACHE_MAX_BYTES
+        self.widths: List[int] = config.DERIVATIVE_WIDTHS
+        self.quality: int = config.DERIVATIVE_QUALITY
+
+        # Generated alongside the embedding input on upload; only possible up to the decode thumbnail size
+        self.eager: Optional[Tuple[int, DerivativeFormat, int]] = None
+        if config.DERIVATIVE_EAGER_WIDTH and config.DERIVATIVE_EAGER_WIDTH not in self.widths:
+            # It would be written on every upload but never served
+            raise ValueError(
+                f"DERIVATIVE_EAGER_WIDTH={config.DERIVATIVE_EAGER_WIDTH} is not one of DERIVATIVE_WIDTHS {self.widths}"
+            )
+        if 0 < config.DERIVATIVE_EAGER_WIDTH <= THUMBNAIL_MIN_SIDE:
+            self.eager = (config.DERIVATIVE_EAGER_WIDTH, config.DERIVATIVE_EAGER_FORMAT, self.quality)
+
+        # Per-process view of the cache directory, in least recently used order
+        self._entries: OrderedDict[Path, int] = OrderedDict()
+        self._nbytes = 0
+        self._loaded: Optional[asyncio.Task] = None
+        self._pending: Dict[Path, asyncio.Future] = {}
+
+        self._initialized = True
+
+    def path_for(self, sha256: str, width: int, format_: DerivativeFormat) -> Path:
+        return self.root / sha256[:2] / f"{sha256}_{width}.{format_}"
+
+    async def _scan(self) -> None:
+        for _mtime, path, size in await asyncio.to_thread(_scan, self.root):
+            await self._record(path, size)
+
+    async def _load(self) -> None:
+        if self._loaded is None:
+            self._loaded = asyncio.create_task(self._scan())
+        await self._loaded
+
+    async def _record(self, path: Path, size: int) -> None:
+        self._nbytes += size - self._entries.pop(path, 0)
+        self._entries[path] = size
+
+        evicted = []
+        while self._entries and self._nbytes > self.max_bytes:
+            evicted_path, evicted_size = self._entries.popitem(last=False)
+            self._nbytes -= evicted_size
+            evicted.append(evicted_path)
+
+        if evicted:
+            await delete_files(evicted)
+
+    async def _lookup(self, path: Path) -> bool:
+        # Checks the disk too: other worker processes share the directory and may have added or evicted it
+        try:
+            size = (await asyncio.to_thread(path.stat)).st_size
+        except FileNotFoundError:
+            if path in self._entries:
+                self._nbytes -= self._entries.pop(path)
+            return False
+
+        if path in self._entries:
+            self._entries.move_to_end(path)
+        else:
+            await self._record(path, size)
+        return True
+
+    async def _render(self, src: Path, path: Path, width: int, format_: DerivativeFormat) -> Path:
+        # The square draft box over-estimates portrait JPEGs slightly, which is fine for admission
+        header = await asyncio.to_thread(check_image, src, src.name, draft_size=(width, width))
+        size = await PreprocessService.get_instance().run(
+            render_derivative, src, path, width, format_, self.quality, pixels=header.decoded_pixels
+        )
+        await self._record(path, size)
+        return path
+
+    async def get(self, src: Path, sha256: str, width: int, format_: DerivativeFormat) -> Path:
+        await self._load()
+        path = self.path_for(sha256, width, format_)
+        if await self._lookup(path):
+            return path
+
+        # Concurrent requests for the same variant share one render
+        pending = self._pending.get(path)
+        if pending is None:
+            pending = asyncio.ensure_future(self._render(src, path, width, format_))
+            self._pending[path] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(path, None))
+
+        return await asyncio.shield(pending)
+
+    async def put_many(self, items: Sequence[Tuple[str, int, DerivativeFormat, bytes]]) -> None:
+        await self._load()
+        paths = [self.path_for(sha256, width, format_) for sha256, width, format_, _ in items]
+        await asyncio.gather(*(
+            asyncio.to_thread(write_atomic, path, data) for path, (*_, data) in zip(paths, items)
+        ))
+        for path, (*_, data) in zip(paths, items):
+            await self._record(path, len(data))
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._nbytes,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,356 @@
+import asyncio
+import logging
+import os
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, ClassVar, Dict, List, Optional, Tuple, Type
+
+import numpy as np
+import tritonclient.grpc.aio as grpcclient
+import tritonclient.utils.shared_memory as shm
+from tritonclient.grpc.aio import InferenceServerClient, InferInput, InferRequestedOutput, InferenceServerException
+
+from finder.config import config
+
+logger = logging.getLogger(__name__)
+
+INPUT_NAME = "INPUT"
+OUTPUT_NAME = "EMBEDDING"
+EMBEDDING_DIM = 512
+
+
+@dataclass(frozen=True)
+class InputFormat:
+    name: str
+    model_name: str
+    datatype: str
+    dtype: Type[np.generic]
+    shape: Tuple[int, ...]
+
+    @property
+    def image_bytes(self) -> int:
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+
+# float32: normalized NCHW tensors prepared on the client
+# uint8: raw NHWC pixels, scaling/normalization/transpose run inside the model (1/4 of the bytes)
+INPUT_FORMATS: Dict[str, InputFormat] = {
+    "float32": InputFormat("float32", "embedder", "FP32", np.float32, (3, 224, 224)),
+    "uint8": InputFormat("uint8", "embedder_uint8", "UINT8", np.uint8, (224, 224, 3)),
+}
+
+
+class EmbeddingUnavailableError(Exception):
+    pass
+
+
+class EmbeddingBackend(ABC):
+    name: ClassVar[str]
+    input_format: InputFormat
+
+    @abstractmethod
+    async def is_running(self) -> bool:
+        ...
+
+    @abstractmethod
+    async def infer(self, batch: np.ndarray) -> np.ndarray[np.float32]:
+        ...
+
+    async def infer_parts(self, parts: List[np.ndarray]) -> np.ndarray[np.float32]:
+        return await self.infer(parts[0] if len(parts) == 1 else np.concatenate(parts, axis=0))
+
+    async def close(self) -> None:
+        pass
+
+
+@dataclass
+class SharedMemoryRegion:
+    input_name: str
+    output_name: str
+    input_handle: Any
+    output_handle: Any
+    input_bytes: int
+    output_bytes: int
+    inputs: np.ndarray
+    outputs: np.ndarray
+
+    @classmethod
+    def create(cls, name: str, max_batch: int, input_format: InputFormat) -> "SharedMemoryRegion":
+        input_shape = (max_batch, *input_format.shape)
+        output_shape = (max_batch, EMBEDDING_DIM)
+        input_bytes = max_batch * input_format.image_bytes
+        output_bytes = int(np.prod(output_shape)) * 4
+        input_name, output_name = f"{name}_input", f"{name}_output"
+        input_handle = shm.create_shared_memory_region(input_name, f"/{input_name}", input_bytes)
+        output_handle = shm.create_shared_memory_region(output_name, f"/{output_name}", output_bytes)
+        return cls(
+            input_name=input_name,
+            output_name=output_name,
+            input_handle=input_handle,
+            output_handle=output_handle,
+            input_bytes=input_bytes,
+            output_bytes=output_bytes,
+            inputs=shm.get_contents_as_numpy(input_handle, input_format.dtype, input_shape),
+            outputs=shm.get_contents_as_numpy(output_handle, np.float32, output_shape),
+        )
+
+    def destroy(self) -> None:
+        # The numpy views pin the mapped buffers, so they are dropped before unmapping
+        self.inputs = self.outputs = None
+        shm.destroy_shared_memory_region(self.input_handle)
+        shm.destroy_shared_memory_region(self.output_handle)
+
+
+class TritonBackend(EmbeddingBackend):
+    name = "triton"
+
+    def __init__(
+            self,
+            url: str = config.TRITON_URL,
+            infer_timeout: float = config.TRITON_INFER_TIMEOUT,
+            health_timeout: float = config.TRITON_HEALTH_TIMEOUT,
+            max_in_flight: int = config.TRITON_MAX_IN_FLIGHT,
+            shared_memory: bool = config.TRITON_SHARED_MEMORY,
+            shm_max_batch: int = config.TRITON_SHM_MAX_BATCH,
+            shm_pool_size: int = config.TRITON_SHM_POOL_SIZE,
+            input_format: str = config.EMBEDDING_INPUT_FORMAT
+    ):
+        self.input_format = INPUT_FORMATS[input_format]
+        self.url = url
+        self.infer_timeout = infer_timeout
+        self.health_timeout = health_timeout
+
+        # The asyncio client binds to the running event loop, so it is created on first use
+        self._client: Optional[InferenceServerClient] = None
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+
+        # System shared memory only works when Triton runs on the same host
+        self.shared_memory = shared_memory
+        self.shm_max_batch = shm_max_batch
+        self.shm_pool_size = shm_pool_size
+        if shared_memory and shm_max_batch < config.EMBEDDING_MAX_BATCH_SIZE:
+            logger.warning(
+                "TRITON_SHM_MAX_BATCH=%d is below EMBEDDING_MAX_BATCH_SIZE=%d; larger batches bypass shared memory",
+                shm_max_batch, config.EMBEDDING_MAX_BATCH_SIZE,
+            )
+        self._shm_regions: List[SharedMemoryRegion] = []
+        self._shm_free: Optional[asyncio.Queue[SharedMemoryRegion]] = None
+        self._shm_registered = False
+        self._shm_lock = asyncio.Lock()
+
+    @property
+    def client(self) -> InferenceServerClient:
+        if self._client is None:
+            self._client = grpcclient.InferenceServerClient(url=self.url, verbose=False)
+
+        return self._client
+
+    async def _register_shared_memory(self) -> None:
+        async with self._shm_lock:
+            if self._shm_registered:
+                return
+
+            if not self._shm_regions:
+                prefix = f"finder_{os.getpid()}"
+                self._shm_regions = [
+                    SharedMemoryRegion.create(f"{prefix}_{i}", self.shm_max_batch, self.input_format) for i in range(self.shm_pool_size)
+                ]
+                self._shm_free = asyncio.Queue()
+                for region in self._shm_regions:
+                    self._shm_free.put_nowait(region)
+
+            # Every region is taken back first, so none is re-registered under a request still using it.
+            # Callers never hold a region while registering, so this only waits for in-flight requests.
+            held = []
+            try:
+                while len(held) < len(self._shm_regions):
+                    held.append(await self._shm_free.get())
+
+                # Registrations do not survive a server restart, so stale ones are dropped before registering again
+                for region in self._shm_regions:
+                    for name, byte_size in (
+                        (region.input_name, region.input_bytes),
+                        (region.output_name, region.output_bytes),
+                    ):
+                        await self.client.unregister_system_shared_memory(name)
+                        await self.client.register_system_shared_memory(name, f"/{name}", byte_size)
+
+                self._shm_registered = True
+            finally:
+                for region in held:
+                    self._shm_free.put_nowait(region)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            if self._shm_registered:
+                for region in self._shm_regions:
+                    try:
+                        await self._client.unregister_system_shared_memory(region.input_name)
+                        await self._client.unregister_system_shared_memory(region.output_name)
+                    except InferenceServerException:
+                        pass
+                self._shm_registered = False
+
+            await self._client.close()
+            self._client = None
+
+        for region in self._shm_regions:
+            region.destroy()
+        self._shm_regions = []
+        self._shm_free = None
+
+    async def is_running(self) -> bool:
+        timeout = self.health_timeout
+        try:
+            running = (
+                await self.client.is_server_live(client_timeout=timeout)
+                and await self.client.is_server_ready(client_timeout=timeout)
+                and await self.client.is_model_ready(self.input_format.model_name, client_timeout=timeout)
+            )
+            if running and self.shared_memory:
+                await self._register_shared_memory()
+            return running
+        except Exception:
+            return False
+
+    async def infer(self, batch: np.ndarray) -> np.ndarray[np.float32]:
+        inp = InferInput(INPUT_NAME, list(batch.shape), self.input_format.datatype)
+        inp.set_data_from_numpy(batch)
+        out = InferRequestedOutput(OUTPUT_NAME)
+
+        async with self._in_flight:
+            try:
+                res = await self.client.infer(
+                    self.input_format.model_name, inputs=[inp], outputs=[out], client_timeout=self.infer_timeout
+                )
+            except InferenceServerException as e:
+                raise EmbeddingUnavailableError(str(e)) from e
+
+        return res.as_numpy(OUTPUT_NAME)
+
+    async def infer_parts(self, parts: List[np.ndarray]) -> np.ndarray[np.float32]:
+        size = sum(len(part) for part in parts)
+        if not self.shared_memory or size > self.shm_max_batch:
+            return await super().infer_parts(parts)
+
+        try:
+            await self._register_shared_memory()
+        except InferenceServerException as e:
+            raise EmbeddingUnavailableError(str(e)) from e
+
+        async with self._in_flight:
+            region = await self._shm_free.get()
+            try:
+                # Each request's tensor is copied once, straight into the mapped region
+                offset = 0
+                for part in parts:
+                    region.inputs[offset:offset + len(part)] = part
+                    offset += len(part)
+
+                inp = InferInput(INPUT_NAME, [size, *self.input_format.shape], self.input_format.datatype)
+                inp.set_shared_memory(region.input_name, size * self.input_format.image_bytes)
+                out = InferRequestedOutput(OUTPUT_NAME)
+                out.set_shared_memory(region.output_name, size * EMBEDDING_DIM * 4)
+
+                try:
+                    await self.client.infer(
+                        self.input_format.model_name, inputs=[inp], outputs=[out], client_timeout=self.infer_timeout
+                    )
+                except InferenceServerException as e:
+                    self._shm_registered = False
+                    raise EmbeddingUnavailableError(str(e)) from e
+
+                return region.outputs[:size].copy()
+            finally:
+                self._shm_free.put_nowait(region)
+
+
+class OnnxRuntimeBackend(EmbeddingBackend):
+    name = "onnxruntime"
+
+    def __init__(
+            self,
+            model_path: Path = config.ONNX_MODEL_PATH,
+            intra_op_threads: int = config.ONNX_INTRA_OP_THREADS,
+            inter_op_threads: int = config.ONNX_INTER_OP_THREADS,
+            pool_size: int = config.ONNX_SESSION_POOL_SIZE,
+            input_format: str = config.EMBEDDING_INPUT_FORMAT
+    ):
+        self.input_format = INPUT_FORMATS[input_format]
+        self.model_path = model_path
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.pool_size = pool_size
+
+        # Sessions are loaded on first use; each one runs a single batch at a time
+        self._sessions: Optional[asyncio.Queue] = None
+        self._loading = asyncio.Lock()
+
+    def _create_session(self):
+        # Imported lazily so Triton deployments do not pay for loading onnxruntime
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.intra_op_threads
+        options.inter_op_num_threads = self.inter_op_threads
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        return ort.InferenceSession(str(self.model_path), sess_options=options, providers=["CPUExecutionProvider"])
+
+    async def _get_sessions(self) -> asyncio.Queue:
+        async with self._loading:
+            if self._sessions is None:
+                sessions = await asyncio.gather(*(
+                    asyncio.to_thread(self._create_session) for _ in range(self.pool_size)
+                ))
+                self._sessions = asyncio.Queue()
+                for session in sessions:
+                    self._sessions.put_nowait(session)
+
+        return self._sessions
+
+    async def close(self) -> None:
+        self._sessions = None
+
+    async def is_running(self) -> bool:
+        if not self.model_path.is_file():
+            return False
+
+        try:
+            await self._get_sessions()
+        except Exception:
+            return False
+
+        return True
+
+    async def infer(self, batch: np.ndarray) -> np.ndarray[np.float32]:
+        try:
+            sessions = await self._get_sessions()
+        except Exception as e:
+            raise EmbeddingUnavailableError(str(e)) from e
+
+        # Only runtime failures mean the backend is unavailable; invalid arguments (wrong dtype or shape)
+        # are bugs in the caller and propagate unchanged
+        from onnxruntime.capi.onnxruntime_pybind11_state import EPFail, Fail, RuntimeException
+
+        session = await sessions.get()
+        try:
+            outputs = await asyncio.to_thread(session.run, [OUTPUT_NAME], {INPUT_NAME: batch})
+        except (Fail, EPFail, RuntimeException, MemoryError) as e:
+            raise EmbeddingUnavailableError(str(e)) from e
+        finally:
+            sessions.put_nowait(session)
+
+        return outputs[0]
+
+
+BACKENDS: Dict[str, Type[EmbeddingBackend]] = {
+    TritonBackend.name: TritonBackend,
+    OnnxRuntimeBackend.name: OnnxRuntimeBackend,
+}
+
+
+def create_embedding_backend(name: str = config.EMBEDDING_BACKEND) -> EmbeddingBackend:
+    return BACKENDS[name]()
@@ -1,17 +1,22 @@
-from typing import List
+import asyncio
+import contextlib
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Dict, Set, Union
 
 import numpy as np
-import tritonclient.grpc as grpcclient
 from PIL import Image
-from tritonclient.grpc import InferenceServerClient, InferInput, InferRequestedOutput
 
 from finder.config import config
+from finder.services.embedding_backends import EmbeddingBackend, EmbeddingUnavailableError, create_embedding_backend
 from finder.services.singleton_base_service import SingletonBaseService
 from finder.utils.preprocess import preprocess_many
 
-MODEL_NAME = "embedder"
-INPUT_NAME = "INPUT"
-OUTPUT_NAME = "EMBEDDING"
+
+@dataclass
+class PendingEmbedding:
+    batch: np.ndarray
+    future: asyncio.Future
 
 
 class EmbeddingService(SingletonBaseService):
@@ -19,31 +24,208 @@ class EmbeddingService(SingletonBaseService):
         if getattr(self, "_initialized", False):
             return
 
-        self.client: InferenceServerClient = grpcclient.InferenceServerClient(
-            url=config.TRITON_URL, verbose=False
-        )
+        self.backend: EmbeddingBackend = create_embedding_backend(config.EMBEDDING_BACKEND)
+
+        # Last known backend health, refreshed by the background monitor so requests only read a flag.
+        # Optimistic until the first probe, so requests arriving before it completes are not turned away;
+        # a failed inference marks the backend down right away
+        self.healthy = True
+        self._health_monitor: Optional[asyncio.Task] = None
+        self._health_failures = 0
+        self._health_transitions = 0
+        self._health_checked_at: Optional[float] = None
+        self._health_changed_at: Optional[float] = None
+
+        # Client-side micro-batching: tensors from concurrent requests are merged into one inference call
+        self.max_batch_size: int = config.EMBEDDING_MAX_BATCH_SIZE
+        self.max_queue_delay: float = config.EMBEDDING_MAX_QUEUE_DELAY_MS / 1000
+        self._queue: Optional[asyncio.Queue[PendingEmbedding]] = None
+        self._batcher: Optional[asyncio.Task] = None
+        self._dispatches: Set[asyncio.Task] = set()
+        self._queued_images = 0
+        self._batches_total = 0
+        self._images_total = 0
+        self._last_batch_size = 0
+        self._max_batch_size_seen = 0
 
         self._initialized = True
 
-    def is_running(self) -> bool:
-        try:
-            return (
-                self.client.is_server_live()
-                and self.client.is_server_ready()
-                and self.client.is_model_ready(MODEL_NAME)
-            )
-        except Exception:
-            return False
-
-    def _infer_batch(self, batch_chw_fp32: np.ndarray[np.float32]) -> np.ndarray[np.float32]:
-        inp = InferInput(INPUT_NAME, list(batch_chw_fp32.shape), "FP32")
-        inp.set_data_from_numpy(batch_chw_fp32)
-        out = InferRequestedOutput(OUTPUT_NAME)
-        res = self.client.infer(MODEL_NAME, inputs=[inp], outputs=[out])
-        embs = res.as_numpy(OUTPUT_NAME)
+    def start_health_monitor(self) -> None:
+        if self._health_monitor is None or self._health_monitor.done():
+            self._health_monitor = asyncio.create_task(self._monitor_health())
+
+    async def close(self) -> None:
+        if self._health_monitor is not None:
+            self._health_monitor.cancel()
+            self._health_monitor = None
+
+        if self._batcher is not None:
+            self._batcher.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._batcher
+            self._batcher = None
+
+        # Batches already sent finish normally; requests still queued would otherwise wait forever
+        await asyncio.gather(*self._dispatches, return_exceptions=True)
+        while self._queue is not None and not self._queue.empty():
+            item = self._queue.get_nowait()
+            self._queued_images -= len(item.batch)
+            self._fail([item], EmbeddingUnavailableError("Embedding service is shutting down"))
+
+        await self.backend.close()
+
+    def _set_healthy(self, healthy: bool) -> None:
+        if healthy != self.healthy:
+            self.healthy = healthy
+            self._health_transitions += 1
+            self._health_changed_at = time.time()
+
+        self._health_failures = 0 if healthy else self._health_failures + 1
+
+    async def is_running(self) -> bool:
+        healthy = await self.backend.is_running()
+        self._health_checked_at = time.time()
+        self._set_healthy(healthy)
+        return healthy
+
+    async def _monitor_health(self) -> None:
+        while True:
+            await self.is_running()
+
+            delay = config.EMBEDDING_HEALTH_INTERVAL
+            if not self.healthy:
+                delay = min(delay * 2 ** (self._health_failures - 1), config.EMBEDDING_HEALTH_MAX_BACKOFF)
+
+            await asyncio.sleep(delay)
+
+    async def _infer_batch(self, parts: List[np.ndarray]) -> np.ndarray[np.float32]:
+        embs = await self.backend.infer_parts(parts)
         norms = np.linalg.norm(embs, axis=1, keepdims=True) + 1e-12
         return (embs / norms).astype(np.float32)
 
+    def metrics(self) -> Dict[str, Union[str, float, bool, None]]:
+        return {
+            "backend": self.backend.name,
+            "healthy": self.healthy,
+            "health_transitions_total": self._health_transitions,
+            "health_consecutive_failures": self._health_failures,
+            "health_checked_at": self._health_checked_at,
+            "health_changed_at": self._health_changed_at,
+            "queue_depth_requests": self._queue.qsize() if self._queue is not None else 0,
+            "queue_depth_images": self._queued_images,
+            "batches_total": self._batches_total,
+            "images_total": self._images_total,
+            "avg_batch_size": self._images_total / self._batches_total if self._batches_total else 0.0,
+            "last_batch_size": self._last_batch_size,
+            "max_batch_size_seen": self._max_batch_size_seen,
+        }
+
+    def _ensure_batcher(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+
+        if self._batcher is None or self._batcher.done():
+            self._batcher = asyncio.create_task(self._run_batcher())
+
+    def _fail(self, items: List[PendingEmbedding], error: Exception) -> None:
+        for item in items:
+            if not item.future.done():
+                item.future.set_exception(error)
+
+    async def _run_batcher(self) -> None:
+        loop = asyncio.get_running_loop()
+        carry: Optional[PendingEmbedding] = None
+        items: List[PendingEmbedding] = []
+
+        try:
+            while True:
+                first = carry if carry is not None else await self._queue.get()
+                carry = None
+
+                items = [first]
+                size = len(first.batch)
+                deadline = loop.time() + self.max_queue_delay
+                while size < self.max_batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+
+                    if size + len(item.batch) > self.max_batch_size:
+                        carry = item
+                        break
+
+                    items.append(item)
+                    size += len(item.batch)
+
+                dispatch = asyncio.create_task(self._dispatch(items))
+                self._dispatches.add(dispatch)
+                dispatch.add_done_callback(self._dispatches.discard)
+                items = []
+
+        except asyncio.CancelledError:
+            # Requests taken off the queue but not dispatched yet
+            pending = items + ([carry] if carry is not None else [])
+            self._queued_images -= sum(len(item.batch) for item in pending)
+            self._fail(pending, EmbeddingUnavailableError("Embedding service is shutting down"))
+            raise
+
+    async def _dispatch(self, items: List[PendingEmbedding]) -> None:
+        self._queued_images -= sum(len(item.batch) for item in items)
+
+        # Requests cancelled while queued (e.g. the HTTP client disconnected) are not sent
+        items = [item for item in items if not item.future.done()]
+        if not items:
+            return
+
+        size = sum(len(item.batch) for item in items)
+        self._batches_total += 1
+        self._images_total += size
+        self._last_batch_size = size
+        self._max_batch_size_seen = max(self._max_batch_size_seen, size)
+
+        try:
+            embeddings = await self._infer_batch([item.batch for item in items])
+        except Exception as e:
+            if isinstance(e, EmbeddingUnavailableError):
+                self._set_healthy(False)
+
+            self._fail(items, e)
+            return
+
+        offsets = np.cumsum([len(item.batch) for item in items])[:-1]
+        for item, result in zip(items, np.split(embeddings, offsets)):
+            if not item.future.done():
+                item.future.set_result(result)
+
+    async def _submit(self, batch: np.ndarray) -> np.ndarray[np.float32]:
+        self._ensure_batcher()
+        loop = asyncio.get_running_loop()
+
+        futures = []
+        for start in range(0, len(batch), self.max_batch_size):
+            chunk = batch[start:start + self.max_batch_size]
+            future = loop.create_future()
+            self._queued_images += len(chunk)
+            self._queue.put_nowait(PendingEmbedding(chunk, future))
+            futures.append(future)
+
+        try:
+            results = await asyncio.gather(*futures)
+        finally:
+            for future in futures:
+                future.cancel()
+
+        return np.concatenate(results, axis=0)
+
     async def embed(self, images: List[Image.Image]) -> np.ndarray[np.float32]:
-        batch = await preprocess_many(images)
-        return self._infer_batch(batch)
+        batch = await preprocess_many(images, self.backend.input_format.name)
+        return await self._submit(batch)
+
+    async def embed_batch(self, batch: np.ndarray) -> np.ndarray[np.float32]:
+        # `batch` must already be in the backend's input format (see PreprocessService)
+        return await self._submit(batch)
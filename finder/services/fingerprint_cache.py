@@ -0,0 +1,365 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from finder.config import config
+from finder.db.models.image import Image
+from finder.db.models.image_fingerprint import ImageFingerprint
+from finder.services.singleton_base_service import SingletonBaseService
+from finder.utils.duplicates import DuplicateMatch, detect_duplicates_many
+from finder.utils.hashing import hamming_distances
+
+EMBEDDING_DIM = 512
+# Rough per-row overhead of the Python side (UUID objects, id/sha256 dict entries)
+ROW_OVERHEAD_BYTES = 256
+SIMILARITY_CHUNK_ROWS = 65536
+
+
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True) + 1e-12
+    return embeddings / norms
+
+
+@dataclass(frozen=True)
+class FingerprintSnapshot:
+    alive: np.ndarray
+    image_ids: List[Optional[uuid.UUID]]
+    phashes: np.ndarray
+    embeddings: np.ndarray
+    sha256_rows: Dict[bytes, List[int]]
+
+    def detect(
+        self,
+        fingerprints: Sequence[ImageFingerprint],
+        bit_diff_tolerance: int,
+        similarity_threshold: float
+    ) -> Dict[uuid.UUID, DuplicateMatch]:
+        # Same cascade as `detect_duplicates_many`: targets are compared against the cached collection only,
+        # copies within the batch are resolved beforehand by `detect_batch_duplicates`.
+        size = len(self.alive)
+        alive = self.alive
+        image_ids = self.image_ids
+
+        ids = [fp.image_id for fp in fingerprints]
+        sha256_list = [bytes.fromhex(fp.sha256) for fp in fingerprints]
+        phashes = np.array([fp.phash for fp in fingerprints], dtype=np.int64).view(np.uint64)
+        embeddings = _normalize(np.stack([np.asarray(fp.embedding) for fp in fingerprints]))
+
+        duplicates: Dict[uuid.UUID, DuplicateMatch] = {}
+
+        for i, sha256 in enumerate(sha256_list):
+            rows = [row for row in self.sha256_rows.get(sha256, ()) if alive[row]]
+            if rows:
+                duplicates[ids[i]] = (image_ids[rows[0]], "sha256")
+
+        for i in range(len(ids)):
+            if ids[i] in duplicates:
+                continue
+
+            hits = np.flatnonzero((hamming_distances(self.phashes, phashes[i]) <= bit_diff_tolerance) & alive)
+            if hits.size:
+                duplicates[ids[i]] = (image_ids[hits[0]], "phash")
+
+        remaining = [i for i in range(len(ids)) if ids[i] not in duplicates]
+        if not remaining:
+            return duplicates
+
+        targets = embeddings[remaining]
+        best_rows = np.full(len(remaining), -1, dtype=np.int64)
+        best_similarities = np.full(len(remaining), -np.inf, dtype=np.float32)
+        for start in range(0, size, SIMILARITY_CHUNK_ROWS):
+            end = min(start + SIMILARITY_CHUNK_ROWS, size)
+            similarities = self.embeddings[start:end].astype(np.float32, copy=False) @ targets.T
+            similarities[~alive[start:end]] = -np.inf
+
+            rows = np.argmax(similarities, axis=0)
+            values = similarities[rows, np.arange(len(remaining))]
+            better = values > best_similarities
+            best_rows[better] = rows[better] + start
+            best_similarities[better] = values[better]
+
+        for k, i in enumerate(remaining):
+            if best_similarities[k] >= similarity_threshold:
+                duplicates[ids[i]] = (image_ids[best_rows[k]], "embedding")
+
+        return duplicates
+
+
+class CollectionFingerprints:
+    def __init__(self, owner_id: uuid.UUID, capacity: int, dtype: np.dtype):
+        self.owner_id = owner_id
+        self.loaded_at = time.monotonic()
+
+        self.size = 0
+        self.image_ids: List[Optional[uuid.UUID]] = []
+        self.rows: Dict[uuid.UUID, int] = {}
+        self.sha256: Dict[bytes, List[int]] = {}
+        self.row_sha256: List[Optional[bytes]] = []
+
+        capacity = max(capacity, 16)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.phashes = np.zeros(capacity, dtype=np.uint64)
+        self.embeddings = np.zeros((capacity, EMBEDDING_DIM), dtype=dtype)
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.alive.nbytes
+            + self.phashes.nbytes
+            + self.embeddings.nbytes
+            + len(self.image_ids) * ROW_OVERHEAD_BYTES
+        )
+
+    def _capacity_for(self, needed: int) -> int:
+        capacity = len(self.alive)
+        while capacity < needed:
+            capacity *= 2
+        return capacity
+
+    def growth_bytes(self, count: int) -> int:
+        # Upper bound of what adding `count` rows adds to `nbytes`, including the doubled arrays
+        row_bytes = self.alive.itemsize + self.phashes.itemsize + EMBEDDING_DIM * self.embeddings.itemsize
+        extra_rows = self._capacity_for(self.size + count) - len(self.alive)
+        return extra_rows * row_bytes + count * ROW_OVERHEAD_BYTES
+
+    def _grow(self, needed: int) -> None:
+        capacity = self._capacity_for(needed)
+        if capacity == len(self.alive):
+            return
+
+        self.alive = np.resize(self.alive, capacity)
+        self.alive[self.size:] = False
+        self.phashes = np.resize(self.phashes, capacity)
+        embeddings = np.zeros((capacity, EMBEDDING_DIM), dtype=self.embeddings.dtype)
+        embeddings[:self.size] = self.embeddings[:self.size]
+        self.embeddings = embeddings
+
+    def add(
+        self,
+        image_ids: Sequence[uuid.UUID],
+        sha256_list: Sequence[str],
+        phashes: Sequence[int],
+        embeddings: np.ndarray
+    ) -> None:
+        new = [i for i, image_id in enumerate(image_ids) if image_id not in self.rows]
+        if not new:
+            return
+
+        start = self.size
+        self._grow(start + len(new))
+
+        self.phashes[start:start + len(new)] = np.array([phashes[i] for i in new], dtype=np.int64).view(np.uint64)
+        self.embeddings[start:start + len(new)] = _normalize(np.asarray(embeddings)[new])
+        self.alive[start:start + len(new)] = True
+
+        for row, i in enumerate(new, start=start):
+            sha256 = bytes.fromhex(sha256_list[i])
+            self.image_ids.append(image_ids[i])
+            self.row_sha256.append(sha256)
+            self.rows[image_ids[i]] = row
+            self.sha256.setdefault(sha256, []).append(row)
+
+        self.size += len(new)
+
+    def discard(self, image_ids: Sequence[uuid.UUID]) -> None:
+        for image_id in image_ids:
+            row = self.rows.pop(image_id, None)
+            if row is None:
+                continue
+
+            self.alive[row] = False
+            self.image_ids[row] = None
+
+            sha256 = self.row_sha256[row]
+            self.row_sha256[row] = None
+            rows = self.sha256[sha256]
+            rows.remove(row)
+            if not rows:
+                del self.sha256[sha256]
+
+    def snapshot(self, sha256_list: Sequence[str]) -> FingerprintSnapshot:
+        # Taken on the event loop, where `add`/`discard` run, so the comparison can work on it in a thread.
+        # Rows below `size` are never written again and `_grow` allocates new arrays, so views are enough.
+        size = self.size
+        return FingerprintSnapshot(
+            alive=self.alive[:size].copy(),
+            image_ids=list(self.image_ids[:size]),
+            phashes=self.phashes[:size],
+            embeddings=self.embeddings[:size],
+            sha256_rows={
+                sha256: list(self.sha256.get(sha256, ()))
+                for sha256 in map(bytes.fromhex, sha256_list)
+            },
+        )
+
+
+class FingerprintCache(SingletonBaseService):
+    def __init__(self):
+        if getattr(self, "_initialized", False):
+            return
+
+        self.max_bytes: int = config.FINGERPRINT_CACHE_MAX_BYTES
+        self.ttl: float = config.FINGERPRINT_CACHE_TTL
+        self.dtype = np.dtype(config.FINGERPRINT_CACHE_EMBEDDING_DTYPE)
+
+        self._entries: OrderedDict[uuid.UUID, CollectionFingerprints] = OrderedDict()
+        # Warm locks with the number of `get` calls using them, dropped once unused
+        self._locks: Dict[uuid.UUID, asyncio.Lock] = {}
+        self._lock_users: Dict[uuid.UUID, int] = {}
+        # Bumped on every change to a collection with a `get` in flight, so a warm racing with a change is not kept
+        self._generations: Dict[uuid.UUID, int] = {}
+
+        self._initialized = True
+
+    @property
+    def nbytes(self) -> int:
+        return sum(entry.nbytes for entry in self._entries.values())
+
+    def _row_bytes(self) -> int:
+        return 1 + 8 + EMBEDDING_DIM * self.dtype.itemsize + ROW_OVERHEAD_BYTES
+
+    def _bump(self, collection_id: uuid.UUID) -> None:
+        if collection_id in self._locks:
+            self._generations[collection_id] = self._generations.get(collection_id, 0) + 1
+
+    def _evict(self, needed: int) -> bool:
+        if needed > self.max_bytes:
+            return False
+
+        while self._entries and self.nbytes + needed > self.max_bytes:
+            self._entries.popitem(last=False)
+
+        return True
+
+    async def _warm(
+        self,
+        db: AsyncSession,
+        owner_id: uuid.UUID,
+        collection_id: uuid.UUID,
+        exclude_ids: Sequence[uuid.UUID]
+    ) -> Optional[CollectionFingerprints]:
+        where = (
+            Image.owner_id == owner_id,
+            Image.collection_id == collection_id,
+            Image.id.not_in(exclude_ids),
+        )
+        count = await db.scalar(sa.select(sa.func.count()).select_from(Image).where(*where))
+        if not self._evict(count * self._row_bytes()):
+            return None
+
+        generation = self._generations.get(collection_id, 0)
+        entry = CollectionFingerprints(owner_id, count, self.dtype)
+
+        result = await db.stream(
+            sa.select(Image.id, ImageFingerprint.sha256, ImageFingerprint.phash, ImageFingerprint.embedding)
+            .join(ImageFingerprint, ImageFingerprint.image_id == Image.id)
+            .where(*where)
+        )
+        async for rows in result.partitions(10000):
+            image_ids, sha256_list, phashes, embeddings = zip(*rows)
+            entry.add(image_ids, sha256_list, phashes, np.stack(embeddings))
+
+        if self._generations.get(collection_id, 0) == generation:
+            self._entries[collection_id] = entry
+
+        return entry
+
+    async def get(
+        self,
+        db: AsyncSession,
+        owner_id: uuid.UUID,
+        collection_id: uuid.UUID,
+        exclude_ids: Sequence[uuid.UUID] = ()
+    ) -> Optional[CollectionFingerprints]:
+        if self.max_bytes <= 0:
+            return None
+
+        lock = self._locks.setdefault(collection_id, asyncio.Lock())
+        self._lock_users[collection_id] = self._lock_users.get(collection_id, 0) + 1
+        try:
+            async with lock:
+                entry = self._entries.get(collection_id)
+                if entry is not None and time.monotonic() - entry.loaded_at > self.ttl:
+                    del self._entries[collection_id]
+                    entry = None
+
+                if entry is None:
+                    return await self._warm(db, owner_id, collection_id, exclude_ids)
+
+                self._entries.move_to_end(collection_id)
+                return entry
+        finally:
+            self._lock_users[collection_id] -= 1
+            if not self._lock_users[collection_id]:
+                del self._lock_users[collection_id]
+                del self._locks[collection_id]
+                self._generations.pop(collection_id, None)
+
+    async def detect_many(
+        self,
+        db: AsyncSession,
+        owner_id: uuid.UUID,
+        collection_id: uuid.UUID,
+        fingerprints: Sequence[ImageFingerprint],
+        bit_diff_tolerance: int = config.PHASH_BIT_DIFF_TOLERANCE,
+        similarity_threshold: float = config.EMBEDDING_SIMILARITY_THRESHOLD
+    ) -> Dict[uuid.UUID, DuplicateMatch]:
+        # Fingerprints must already be flushed: collections that do not fit in the cache are checked
+        # against the database by `detect_duplicates_many`, which sees the batch through the flush.
+        if not fingerprints:
+            return {}
+
+        ids = [fp.image_id for fp in fingerprints]
+        entry = await self.get(db, owner_id, collection_id, exclude_ids=ids)
+        if entry is None:
+            return await detect_duplicates_many(
+                db, owner_id, collection_id, ids,
+                bit_diff_tolerance=bit_diff_tolerance,
+                similarity_threshold=similarity_threshold,
+            )
+
+        snapshot = entry.snapshot([fp.sha256 for fp in fingerprints])
+        return await asyncio.to_thread(snapshot.detect, fingerprints, bit_diff_tolerance, similarity_threshold)
+
+    def add(self, collection_id: uuid.UUID, fingerprints: Sequence[ImageFingerprint]) -> None:
+        self._bump(collection_id)
+        entry = self._entries.get(collection_id)
+        if entry is None or not fingerprints:
+            return
+
+        # The growth is charged before it is allocated; an entry that no longer fits is dropped
+        # and warmed again from the database on next use
+        del self._entries[collection_id]
+        if not self._evict(entry.nbytes + entry.growth_bytes(len(fingerprints))):
+            return
+
+        entry.add(
+            [fp.image_id for fp in fingerprints],
+            [fp.sha256 for fp in fingerprints],
+            [fp.phash for fp in fingerprints],
+            np.stack([np.asarray(fp.embedding) for fp in fingerprints]),
+        )
+        self._entries[collection_id] = entry
+
+    def discard(self, collection_id: uuid.UUID, image_ids: Sequence[uuid.UUID]) -> None:
+        self._bump(collection_id)
+        entry = self._entries.get(collection_id)
+        if entry is not None:
+            entry.discard(image_ids)
+
+    def invalidate(self, collection_id: uuid.UUID) -> None:
+        self._bump(collection_id)
+        self._entries.pop(collection_id, None)
+
+    def invalidate_owner(self, owner_id: uuid.UUID) -> None:
+        for collection_id, entry in list(self._entries.items()):
+            if entry.owner_id == owner_id:
+                self.invalidate(collection_id)
@@ -0,0 +1,273 @@
+import asyncio
+import contextlib
+import logging
+import os
+import shutil
+import time
+import uuid
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from finder.config import config
+from finder.db.models.blob import Blob
+from finder.db.models.collection import Collection
+from finder.db.models.file_tombstone import FileTombstone
+from finder.db.models.image import Image
+from finder.db.models.ingestion_job import IngestionJob
+from finder.db.session import SessionLocal
+from finder.services.singleton_base_service import SingletonBaseService
+from finder.utils.files import delete_files
+from finder.utils.storage import blob_path
+
+logger = logging.getLogger(__name__)
+
+# Held for the duration of a reconcile step so only one process walks the tree at a time
+_RECONCILE_LOCK = 0x66696e64
+
+
+def _subdirectories(path: Path) -> Iterator[Path]:
+    try:
+        with os.scandir(path) as entries:
+            names = sorted(entry.name for entry in entries if entry.is_dir(follow_symlinks=False))
+    except FileNotFoundError:
+        return
+
+    for name in names:
+        yield path / name
+
+
+def _storage_directories(root: Path) -> Iterator[Tuple[str, Path]]:
+    # Every directory the reconciler checks, listed lazily so a pass never holds the whole tree in memory
+    yield "spool", root / "spool"
+    yield "jobs", root / "jobs"
+    for owner_dir in _subdirectories(root / "collections"):
+        for collection_dir in _subdirectories(owner_dir):
+            yield "collection", collection_dir
+    for prefix_dir in _subdirectories(root / "blobs"):
+        for blob_dir in _subdirectories(prefix_dir):
+            yield "blobs", blob_dir
+
+
+def _old_entries(directory: Path, cutoff: float) -> List[str]:
+    # Entries last modified before `cutoff`; newer ones may belong to a write whose row is not committed yet
+    try:
+        with os.scandir(directory) as entries:
+            return [entry.name for entry in entries if entry.stat(follow_symlinks=False).st_mtime < cutoff]
+    except FileNotFoundError:
+        return []
+
+
+def _remove_empty_directories(*directories: Path) -> None:
+    for directory in directories:
+        try:
+            directory.rmdir()
+        except OSError:
+            return
+
+
+def _parse_uuids(names: List[str]) -> Dict[uuid.UUID, str]:
+    ids = {}
+    for name in names:
+        with contextlib.suppress(ValueError):
+            ids[uuid.UUID(name)] = name
+    return ids
+
+
+class GarbageCollector(SingletonBaseService):
+    def __init__(self):
+        if getattr(self, "_initialized", False):
+            return
+
+        self.batch_size: int = config.GC_BATCH_SIZE
+        self._deleter: Optional[asyncio.Task] = None
+        self._reconciler: Optional[asyncio.Task] = None
+        self._walk: Optional[Iterator[Tuple[str, Path]]] = None
+
+        self._tombstones_total = 0
+        self._files_deleted_total = 0
+        self._orphans_deleted_total = 0
+        self._reconcile_passes_total = 0
+        self._reconcile_pass_completed_at: Optional[float] = None
+
+        self._initialized = True
+
+    def start(self) -> None:
+        if self._deleter is None or self._deleter.done():
+            self._deleter = asyncio.create_task(self._run_deleter())
+        if self._reconciler is None or self._reconciler.done():
+            self._reconciler = asyncio.create_task(self._run_reconciler())
+
+    async def close(self) -> None:
+        for task in (self._deleter, self._reconciler):
+            if task is not None:
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+        self._deleter = None
+        self._reconciler = None
+
+    async def collect(self) -> int:
+        # Deletes the files of one batch of tombstones and returns how many tombstones were processed
+        async with SessionLocal() as db:
+            tombstones = (await db.execute(
+                sa.select(FileTombstone.id, FileTombstone.path, FileTombstone.blob_sha256)
+                .order_by(FileTombstone.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )).all()
+            if not tombstones:
+                return 0
+
+            done = [tombstone.id for tombstone in tombstones if tombstone.path is not None]
+            paths = [config.STORAGE_PATH / tombstone.path for tombstone in tombstones if tombstone.path is not None]
+
+            blob_tombstones = [tombstone for tombstone in tombstones if tombstone.blob_sha256 is not None]
+            unreferenced = set()
+            if blob_tombstones:
+                shas = {tombstone.blob_sha256 for tombstone in blob_tombstones}
+
+                # The row lock is held until the files are gone: an upload of the same bytes waits on it and
+                # then writes the blob again instead of finding a file that is about to be deleted
+                lockable = dict((await db.execute(
+                    sa.select(Blob.sha256, Blob.ref_count)
+                    .where(Blob.sha256.in_(shas))
+                    .with_for_update(skip_locked=True)
+                )).all())
+                unreferenced = {sha256 for sha256, ref_count in lockable.items() if ref_count == 0}
+
+                # Blobs locked by an in-flight upload keep their tombstone for a later batch
+                missing = shas - lockable.keys()
+                locked = set((await db.execute(
+                    sa.select(Blob.sha256).where(Blob.sha256.in_(missing))
+                )).scalars()) if missing else set()
+
+                done.extend(tombstone.id for tombstone in blob_tombstones if tombstone.blob_sha256 not in locked)
+                paths.extend(blob_path(sha256) for sha256 in unreferenced)
+
+            # Bounded by the shared I/O semaphore; files that fail to delete are left to the reconciler
+            results = await delete_files(paths)
+            failed = len(results) - sum(results)
+            if failed:
+                logger.warning("Garbage collector failed to delete %d files", failed)
+
+            if unreferenced:
+                await db.execute(sa.delete(Blob).where(Blob.sha256.in_(unreferenced), Blob.ref_count == 0))
+            await db.execute(sa.delete(FileTombstone).where(FileTombstone.id.in_(done)))
+            await db.commit()
+
+        self._tombstones_total += len(done)
+        self._files_deleted_total += sum(results)
+        return len(tombstones)
+
+    async def _run_deleter(self) -> None:
+        while True:
+            try:
+                # Full batches mean a backlog (e.g. a deleted user), so the next one is taken right away
+                if await self.collect() >= self.batch_size:
+                    continue
+
+            except Exception:
+                logger.exception("Garbage collector batch failed")
+
+            await asyncio.sleep(config.GC_INTERVAL)
+
+    async def _reconcile_directory(self, db: AsyncSession, kind: str, directory: Path, cutoff: float) -> int:
+        names = await asyncio.to_thread(_old_entries, directory, cutoff)
+        if not names and kind != "collection":
+            return 0
+
+        if kind == "spool":
+            # Spool files of uploads that crashed before being committed or enqueued
+            return sum(await delete_files([directory / name for name in names]))
+
+        if kind == "jobs":
+            ids = _parse_uuids(names)
+            active = set((await db.execute(
+                sa.select(IngestionJob.id)
+                .where(IngestionJob.id.in_(list(ids)), IngestionJob.status.in_(("queued", "running")))
+            )).scalars()) if ids else set()
+
+            stale = [directory / name for job_id, name in ids.items() if job_id not in active]
+            for path in stale:
+                await asyncio.to_thread(shutil.rmtree, path, ignore_errors=True)
+            return len(stale)
+
+        if kind == "collection":
+            try:
+                owner_id, collection_id = uuid.UUID(directory.parent.name), uuid.UUID(directory.name)
+            except ValueError:
+                return 0
+
+            stored = set((await db.execute(
+                sa.select(Image.stored_filename)
+                .where(
+                    Image.owner_id == owner_id,
+                    Image.collection_id == collection_id,
+                    Image.blob_sha256.is_(None),
+                    Image.stored_filename.in_(names)
+                )
+            )).scalars()) if names else set()
+            deleted = sum(await delete_files([directory / name for name in names if name not in stored]))
+
+            # Directories of deleted collections only; live ones may be receiving an upload right now
+            exists = (await db.execute(sa.select(Collection.id).where(Collection.id == collection_id))).first()
+            if exists is None:
+                await asyncio.to_thread(_remove_empty_directories, directory, directory.parent)
+            return deleted
+
+        # Blob files without a row; rows at ref_count 0 are deleted through their tombstone
+        known = set((await db.execute(sa.select(Blob.sha256).where(Blob.sha256.in_(names)))).scalars())
+        return sum(await delete_files([directory / name for name in names if name not in known]))
+
+    async def reconcile(self) -> int:
+        # Checks the next GC_RECONCILE_DIRECTORIES directories of the storage tree for files no row refers to,
+        # resuming where the previous step stopped; returns how many orphans were deleted
+        async with SessionLocal() as db:
+            locked = (await db.execute(sa.select(sa.func.pg_try_advisory_xact_lock(_RECONCILE_LOCK)))).scalar()
+            if not locked:
+                return 0
+
+            if self._walk is None:
+                self._walk = _storage_directories(config.STORAGE_PATH)
+
+            count = config.GC_RECONCILE_DIRECTORIES
+            directories = await asyncio.to_thread(lambda: list(islice(self._walk, count)))
+            if len(directories) < count:
+                self._walk = None
+                self._reconcile_passes_total += 1
+                self._reconcile_pass_completed_at = time.time()
+
+            cutoff = time.time() - config.GC_GRACE_PERIOD
+            deleted = 0
+            for kind, directory in directories:
+                deleted += await self._reconcile_directory(db, kind, directory, cutoff)
+
+            # Ends the transaction, releasing the advisory lock
+            await db.rollback()
+
+        self._orphans_deleted_total += deleted
+        return deleted
+
+    async def _run_reconciler(self) -> None:
+        while True:
+            try:
+                await self.reconcile()
+            except Exception:
+                self._walk = None
+                logger.exception("Garbage collector reconcile step failed")
+
+            await asyncio.sleep(config.GC_RECONCILE_INTERVAL)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "running": self._deleter is not None and not self._deleter.done(),
+            "tombstones_total": self._tombstones_total,
+            "files_deleted_total": self._files_deleted_total,
+            "orphans_deleted_total": self._orphans_deleted_total,
+            "reconcile_passes_total": self._reconcile_passes_total,
+            "reconcile_pass_completed_at": self._reconcile_pass_completed_at,
+        }
@@ -0,0 +1,489 @@
+import asyncio
+import contextlib
+import datetime as dt
+import logging
+import shutil
+import uuid
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import sqlalchemy as sa
+from PIL import UnidentifiedImageError
+from fastapi import Request
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from finder.config import config
+from finder.db.models.image import Image
+from finder.db.models.image_fingerprint import ImageFingerprint
+from finder.db.models.ingestion_job import IngestionJob
+from finder.db.session import SessionLocal
+from finder.services.derivative_cache import DerivativeCache
+from finder.services.embedding_service import EmbeddingService, EmbeddingUnavailableError
+from finder.services.fingerprint_cache import FingerprintCache
+from finder.services.preprocess_service import PreprocessService
+from finder.services.singleton_base_service import SingletonBaseService
+from finder.utils.budget import UPLOAD_BUDGET
+from finder.utils.duplicates import detect_batch_duplicates
+from finder.utils.files import SpooledFile, commit_blobs, commit_files, delete_files, read_files
+from finder.utils.http import cancel_on_disconnect
+from finder.utils.preprocess import ImageHeader, ImageTooLargeError
+from finder.utils.storage import blob_path, collection_path, job_path
+
+logger = logging.getLogger(__name__)
+
+
+class JobLeaseLostError(Exception):
+    # The job was claimed again by another worker (e.g. after a missed heartbeat) while this one ran it
+    pass
+
+
+@dataclass
+class IngestItem:
+    filename: str
+    content_type: str
+    spooled: SpooledFile
+    # Result of the router's `check_image`, so the file is not probed again before decoding
+    header: Optional[ImageHeader] = None
+
+
+@dataclass
+class FileData:
+    uuid: uuid.UUID
+    item: IngestItem
+    stored_filename: str
+    phash: int
+    embedding: Optional[np.ndarray] = None
+    thumbnail: Optional[bytes] = None
+
+
+@dataclass
+class IngestResult:
+    # `image_ids` is aligned with the ingested items; ids found in `duplicates` were not stored
+    image_ids: List[uuid.UUID]
+    files: List[uuid.UUID] = field(default_factory=list)
+    duplicates: Dict[str, str] = field(default_factory=dict)
+
+    def file_results(self, items: List[IngestItem]) -> List[Dict[str, Optional[str]]]:
+        results = []
+        for item, image_id in zip(items, self.image_ids):
+            duplicate_of = self.duplicates.get(str(image_id))
+            results.append({
+                "filename": item.filename,
+                "status": "duplicate" if duplicate_of is not None else "created",
+                "image_id": str(image_id) if duplicate_of is None else None,
+                "duplicate_of": duplicate_of,
+            })
+
+        return results
+
+
+class IngestionService(SingletonBaseService):
+    def __init__(self):
+        if getattr(self, "_initialized", False):
+            return
+
+        self.embedder = EmbeddingService.get_instance()
+        self.preprocessor = PreprocessService.get_instance()
+        self.fingerprint_cache = FingerprintCache.get_instance()
+        self.derivative_cache = DerivativeCache.get_instance()
+
+        # Background worker for `?async=true` uploads, claiming queued jobs with SKIP LOCKED so any
+        # number of processes can run one
+        self._worker: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._jobs_done = 0
+        self._jobs_failed = 0
+
+        self._initialized = True
+
+    async def _process_window(
+            self,
+            items: List[IngestItem],
+            request: Optional[Request]
+    ) -> Tuple[np.ndarray, np.ndarray, List[Optional[bytes]]]:
+        async with UPLOAD_BUDGET.reserve(sum(item.spooled.size for item in items)):
+            contents = await read_files([item.spooled.path for item in items])
+            headers = [item.header for item in items]
+            batch, phashes, thumbnails = await self.preprocessor.preprocess(
+                contents,
+                self.embedder.backend.input_format.name,
+                [item.filename for item in items],
+                derivative=self.derivative_cache.eager,
+                headers=headers if None not in headers else None
+            )
+            del contents
+
+        embed = self.embedder.embed_batch(batch)
+        embeddings = await (cancel_on_disconnect(request, embed) if request is not None else embed)
+        return phashes, embeddings, thumbnails
+
+    async def ingest(
+            self,
+            db: AsyncSession,
+            owner_id: uuid.UUID,
+            collection_id: uuid.UUID,
+            items: List[IngestItem],
+            detect_duplicates: bool,
+            request: Optional[Request] = None,
+            window_size: int = config.UPLOAD_WINDOW_SIZE,
+            before_commit: Optional[Callable[[AsyncSession, IngestResult], Awaitable[None]]] = None
+    ) -> IngestResult:
+        # Spooled files are decoded `window_size` at a time so memory stays bounded, and renamed into place
+        # once the rows are committed. Raises UnidentifiedImageError (carrying the file name) for unreadable
+        # images, ImageTooLargeError above MAX_IMAGE_PIXELS and EmbeddingUnavailableError when the embedder fails.
+        # `before_commit` runs on `db` right before the final commit, so its writes land in the same transaction.
+        phash_parts: List[np.ndarray] = []
+        embedding_parts: List[np.ndarray] = []
+        thumbnails: List[Optional[bytes]] = []
+        for start in range(0, len(items), window_size):
+            phashes, embeddings, window_thumbnails = await self._process_window(
+                items[start:start + window_size], request
+            )
+            phash_parts.append(phashes)
+            embedding_parts.append(embeddings)
+            thumbnails.extend(window_thumbnails)
+
+        sha256_list = [item.spooled.sha256 for item in items]
+        phash_list = np.concatenate(phash_parts)
+        embeddings = np.concatenate(embedding_parts, axis=0)
+
+        file_datas: List[FileData] = []
+        for item, phash, embedding, thumbnail in zip(items, phash_list, embeddings, thumbnails):
+            uuid_ = uuid.uuid4()
+            file_datas.append(FileData(
+                uuid=uuid_,
+                item=item,
+                stored_filename=f"{uuid_}{Path(item.filename).suffix}",
+                phash=int(phash),
+                embedding=embedding,
+                thumbnail=thumbnail
+            ))
+        result = IngestResult(image_ids=[data.uuid for data in file_datas])
+
+        # Later copies of the same picture within this batch never reach the database
+        batch_duplicates = {}
+        if detect_duplicates:
+            batch_duplicates = await asyncio.to_thread(
+                detect_batch_duplicates,
+                sha256_list,
+                phash_list,
+                embeddings,
+            )
+
+        batch_duplicate_of = {
+            file_datas[later].uuid: file_datas[earlier].uuid
+            for later, (earlier, _layer) in batch_duplicates.items()
+        }
+        file_datas = [data for data in file_datas if data.uuid not in batch_duplicate_of]
+
+        images: List[Image] = []
+        image_fingerprints: List[ImageFingerprint] = []
+        for data in file_datas:
+            images.append(
+                Image(
+                    id=data.uuid,
+                    owner_id=owner_id,
+                    collection_id=collection_id,
+                    stored_filename=data.stored_filename,
+                    original_filename=data.item.filename,
+                    mime_type=data.item.content_type,
+                    size_bytes=data.item.spooled.size,
+                    blob_sha256=data.item.spooled.sha256 if config.STORAGE_LAYOUT == "blobs" else None,
+                )
+            )
+            image_fingerprints.append(
+                ImageFingerprint(
+                    image_id=data.uuid,
+                    sha256=data.item.spooled.sha256,
+                    phash=data.phash,
+                    embedding=data.embedding,
+                )
+            )
+
+        upload_path = collection_path(owner_id, collection_id)
+        try:
+            db.add_all(images)
+            db.add_all(image_fingerprints)
+            await db.flush()
+
+            duplicate_map = {}
+            if detect_duplicates:
+                duplicates = await self.fingerprint_cache.detect_many(db, owner_id, collection_id, image_fingerprints)
+                duplicate_map = {str(image_id): str(dup) for image_id, (dup, _layer) in duplicates.items()}
+                file_datas = [data for data in file_datas if data.uuid not in duplicates]
+
+                for later, earlier in batch_duplicate_of.items():
+                    duplicate_map[str(later)] = duplicate_map.get(str(earlier), str(earlier))
+            result.duplicates = duplicate_map
+
+            if not file_datas:
+                await db.rollback()
+                if before_commit is not None:
+                    await before_commit(db, result)
+                    await db.commit()
+                return result
+
+            for image_fingerprint in image_fingerprints:
+                if str(image_fingerprint.image_id) in duplicate_map:
+                    await db.delete(image_fingerprint)
+
+            for image in images:
+                if str(image.id) in duplicate_map:
+                    await db.delete(image)
+
+            result.files = [data.uuid for data in file_datas]
+            if before_commit is not None:
+                await before_commit(db, result)
+            await db.commit()
+            self.fingerprint_cache.add(collection_id, [
+                image_fingerprint for image_fingerprint in image_fingerprints
+                if str(image_fingerprint.image_id) not in duplicate_map
+            ])
+
+            if config.STORAGE_LAYOUT == "blobs":
+                await commit_blobs([(data.item.spooled.path, blob_path(data.item.spooled.sha256)) for data in file_datas])
+            else:
+                await commit_files([
+                    (data.item.spooled.path, upload_path / data.stored_filename)
+                    for data in file_datas
+                ])
+
+            if self.derivative_cache.eager is not None:
+                width, format_, _quality = self.derivative_cache.eager
+                # Only a cache: a failed write is regenerated on the first request
+                with contextlib.suppress(OSError):
+                    await self.derivative_cache.put_many([
+                        (data.item.spooled.sha256, width, format_, data.thumbnail) for data in file_datas
+                    ])
+
+            return result
+
+        except Exception:
+            await db.rollback()
+            # Blobs may be shared with other images, so they are never removed here
+            if config.STORAGE_LAYOUT == "collections":
+                await delete_files([upload_path / data.stored_filename for data in file_datas])
+            raise
+
+    async def enqueue(
+            self,
+            db: AsyncSession,
+            owner_id: uuid.UUID,
+            collection_id: uuid.UUID,
+            items: List[IngestItem],
+            detect_duplicates: bool
+    ) -> uuid.UUID:
+        # Moves the spooled files into the job's directory, where they stay until the worker is done with them
+        job_id = uuid.uuid4()
+        directory = job_path(job_id)
+        await commit_files([(item.spooled.path, directory / str(i)) for i, item in enumerate(items)])
+
+        try:
+            db.add(IngestionJob(
+                id=job_id,
+                owner_id=owner_id,
+                collection_id=collection_id,
+                detect_duplicates=detect_duplicates,
+                files=[
+                    {
+                        "filename": item.filename,
+                        "content_type": item.content_type,
+                        "size": item.spooled.size,
+                        "sha256": item.spooled.sha256,
+                        "header": asdict(item.header) if item.header is not None else None,
+                    }
+                    for item in items
+                ],
+            ))
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            await asyncio.to_thread(shutil.rmtree, directory, ignore_errors=True)
+            raise
+
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+        return job_id
+
+    def start_worker(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run_worker())
+
+    async def close(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._worker
+            self._worker = None
+
+    async def _claim(self) -> List[sa.Row]:
+        # Jobs still "running" past the lease belong to a worker that died and are taken over
+        expired = dt.datetime.now(dt.timezone.utc) - dt.timedelta(seconds=config.INGESTION_JOB_LEASE)
+        claimable = (
+            sa.select(IngestionJob.id)
+            .where(sa.or_(
+                IngestionJob.status == "queued",
+                sa.and_(IngestionJob.status == "running", IngestionJob.started_at < expired),
+            ))
+            .order_by(IngestionJob.created_at)
+            .limit(config.INGESTION_WORKER_JOBS)
+            .with_for_update(skip_locked=True)
+        )
+
+        async with SessionLocal() as db:
+            rows = (await db.execute(
+                sa.update(IngestionJob)
+                .where(IngestionJob.id.in_(claimable.scalar_subquery()))
+                .values(status="running", attempts=IngestionJob.attempts + 1, started_at=sa.func.now())
+                .returning(
+                    IngestionJob.id,
+                    IngestionJob.owner_id,
+                    IngestionJob.collection_id,
+                    IngestionJob.detect_duplicates,
+                    IngestionJob.files,
+                    IngestionJob.attempts,
+                )
+            )).all()
+            await db.commit()
+
+        return rows
+
+    def _claimed(self, job_id: uuid.UUID, claimed_attempts: int) -> Tuple[sa.ColumnElement[bool], ...]:
+        # Only matches while this worker still holds the claim; a takeover after an expired lease bumps `attempts`
+        return IngestionJob.id == job_id, IngestionJob.status == "running", IngestionJob.attempts == claimed_attempts
+
+    async def _finish(self, job_id: uuid.UUID, claimed_attempts: int, **values: Any) -> None:
+        async with SessionLocal() as db:
+            await db.execute(
+                sa.update(IngestionJob).where(*self._claimed(job_id, claimed_attempts)).values(**values)
+            )
+            await db.commit()
+
+    async def _heartbeat(self, job_id: uuid.UUID, attempts: int) -> None:
+        # Keeps the lease of a slow but healthy job from expiring while it runs
+        while True:
+            await asyncio.sleep(config.INGESTION_JOB_LEASE / 3)
+            try:
+                await self._finish(job_id, attempts, started_at=sa.func.now())
+            except Exception:
+                logger.exception("Heartbeat of ingestion job %s failed", job_id)
+
+    async def _run_job(self, job: sa.Row) -> None:
+        job_id, owner_id, collection_id, detect_duplicates, files, attempts = job
+        directory = job_path(job_id)
+
+        if attempts > config.INGESTION_MAX_ATTEMPTS:
+            await self._finish(
+                job_id, attempts, status="failed", error="Gave up after repeated failures.", finished_at=sa.func.now()
+            )
+            await asyncio.to_thread(shutil.rmtree, directory, ignore_errors=True)
+            self._jobs_failed += 1
+            return
+
+        # Jobs queued before headers were stored are checked again by the preprocessor
+        items = [
+            IngestItem(
+                file["filename"], file["content_type"], SpooledFile(directory / str(i), file["size"], file["sha256"]),
+                ImageHeader(**file["header"]) if file.get("header") else None
+            )
+            for i, file in enumerate(files)
+        ]
+
+        async def record_done(db: AsyncSession, result: IngestResult) -> None:
+            # Written in the ingest transaction, so the images and the job's outcome are committed together
+            done = await db.execute(
+                sa.update(IngestionJob)
+                .where(*self._claimed(job_id, attempts))
+                .values(
+                    status="done",
+                    result={
+                        "status": "duplicate" if not result.files else "partial" if result.duplicates else "created",
+                        "files": result.file_results(items),
+                        "duplicates": result.duplicates,
+                    },
+                    finished_at=sa.func.now()
+                )
+            )
+            if done.rowcount != 1:
+                raise JobLeaseLostError(job_id)
+
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, attempts))
+        try:
+            async with SessionLocal() as db:
+                await self.ingest(
+                    db, owner_id, collection_id, items, detect_duplicates,
+                    window_size=config.INGESTION_WINDOW_SIZE, before_commit=record_done
+                )
+
+        except asyncio.CancelledError:
+            # Shutdown: handed back to the queue right away instead of waiting for the lease to expire
+            await self._finish(job_id, attempts, status="queued", attempts=attempts - 1, started_at=None)
+            raise
+
+        except JobLeaseLostError:
+            # Nothing was committed; the job and its files now belong to the worker that claimed it
+            logger.warning("Ingestion job %s was claimed by another worker", job_id)
+            return
+
+        except EmbeddingUnavailableError:
+            # Not the job's fault: queued again without using up an attempt
+            await self._finish(job_id, attempts, status="queued", attempts=attempts - 1, started_at=None)
+            return
+
+        except (UnidentifiedImageError, ImageTooLargeError) as e:
+            error = str(e) if isinstance(e, ImageTooLargeError) else f"Failed to read image: {e}. The file may be corrupted."
+            await self._finish(job_id, attempts, status="failed", error=error, finished_at=sa.func.now())
+            self._jobs_failed += 1
+
+        except Exception:
+            logger.exception("Ingestion job %s failed", job_id)
+            # A no-op when the failure came after the job was already committed as done
+            if attempts < config.INGESTION_MAX_ATTEMPTS:
+                await self._finish(job_id, attempts, status="queued", started_at=None)
+                return
+
+            await self._finish(
+                job_id, attempts,
+                status="failed", error="Internal error while processing the job.", finished_at=sa.func.now()
+            )
+            self._jobs_failed += 1
+
+        else:
+            self._jobs_done += 1
+
+        finally:
+            heartbeat.cancel()
+
+        await asyncio.to_thread(shutil.rmtree, directory, ignore_errors=True)
+
+    async def _run_worker(self) -> None:
+        while True:
+            try:
+                # Jobs wait while the embedder is down instead of failing
+                jobs = await self._claim() if self.embedder.healthy else []
+                if jobs:
+                    # Claimed jobs run together so the embedding micro-batcher can merge their windows;
+                    # all of them finish before new ones are claimed, even when one fails
+                    results = await asyncio.gather(*(self._run_job(job) for job in jobs), return_exceptions=True)
+                    for job, result in zip(jobs, results):
+                        if isinstance(result, BaseException):
+                            logger.error("Ingestion job %s could not be recorded", job.id, exc_info=result)
+                    continue
+
+            except Exception:
+                logger.exception("Ingestion worker iteration failed")
+
+            self._wakeup.clear()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), config.INGESTION_POLL_INTERVAL)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "worker_running": self._worker is not None and not self._worker.done(),
+            "jobs_done_total": self._jobs_done,
+            "jobs_failed_total": self._jobs_failed,
+        }
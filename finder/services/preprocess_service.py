@@ -0,0 +1,161 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import numpy as np
+from PIL import UnidentifiedImageError
+
+from finder.config import config
+from finder.services.embedding_backends import INPUT_FORMATS
+from finder.services.singleton_base_service import SingletonBaseService
+from finder.utils.budget import PIXEL_BUDGET
+from finder.utils.derivatives import DerivativeFormat
+from finder.utils.hashing import phash_batch
+from finder.utils.preprocess import IMG_SIZE, ImageHeader, check_images, preprocess_into
+
+T = TypeVar("T")
+
+# Batch buffers attached by this worker process, kept for the lifetime of the pool
+_ATTACHED: Dict[str, SharedMemory] = {}
+
+
+def _attach(name: str) -> SharedMemory:
+    if name not in _ATTACHED:
+        # Pool workers share the service's resource tracker, so attaching does not take ownership of the block
+        _ATTACHED[name] = SharedMemory(name=name)
+
+    return _ATTACHED[name]
+
+
+def _preprocess_into_shared(
+        name: str,
+        shape: Tuple[int, ...],
+        dtype: str,
+        index: int,
+        content: bytes,
+        derivative: Optional[Tuple[int, DerivativeFormat, int]]
+) -> Tuple[np.ndarray, Optional[bytes]]:
+    batch = np.ndarray(shape, dtype=dtype, buffer=_attach(name).buf)
+    return preprocess_into(content, batch[index], derivative=derivative)
+
+
+class PreprocessService(SingletonBaseService):
+    def __init__(self):
+        if getattr(self, "_initialized", False):
+            return
+
+        # 0 decodes on threads of this process; otherwise a process pool writes into shared buffers, which are
+        # recycled between batches, so each chunk is copied once into the returned batch
+        self.workers: int = config.PREPROCESS_WORKERS
+        self.max_batch: int = config.PREPROCESS_MAX_BATCH
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._buffers: List[SharedMemory] = []
+        self._free: Optional[asyncio.Queue[SharedMemory]] = None
+
+        self._initialized = True
+
+    def start(self) -> None:
+        # Called from the app lifespan; scripts start the pool on first use
+        if self.workers > 0 and self._pool is None:
+            self._start()
+
+    def _start(self) -> None:
+        # Never fork: the server already runs gRPC, ONNX Runtime and other threads whose locks a forked child
+        # could inherit while held. The forkserver imports this module once and forks workers from that.
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+
+        # One buffer per concurrent batch, sized for the largest input format
+        buffer_size = self.max_batch * max(input_format.image_bytes for input_format in INPUT_FORMATS.values())
+        self._buffers = [SharedMemory(create=True, size=buffer_size) for _ in range(config.PREPROCESS_BUFFERS)]
+        self._free = asyncio.Queue()
+        for buffer in self._buffers:
+            self._free.put_nowait(buffer)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+        for buffer in self._buffers:
+            buffer.close()
+            buffer.unlink()
+        self._buffers = []
+        self._free = None
+
+    async def run(self, func: Callable[..., T], *args: Any, pixels: int = 0, name: Optional[str] = None) -> T:
+        # Runs CPU-bound image work (preprocessing, derivatives) once the `pixels` it decodes fit in the
+        # process-wide decode budget; unreadable images are reported under `name`
+        async with PIXEL_BUDGET.reserve(pixels):
+            try:
+                if self.workers == 0:
+                    return await asyncio.to_thread(func, *args)
+
+                if self._pool is None:
+                    self._start()
+
+                return await asyncio.get_running_loop().run_in_executor(self._pool, func, *args)
+
+            except UnidentifiedImageError as e:
+                if name is None:
+                    raise
+                raise UnidentifiedImageError(name) from e
+
+    async def preprocess(
+            self,
+            contents: List[bytes],
+            input_format: str = "float32",
+            names: Optional[List[str]] = None,
+            derivative: Optional[Tuple[int, DerivativeFormat, int]] = None,
+            headers: Optional[List[ImageHeader]] = None
+    ) -> Tuple[np.ndarray, np.ndarray, List[Optional[bytes]]]:
+        # Returns the model input batch, the pHash of every image (int64) and, when `derivative` is given, the
+        # encoded thumbnail of every image, all from a single decode. `headers` from an earlier `check_images`
+        # of the same files skips the second header probe.
+        input_format = INPUT_FORMATS[input_format]
+        batch = np.empty((len(contents), *input_format.shape), dtype=input_format.dtype)
+        if names is None:
+            names = [None] * len(contents)
+
+        # Headers only: unreadable or oversized images are rejected before anything is decoded
+        if headers is None:
+            headers = await asyncio.to_thread(check_images, contents, names)
+
+        if self.workers == 0:
+            results = await asyncio.gather(*(
+                self.run(
+                    preprocess_into, content, batch[i], (IMG_SIZE, IMG_SIZE), derivative,
+                    pixels=headers[i].decoded_pixels, name=names[i]
+                )
+                for i, content in enumerate(contents)
+            ))
+            phash_inputs, derivatives = zip(*results) if results else ((), ())
+            return batch, phash_batch(phash_inputs), list(derivatives)
+
+        if self._pool is None:
+            self._start()
+
+        results: List[Tuple[np.ndarray, Optional[bytes]]] = []
+        for start in range(0, len(contents), self.max_batch):
+            chunk = contents[start:start + self.max_batch]
+            shape = (len(chunk), *input_format.shape)
+            dtype = np.dtype(input_format.dtype).str
+
+            buffer = await self._free.get()
+            try:
+                results.extend(await asyncio.gather(*(
+                    self.run(
+                        _preprocess_into_shared, buffer.name, shape, dtype, i, content, derivative,
+                        pixels=headers[start + i].decoded_pixels, name=names[start + i]
+                    )
+                    for i, content in enumerate(chunk)
+                )))
+                batch[start:start + len(chunk)] = np.ndarray(shape, dtype=dtype, buffer=buffer.buf)
+            finally:
+                self._free.put_nowait(buffer)
+
+        phash_inputs, derivatives = zip(*results) if results else ((), ())
+        return batch, phash_batch(phash_inputs), list(derivatives)
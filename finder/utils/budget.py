@@ -0,0 +1,47 @@
+import asyncio
+import contextlib
+from typing import AsyncIterator, Dict
+
+from finder.config import config
+
+
+class Budget:
+    # Process-wide cap on a resource held by concurrent work (bytes, decoded pixels): callers wait for room
+    # instead of allocating past it. A single reservation larger than the capacity is clamped so it can still
+    # run alone.
+    def __init__(self, capacity: int, unit: str):
+        self.capacity = capacity
+        self.unit = unit
+        self.used = 0
+        self.waiting = 0
+        self._condition = asyncio.Condition()
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, size: int) -> AsyncIterator[None]:
+        size = min(size, self.capacity)
+        async with self._condition:
+            self.waiting += 1
+            try:
+                await self._condition.wait_for(lambda: self.used + size <= self.capacity)
+            finally:
+                self.waiting -= 1
+            self.used += size
+
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.used -= size
+                self._condition.notify_all()
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            f"capacity_{self.unit}": self.capacity,
+            f"used_{self.unit}": self.used,
+            "waiting": self.waiting,
+        }
+
+
+UPLOAD_BUDGET = Budget(config.UPLOAD_MEMORY_BUDGET, "bytes")
+# Pixels being decoded at once by this process and its preprocessing pool
+PIXEL_BUDGET = Budget(config.DECODE_PIXEL_BUDGET, "pixels")
@@ -0,0 +1,53 @@
+import io
+import os
+import uuid
+from pathlib import Path
+from typing import Literal
+
+from PIL import Image, ImageOps
+
+DerivativeFormat = Literal["webp", "jpeg", "png"]
+
+DERIVATIVE_MEDIA_TYPES = {
+    "webp": "image/webp",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+}
+# EXIF orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def encode_derivative(image: Image.Image, width: int, format_: DerivativeFormat, quality: int) -> bytes:
+    # Downscales to `width` (never upscales) keeping the aspect ratio; `image` must already be upright
+    if image.width > width:
+        size = (width, max(round(image.height * width / image.width), 1))
+        image = image.resize(size, Image.Resampling.BICUBIC, reducing_gap=3.0)
+
+    mode = "RGBA" if format_ != "jpeg" and image.has_transparency_data else "RGB"
+    buffer = io.BytesIO()
+    image.convert(mode).save(buffer, format=format_.upper(), quality=quality)
+    return buffer.getvalue()
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Unique per writer: other workers or the importer may be writing the same derivative right now
+    part = path.with_name(f"{path.name}.{uuid.uuid4().hex}.part")
+    try:
+        part.write_bytes(data)
+        os.replace(part, path)
+    except BaseException:
+        part.unlink(missing_ok=True)
+        raise
+
+
+def render_derivative(src: Path, dst: Path, width: int, format_: DerivativeFormat, quality: int) -> int:
+    # Runs on the preprocessing pool: decodes the original at the smallest JPEG scale covering `width`
+    with Image.open(src) as image:
+        orientation = image.getexif().get(0x0112)
+        image.draft("RGB", (1, width) if orientation in TRANSPOSED_ORIENTATIONS else (width, 1))
+        image = ImageOps.exif_transpose(image)
+        data = encode_derivative(image, width, format_, quality)
+
+    write_atomic(dst, data)
+    return len(data)
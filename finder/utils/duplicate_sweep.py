@@ -0,0 +1,195 @@
+import asyncio
+import uuid
+from typing import AsyncGenerator, Callable, List, Sequence
+
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from finder.config import config
+from finder.db.models.image import Image
+from finder.db.models.image_fingerprint import ImageFingerprint
+from finder.utils.duplicates import detect_embedding_neighbours
+from finder.utils.hashing import PHASH_BAND_WIDTHS, hamming_distances
+
+STREAM_PARTITION_SIZE = 10000
+PAIRWISE_CHUNK_ROWS = 1024
+
+
+class DisjointSet:
+    # Union-find over the collection's image ids, kept as a sorted array of 16-byte UUIDs so that a
+    # million-image collection costs ~20 MB instead of a dict of UUID objects.
+    def __init__(self, image_ids: np.ndarray):
+        self.image_ids = image_ids
+        self.parent = np.arange(len(image_ids), dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.image_ids)
+
+    def index_of(self, image_ids: Sequence[uuid.UUID]) -> np.ndarray:
+        # Ids missing from the set map to -1: each layer reads a newer snapshot than the one the ids were loaded
+        # from, so images uploaded during the sweep show up there and are left out
+        keys = np.array([image_id.bytes for image_id in image_ids], dtype="S16")
+        indexes = np.searchsorted(self.image_ids, keys)
+        found = indexes < len(self.image_ids)
+        found[found] = self.image_ids[indexes[found]] == keys[found]
+        return np.where(found, indexes, -1)
+
+    def uuid_at(self, index: int) -> uuid.UUID:
+        # `S16` strips trailing null bytes on access
+        return uuid.UUID(bytes=self.image_ids[index].ljust(16, b"\0"))
+
+    def find(self, i: int) -> int:
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, a: int, b: int) -> None:
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    def union_pairs(self, a: np.ndarray, b: np.ndarray) -> None:
+        known = (a >= 0) & (b >= 0)
+        for i, j in zip(a[known].tolist(), b[known].tolist()):
+            self.union(i, j)
+
+    def union_group(self, indexes: np.ndarray) -> None:
+        indexes = indexes[indexes >= 0]
+        self.union_pairs(indexes[:1].repeat(max(len(indexes) - 1, 0)), indexes[1:])
+
+    def roots(self) -> np.ndarray:
+        roots = self.parent.copy()
+        while True:
+            next_roots = roots[roots]
+            if np.array_equal(next_roots, roots):
+                return roots
+            roots = next_roots
+
+
+async def _load_image_ids(db: AsyncSession, owner_id: uuid.UUID, collection_id: uuid.UUID) -> np.ndarray:
+    result = await db.stream(
+        sa.select(Image.id).where(Image.owner_id == owner_id, Image.collection_id == collection_id)
+    )
+    chunks = [
+        np.array([image_id.bytes for image_id in image_ids], dtype="S16")
+        async for image_ids in result.scalars().partitions(STREAM_PARTITION_SIZE)
+    ]
+    return np.sort(np.concatenate(chunks)) if chunks else np.array([], dtype="S16")
+
+
+async def _union_sha256(db: AsyncSession, owner_id: uuid.UUID, collection_id: uuid.UUID, groups: DisjointSet) -> None:
+    result = await db.stream(
+        sa.select(sa.func.array_agg(Image.id))
+        .join(ImageFingerprint, ImageFingerprint.image_id == Image.id)
+        .where(Image.owner_id == owner_id, Image.collection_id == collection_id)
+        .group_by(ImageFingerprint.sha256)
+        .having(sa.func.count() > 1)
+    )
+    async for blocks in result.scalars().partitions(STREAM_PARTITION_SIZE):
+        for image_ids in blocks:
+            groups.union_group(groups.index_of(image_ids))
+
+
+def _union_close_phashes(groups: DisjointSet, indexes: np.ndarray, phashes: np.ndarray, bit_diff_tolerance: int) -> None:
+    # Compares a block tile by tile (upper triangle only), so memory stays at PAIRWISE_CHUNK_ROWS² distances
+    # however many images share a band value
+    for row_start in range(0, len(phashes), PAIRWISE_CHUNK_ROWS):
+        row_chunk = phashes[row_start:row_start + PAIRWISE_CHUNK_ROWS]
+        for col_start in range(row_start, len(phashes), PAIRWISE_CHUNK_ROWS):
+            col_chunk = phashes[col_start:col_start + PAIRWISE_CHUNK_ROWS]
+            distances = np.stack([hamming_distances(col_chunk, phash) for phash in row_chunk])
+            rows, cols = np.nonzero(distances <= bit_diff_tolerance)
+            rows += row_start
+            cols += col_start
+            upper = rows < cols
+            groups.union_pairs(indexes[rows[upper]], indexes[cols[upper]])
+
+
+async def _union_phash(
+        db: AsyncSession,
+        owner_id: uuid.UUID,
+        collection_id: uuid.UUID,
+        groups: DisjointSet,
+        bit_diff_tolerance: int
+) -> None:
+    # Band blocking: only images sharing a band value are compared, which finds every pair within
+    # the tolerance as long as it is below the number of bands.
+    for column in ImageFingerprint.phash_band_columns():
+        result = await db.stream(
+            sa.select(sa.func.array_agg(Image.id), sa.func.array_agg(ImageFingerprint.phash))
+            .join(ImageFingerprint, ImageFingerprint.image_id == Image.id)
+            .where(Image.owner_id == owner_id, Image.collection_id == collection_id)
+            .group_by(column)
+            .having(sa.func.count() > 1)
+        )
+        async for blocks in result.partitions(STREAM_PARTITION_SIZE):
+            for image_ids, phashes in blocks:
+                # Off the event loop: a popular band value is quadratic in its size
+                await asyncio.to_thread(
+                    _union_close_phashes,
+                    groups,
+                    groups.index_of(image_ids),
+                    np.asarray(phashes, dtype=np.int64),
+                    bit_diff_tolerance
+                )
+
+
+async def _union_embedding(
+        db: AsyncSession,
+        owner_id: uuid.UUID,
+        collection_id: uuid.UUID,
+        groups: DisjointSet,
+        similarity_threshold: float,
+        k: int,
+        page_size: int
+) -> None:
+    for start in range(0, len(groups), page_size):
+        page = [groups.uuid_at(i) for i in range(start, min(start + page_size, len(groups)))]
+        pairs = await detect_embedding_neighbours(
+            db, owner_id, collection_id, page, similarity_threshold=similarity_threshold, k=k
+        )
+        if pairs:
+            image_ids, neighbour_ids = zip(*pairs)
+            groups.union_pairs(groups.index_of(image_ids), groups.index_of(neighbour_ids))
+
+        # Ends the transaction so the snapshot and the session's identity map do not grow with the sweep
+        await db.rollback()
+
+
+async def sweep_collection(
+        db: AsyncSession,
+        owner_id: uuid.UUID,
+        collection_id: uuid.UUID,
+        bit_diff_tolerance: int = config.PHASH_BIT_DIFF_TOLERANCE,
+        similarity_threshold: float = config.EMBEDDING_SIMILARITY_THRESHOLD,
+        k: int = config.EMBEDDING_KNN_K,
+        page_size: int = 500,
+        log: Callable[[str], None] = lambda _message: None
+) -> AsyncGenerator[List[uuid.UUID], None]:
+    # Groups are only final once every layer has run (a later layer can still merge two of them), so nothing
+    # is yielded before the embedding layer finishes; the groups themselves are then produced one at a time
+    image_ids = await _load_image_ids(db, owner_id, collection_id)
+    groups = DisjointSet(image_ids)
+    log(f"[sweep] images={len(groups)}")
+
+    await _union_sha256(db, owner_id, collection_id, groups)
+    log("[sweep] sha256 done")
+
+    if bit_diff_tolerance >= len(PHASH_BAND_WIDTHS):
+        log(f"[sweep] bit_diff_tolerance={bit_diff_tolerance} exceeds band blocking, phash layer is approximate")
+    await _union_phash(db, owner_id, collection_id, groups, bit_diff_tolerance)
+    log("[sweep] phash done")
+
+    await _union_embedding(db, owner_id, collection_id, groups, similarity_threshold, k, page_size)
+    log("[sweep] embedding done")
+
+    roots = groups.roots()
+    order = np.argsort(roots, kind="stable")
+    sorted_roots = roots[order]
+    boundaries = np.flatnonzero(np.diff(sorted_roots)) + 1
+    for members in np.split(order, boundaries):
+        if len(members) > 1:
+            yield [groups.uuid_at(i) for i in members]
@@ -1,13 +1,16 @@
 import uuid
-from typing import Optional
+from typing import Optional, Sequence, Dict, Tuple, List, Callable
 
+import numpy as np
 import sqlalchemy as sa
 import sqlalchemy.dialects
+from pgvector.sqlalchemy import Vector
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from finder.config import config
 from finder.db.models.image import Image
 from finder.db.models.image_fingerprint import ImageFingerprint
+from finder.utils.hashing import PHASH_BAND_WIDTHS, phash_bands, hamming_distances
 
 
 async def detect_duplicate_sha256(
@@ -49,37 +52,20 @@ async def detect_duplicate_phash(
         image_id: uuid.UUID,
         bit_diff_tolerance: int = config.PHASH_BIT_DIFF_TOLERANCE
 ) -> Optional[uuid.UUID]:
-    target_phash = (
-        sa.select(ImageFingerprint.phash)
+    target = (
+        sa.select(ImageFingerprint.image_id, ImageFingerprint.phash, *ImageFingerprint.phash_band_columns())
         .join(Image, ImageFingerprint.image_id == Image.id)
         .where(
             Image.id == image_id,
             Image.owner_id == owner_id,
             Image.collection_id == collection_id,
         )
-        .scalar_subquery()
+        .subquery("target")
     )
 
-    bit_diff = sa.func.bit_count(
-        sa.cast(
-            ImageFingerprint.phash.op("#")(target_phash),
-            sa.dialects.postgresql.BIT(64)
-        )
-    )
-
-    duplicate_query = (
-        sa.select(Image.id)
-        .join(ImageFingerprint, ImageFingerprint.image_id == Image.id)
-        .where(
-            Image.owner_id == owner_id,
-            Image.collection_id == collection_id,
-            Image.id != image_id,
-            bit_diff <= sa.literal(bit_diff_tolerance, type_=sa.Integer),
-        )
-        .limit(1)
-    )
-
-    return await db.scalar(duplicate_query)
+    result = await db.execute(_phash_layer(target, owner_id, collection_id, bit_diff_tolerance))
+    row = result.first()
+    return row[1] if row else None
 
 
 async def detect_duplicate_embedding(
@@ -87,33 +73,280 @@ async def detect_duplicate_embedding(
         owner_id: uuid.UUID,
         collection_id: uuid.UUID,
         image_id: uuid.UUID,
-        similarity_threshold: float = config.EMBEDDING_SIMILARITY_THRESHOLD
+        similarity_threshold: float = config.EMBEDDING_SIMILARITY_THRESHOLD,
+        k: int = config.EMBEDDING_KNN_K
 ) -> Optional[uuid.UUID]:
-    target_embedding = (
-        sa.select(ImageFingerprint.embedding)
+    target = (
+        sa.select(ImageFingerprint.image_id, ImageFingerprint.embedding)
         .join(Image, ImageFingerprint.image_id == Image.id)
         .where(
             Image.id == image_id,
             Image.owner_id == owner_id,
             Image.collection_id == collection_id,
         )
-        .scalar_subquery()
+        .subquery("target")
     )
 
-    similarity = sa.literal(1.0, type_=sa.Float) - (
-        ImageFingerprint.embedding.op("<=>")(target_embedding)
+    await set_embedding_search_params(db)
+    result = await db.execute(_embedding_layer(target, owner_id, collection_id, similarity_threshold, k))
+    row = result.first()
+    return row[1] if row else None
+
+
+DuplicateMatch = Tuple[uuid.UUID, str]
+
+
+def _target_subquery(targets: Sequence[uuid.UUID | ImageFingerprint]) -> sa.Subquery:
+    if all(isinstance(target, uuid.UUID) for target in targets):
+        return (
+            sa.select(
+                ImageFingerprint.image_id,
+                ImageFingerprint.sha256,
+                ImageFingerprint.phash,
+                *ImageFingerprint.phash_band_columns(),
+                ImageFingerprint.embedding,
+            )
+            .where(ImageFingerprint.image_id.in_(targets))
+            .subquery("target")
+        )
+
+    values = sa.values(
+        sa.column("image_id", sa.UUID(as_uuid=True)),
+        sa.column("sha256", sa.String(64)),
+        sa.column("phash", sa.BigInteger),
+        *(sa.column(column.key, sa.SmallInteger) for column in ImageFingerprint.phash_band_columns()),
+        sa.column("embedding", Vector(512)),
+        name="target_values",
+    ).data([
+        (target.image_id, target.sha256, target.phash, *phash_bands(target.phash), target.embedding)
+        for target in targets
+    ])
+
+    return (
+        sa.select(
+            values.c.image_id,
+            values.c.sha256,
+            values.c.phash,
+            *(values.c[column.key] for column in ImageFingerprint.phash_band_columns()),
+            sa.cast(values.c.embedding, Vector(512)).label("embedding"),
+        )
+        .subquery("target")
     )
 
-    duplicate_query = (
+
+def _not_target(target: sa.Subquery, exclude_ids: Optional[Sequence[uuid.UUID]]) -> sa.ColumnElement[bool]:
+    if exclude_ids is None:
+        return Image.id != target.c.image_id
+
+    # A single array parameter excluding the whole batch
+    return Image.id != sa.all_(sa.literal(list(exclude_ids), sa.dialects.postgresql.ARRAY(sa.UUID(as_uuid=True))))
+
+
+def _first_match(
+        target: sa.Subquery,
+        owner_id: uuid.UUID,
+        collection_id: uuid.UUID,
+        condition: sa.ColumnElement[bool],
+        exclude_ids: Optional[Sequence[uuid.UUID]] = None
+) -> sa.Select:
+    match = (
         sa.select(Image.id)
         .join(ImageFingerprint, ImageFingerprint.image_id == Image.id)
         .where(
             Image.owner_id == owner_id,
             Image.collection_id == collection_id,
-            Image.id != image_id,
-            similarity >= sa.literal(similarity_threshold),
+            _not_target(target, exclude_ids),
+            condition,
         )
         .limit(1)
+        .lateral("match")
     )
 
-    return await db.scalar(duplicate_query)
+    return sa.select(target.c.image_id, match.c.id).join(match, sa.true())
+
+
+def _sha256_layer(
+        target: sa.Subquery,
+        owner_id: uuid.UUID,
+        collection_id: uuid.UUID,
+        exclude_ids: Optional[Sequence[uuid.UUID]] = None
+) -> sa.Select:
+    return _first_match(target, owner_id, collection_id, ImageFingerprint.sha256 == target.c.sha256, exclude_ids)
+
+
+def _phash_layer(
+        target: sa.Subquery,
+        owner_id: uuid.UUID,
+        collection_id: uuid.UUID,
+        bit_diff_tolerance: int,
+        exclude_ids: Optional[Sequence[uuid.UUID]] = None
+) -> sa.Select:
+    bit_diff = sa.func.bit_count(
+        sa.cast(
+            ImageFingerprint.phash.op("#")(target.c.phash),
+            sa.dialects.postgresql.BIT(64)
+        )
+    )
+    conditions = [bit_diff <= sa.literal(bit_diff_tolerance, type_=sa.Integer)]
+
+    # Any hash within the tolerance shares at least one band with the target, so the exact popcount
+    # only runs on rows fetched through the band indexes. Larger tolerances fall back to a full scan.
+    if bit_diff_tolerance < len(PHASH_BAND_WIDTHS):
+        conditions.append(sa.or_(*(
+            column == target.c[column.key]
+            for column in ImageFingerprint.phash_band_columns()
+        )))
+
+    return _first_match(target, owner_id, collection_id, sa.and_(*conditions), exclude_ids)
+
+
+def _embedding_neighbours(
+        target: sa.Subquery,
+        owner_id: uuid.UUID,
+        collection_id: uuid.UUID,
+        similarity_threshold: float,
+        k: int,
+        exclude_ids: Optional[Sequence[uuid.UUID]] = None
+) -> sa.Select:
+    distance = ImageFingerprint.embedding.op("<=>", return_type=sa.Float)(target.c.embedding)
+
+    # k-NN ordered by cosine distance so the HNSW index can serve it; the threshold is applied afterwards
+    neighbours = (
+        sa.select(Image.id, distance.label("distance"))
+        .join(ImageFingerprint, ImageFingerprint.image_id == Image.id)
+        .where(
+            Image.owner_id == owner_id,
+            Image.collection_id == collection_id,
+            _not_target(target, exclude_ids),
+        )
+        .order_by(distance)
+        .limit(k)
+        .lateral("neighbours")
+    )
+
+    return (
+        sa.select(target.c.image_id, neighbours.c.id, neighbours.c.distance)
+        .join(neighbours, sa.true())
+        .where(sa.literal(1.0, type_=sa.Float) - neighbours.c.distance >= sa.literal(similarity_threshold))
+    )
+
+
+def _embedding_layer(
+        target: sa.Subquery,
+        owner_id: uuid.UUID,
+        collection_id: uuid.UUID,
+        similarity_threshold: float,
+        k: int,
+        exclude_ids: Optional[Sequence[uuid.UUID]] = None
+) -> sa.Select:
+    neighbours = _embedding_neighbours(target, owner_id, collection_id, similarity_threshold, k, exclude_ids).subquery()
+    return (
+        sa.select(neighbours.c.image_id, neighbours.c.id)
+        .order_by(neighbours.c.image_id, neighbours.c.distance)
+        .distinct(neighbours.c.image_id)
+    )
+
+
+async def set_embedding_search_params(
+        db: AsyncSession,
+        ef_search: int = config.EMBEDDING_HNSW_EF_SEARCH,
+        iterative_scan: str = config.EMBEDDING_HNSW_ITERATIVE_SCAN
+) -> None:
+    # Transaction-local, so it has to be set again after every commit
+    settings = [sa.func.set_config("hnsw.ef_search", str(ef_search), True)]
+    # hnsw.iterative_scan only exists from pgvector 0.8 on; leaving it unset (or off) works with older versions
+    if iterative_scan and iterative_scan != "off":
+        settings.append(sa.func.set_config("hnsw.iterative_scan", iterative_scan, True))
+    await db.execute(sa.select(*settings))
+
+
+async def detect_duplicates_many(
+        db: AsyncSession,
+        owner_id: uuid.UUID,
+        collection_id: uuid.UUID,
+        targets: Sequence[uuid.UUID | ImageFingerprint],
+        bit_diff_tolerance: int = config.PHASH_BIT_DIFF_TOLERANCE,
+        similarity_threshold: float = config.EMBEDDING_SIMILARITY_THRESHOLD,
+        k: int = config.EMBEDDING_KNN_K
+) -> Dict[uuid.UUID, DuplicateMatch]:
+    # Targets are never matched against each other: copies within one batch are resolved beforehand by
+    # `detect_batch_duplicates`, which keeps the first and drops the rest, while matching here would flag both
+    batch_ids = [target if isinstance(target, uuid.UUID) else target.image_id for target in targets]
+    layers: List[Tuple[str, Callable[[sa.Subquery], sa.Select]]] = [
+        ("sha256", lambda target: _sha256_layer(target, owner_id, collection_id, batch_ids)),
+        ("phash", lambda target: _phash_layer(target, owner_id, collection_id, bit_diff_tolerance, batch_ids)),
+        ("embedding", lambda target: _embedding_layer(
+            target, owner_id, collection_id, similarity_threshold, k, batch_ids
+        )),
+    ]
+
+    duplicates: Dict[uuid.UUID, DuplicateMatch] = {}
+    remaining = list(targets)
+    for layer, build_query in layers:
+        if not remaining:
+            break
+
+        if layer == "embedding":
+            await set_embedding_search_params(db)
+
+        result = await db.execute(build_query(_target_subquery(remaining)))
+        for image_id, duplicate_id in result.all():
+            duplicates[image_id] = (duplicate_id, layer)
+
+        remaining = [
+            target for target in remaining
+            if (target if isinstance(target, uuid.UUID) else target.image_id) not in duplicates
+        ]
+
+    return duplicates
+
+
+async def detect_embedding_neighbours(
+        db: AsyncSession,
+        owner_id: uuid.UUID,
+        collection_id: uuid.UUID,
+        image_ids: Sequence[uuid.UUID],
+        similarity_threshold: float = config.EMBEDDING_SIMILARITY_THRESHOLD,
+        k: int = config.EMBEDDING_KNN_K
+) -> List[Tuple[uuid.UUID, uuid.UUID]]:
+    if not image_ids:
+        return []
+
+    await set_embedding_search_params(db)
+    neighbours = _embedding_neighbours(_target_subquery(image_ids), owner_id, collection_id, similarity_threshold, k)
+    result = await db.execute(neighbours)
+    return [(image_id, neighbour_id) for image_id, neighbour_id, _distance in result.all()]
+
+
+def detect_batch_duplicates(
+        sha256_list: Sequence[str],
+        phashes: Sequence[int],
+        embeddings: np.ndarray,
+        bit_diff_tolerance: int = config.PHASH_BIT_DIFF_TOLERANCE,
+        similarity_threshold: float = config.EMBEDDING_SIMILARITY_THRESHOLD
+) -> Dict[int, Tuple[int, str]]:
+    # In-memory pass over a single batch: every later copy maps to the index of the first kept image it
+    # duplicates, so only the first copy reaches the database. Dropped copies are not compared against.
+    phash_array = np.asarray(phashes, dtype=np.int64)
+    distances = np.stack([hamming_distances(phash_array, phash) for phash in phash_array])
+
+    normalized = np.asarray(embeddings, dtype=np.float32)
+    normalized = normalized / (np.linalg.norm(normalized, axis=1, keepdims=True) + 1e-12)
+    gram = normalized @ normalized.T
+
+    duplicates: Dict[int, Tuple[int, str]] = {}
+    kept: List[int] = []
+    for i in range(len(sha256_list)):
+        layers = (
+            ("sha256", [j for j in kept if sha256_list[j] == sha256_list[i]]),
+            ("phash", [j for j in kept if distances[i, j] <= bit_diff_tolerance]),
+            ("embedding", [j for j in kept if gram[i, j] >= similarity_threshold]),
+        )
+        match = next(((matches[0], layer) for layer, matches in layers if matches), None)
+
+        if match is None:
+            kept.append(i)
+        else:
+            duplicates[i] = match
+
+    return duplicates
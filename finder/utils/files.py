@@ -1,6 +1,9 @@
 import asyncio
+import hashlib
 import io
+import os
 import shutil
+from dataclasses import dataclass
 from itertools import repeat
 from pathlib import Path
 from typing import Tuple, List, Optional
@@ -12,6 +15,9 @@ from PIL import Image, UnidentifiedImageError
 from fastapi import UploadFile
 
 from finder.config import config
+from finder.utils.budget import PIXEL_BUDGET
+from finder.utils.preprocess import check_image
+from finder.utils.storage import spool_path
 
 
 class FileTooLargeError(Exception):
@@ -19,55 +25,104 @@ class FileTooLargeError(Exception):
 
 
 SEM = asyncio.Semaphore(config.MAX_CONCURRENT_IO)
+CHUNK_SIZE = 1024 * 1024
 
 
-async def read_file_from_upload_file(file: UploadFile, max_file_size: int) -> bytes:
-    data = bytearray()
-    while chunk := await file.read(1024 * 1024):
-        data.extend(chunk)
-        if len(data) > max_file_size:
-            raise FileTooLargeError(f"File exceeds max file size: '{file.filename}'")
+@dataclass
+class SpooledFile:
+    path: Path
+    size: int
+    sha256: str
 
-    return bytes(data)
 
+async def spool_upload_file(file: UploadFile, max_file_size: int) -> SpooledFile:
+    # Streams the upload to a temp file on the storage volume, hashing it on the way; nothing is kept in memory
+    path = spool_path()
+    async with SEM:
+        path.parent.mkdir(parents=True, exist_ok=True)
 
-async def read_files_from_upload_file(files: List[UploadFile], max_file_size: int) -> List[bytes]:
-    tasks = [read_file_from_upload_file(file, max_file_size) for file in files]
-    return await asyncio.gather(*tasks)
+        size = 0
+        digest = hashlib.sha256()
+        try:
+            async with aiofiles.open(path, "wb") as f:
+                while chunk := await file.read(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_file_size:
+                        raise FileTooLargeError(f"File exceeds max file size: '{file.filename}'")
+                    digest.update(chunk)
+                    await f.write(chunk)
+        except BaseException:
+            path.unlink(missing_ok=True)
+            raise
+
+        return SpooledFile(path=path, size=size, sha256=digest.hexdigest())
+
+
+async def spool_upload_files(files: List[UploadFile], max_file_size: int) -> List[SpooledFile]:
+    results = await asyncio.gather(
+        *(spool_upload_file(file, max_file_size) for file in files), return_exceptions=True
+    )
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        await delete_files([result.path for result in results if isinstance(result, SpooledFile)])
+        raise errors[0]
 
+    return results
 
-async def write_file_bytes(data: bytes, path: Path) -> None:
+
+async def commit_file(src: Path, dst: Path) -> None:
     async with SEM:
-        path.parent.mkdir(parents=True, exist_ok=True)
-        async with aiofiles.open(path, "wb") as f:
-            await f.write(data)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(os.replace, src, dst)
 
 
-async def write_files_bytes(data_list: List[Tuple[bytes, Path]]) -> None:
-    tasks = [write_file_bytes(data, path) for data, path in data_list]
-    await asyncio.gather(*tasks)
+async def commit_files(files: List[Tuple[Path, Path]]) -> None:
+    await asyncio.gather(*(commit_file(src, dst) for src, dst in files))
 
 
-async def write_file(file: UploadFile, path: Path, max_file_size: int) -> bytes:
+def _commit_blob(src: Path, dst: Path) -> None:
+    # Blobs are named by their content, so an existing one already holds these bytes
+    if dst.exists():
+        return
+
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(src, dst)
+
+
+async def commit_blobs(files: List[Tuple[Path, Path]]) -> None:
+    async def commit(src: Path, dst: Path) -> None:
+        async with SEM:
+            await asyncio.to_thread(_commit_blob, src, dst)
+
+    await asyncio.gather(*(commit(src, dst) for src, dst in files))
+
+
+async def write_blobs(data_list: List[Tuple[bytes, Path]]) -> None:
+    # Written under a temporary name first, so a blob path never holds partial content
+    async def write(data: bytes, dst: Path) -> None:
+        if dst.exists():
+            return
+
+        src = spool_path()
+        await write_file_bytes(data, src)
+        try:
+            await commit_blobs([(src, dst)])
+        finally:
+            src.unlink(missing_ok=True)
+
+    await asyncio.gather(*(write(data, dst) for data, dst in data_list))
+
+
+async def write_file_bytes(data: bytes, path: Path) -> None:
     async with SEM:
         path.parent.mkdir(parents=True, exist_ok=True)
-
-        data = bytearray()
         async with aiofiles.open(path, "wb") as f:
-            while chunk := await file.read(1024 * 1024):
-                data.extend(chunk)
-                await f.write(chunk)
-                if len(data) > max_file_size:
-                    await f.close()
-                    path.unlink(missing_ok=True)
-                    raise FileTooLargeError(f"File exceeds max file size: '{file.filename}'")
-
-        return bytes(data)
+            await f.write(data)
 
 
-async def write_files(files: List[Tuple[UploadFile, Path]], max_file_size: int) -> List[bytes]:
-    tasks = [write_file(file, path, max_file_size) for file, path in files]
-    return await asyncio.gather(*tasks)
+async def write_files_bytes(data_list: List[Tuple[bytes, Path]]) -> None:
+    tasks = [write_file_bytes(data, path) for data, path in data_list]
+    await asyncio.gather(*tasks)
 
 
 async def delete_file(path: Path) -> bool:
@@ -86,7 +141,9 @@ async def delete_files(paths: List[Path]) -> List[bool]:
 
 
 async def load_image_from_bytes(b: bytes, name: Optional[str] = None) -> Image.Image:
-    async with SEM:
+    # Full decode: checked against MAX_IMAGE_PIXELS and admitted through the decode budget by its full size
+    header = await asyncio.to_thread(check_image, b, name)
+    async with SEM, PIXEL_BUDGET.reserve(header.pixels):
         try:
             image = await asyncio.to_thread(Image.open, io.BytesIO(b))
             await asyncio.to_thread(image.load)
@@ -104,6 +161,30 @@ async def load_images_from_bytes(bytes_list: List[bytes], names: Optional[List[s
     )
 
 
+def _link_file(src: Path, dst: Path) -> None:
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        pass
+    except FileNotFoundError:
+        return
+    except OSError:
+        shutil.copy2(src, dst)
+
+    # Counts as a new file for the garbage collector's grace period until its row is committed
+    os.utime(dst)
+
+
+async def link_files(files: List[Tuple[Path, Path]]) -> None:
+    # Gives each file a second name, so the source stays valid until the change is committed
+    async def link(src: Path, dst: Path) -> None:
+        async with SEM:
+            await asyncio.to_thread(_link_file, src, dst)
+
+    await asyncio.gather(*(link(src, dst) for src, dst in files))
+
+
 async def move_file(src: Path, dst: Path):
     async with SEM:
         await asyncio.to_thread(shutil.move, src, dst)
@@ -126,6 +207,23 @@ async def read_files(paths: List[Path]) -> List[bytes]:
     return await asyncio.gather(*tasks)
 
 
+async def read_file_with_sha256(path: Path) -> Tuple[bytes, str]:
+    async with SEM:
+        data = bytearray()
+        digest = hashlib.sha256()
+        async with aiofiles.open(path, "rb") as f:
+            while chunk := await f.read(CHUNK_SIZE):
+                data.extend(chunk)
+                digest.update(chunk)
+
+        return bytes(data), digest.hexdigest()
+
+
+async def read_files_with_sha256(paths: List[Path]) -> List[Tuple[bytes, str]]:
+    tasks = [read_file_with_sha256(path) for path in paths]
+    return await asyncio.gather(*tasks)
+
+
 async def get_mime_type(path: Path) -> str:
     async with SEM:
         async with aiofiles.open(path, 'rb') as file:
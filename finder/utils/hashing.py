@@ -1,11 +1,22 @@
 import asyncio
 import hashlib
-from typing import List
+from typing import List, Sequence, Tuple
 
 import imagehash
+import numpy as np
+import scipy.fftpack
 from PIL import Image
 
 
+# 64-bit pHash split into 6 bands (MSB first). By the pigeonhole principle, two hashes within
+# `len(PHASH_BAND_WIDTHS) - 1` differing bits share at least one band exactly.
+PHASH_BAND_WIDTHS: Tuple[int, ...] = (11, 11, 11, 11, 10, 10)
+
+# imagehash.phash defaults: an 8x8 low-frequency block of the DCT of a 32x32 grayscale image
+PHASH_SIZE = 8
+PHASH_HIGHFREQ_FACTOR = 4
+
+
 def sha256_bytes(data: bytes) -> str:
     return hashlib.sha256(data).hexdigest()
 
@@ -15,6 +26,42 @@ def phash(image: Image.Image, hash_size: int = 8) -> bytes:
     return bytes.fromhex(str(ih))
 
 
+def phash_pixels(image: Image.Image) -> np.ndarray:
+    # The grayscale thumbnail imagehash.phash runs its DCT on
+    size = PHASH_SIZE * PHASH_HIGHFREQ_FACTOR
+    return np.asarray(image.convert("L").resize((size, size), Image.Resampling.LANCZOS))
+
+
+def phash_batch(pixels: Sequence[np.ndarray]) -> np.ndarray:
+    # `pixels` holds the `phash_pixels` of every image. Runs the same scipy DCT, median and row-major,
+    # MSB-first bit order as imagehash.phash for the whole batch at once, so results are bit-identical.
+    # Returned as int64 like the `image_fingerprints.phash` column (the two's complement of the hash bits).
+    if len(pixels) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    pixels = np.stack(pixels)
+    dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=1), axis=2)
+    low = dct[:, :PHASH_SIZE, :PHASH_SIZE].reshape(len(pixels), -1)
+    bits = low > np.median(low, axis=1, keepdims=True)
+    return np.packbits(bits, axis=1).view(">i8").ravel().astype(np.int64)
+
+
+def phash_bands(phash_value: int) -> Tuple[int, ...]:
+    value = phash_value & 0xFFFFFFFFFFFFFFFF
+    bands = []
+    shift = 64
+    for width in PHASH_BAND_WIDTHS:
+        shift -= width
+        bands.append((value >> shift) & ((1 << width) - 1))
+
+    return tuple(bands)
+
+
+def hamming_distances(phashes: np.ndarray, target: int | np.integer) -> np.ndarray:
+    xor = phashes.view(np.uint64) ^ np.asarray(target, dtype=np.int64).view(np.uint64)
+    return np.bitwise_count(xor)
+
+
 async def sha256_many(data_list: List[bytes]) -> List[str]:
     tasks = [asyncio.to_thread(sha256_bytes, b) for b in data_list]
     return await asyncio.gather(*tasks)
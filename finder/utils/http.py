@@ -0,0 +1,76 @@
+import asyncio
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Awaitable, TypeVar
+
+from fastapi import HTTPException, Request, Response, status
+from fastapi.responses import FileResponse
+
+from finder.config import config
+
+T = TypeVar("T")
+
+# Non-standard (nginx) status for requests whose client went away before the response
+CLIENT_CLOSED_REQUEST = 499
+
+
+async def cancel_on_disconnect(request: Request, awaitable: Awaitable[T], poll_interval: float = 0.1) -> T:
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+
+            if await request.is_disconnected():
+                task.cancel()
+                raise HTTPException(CLIENT_CLOSED_REQUEST, "Client closed the request.")
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+
+    # If-None-Match uses the weak comparison
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+    return False
+
+
+async def file_response(
+        request: Request,
+        path: Path,
+        media_type: str,
+        etag: str,
+        cache_control: str = config.IMAGE_CACHE_CONTROL
+) -> Response:
+    # Streams the file from disk (zero-copy when the server supports the ASGI pathsend extension),
+    # with Range support from FileResponse and conditional requests answered with 304
+    try:
+        stat_result = await asyncio.to_thread(os.stat, path)
+    except (FileNotFoundError, PermissionError):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="The requested file was not found.")
+
+    headers = {"etag": etag, "cache-control": cache_control}
+    if _not_modified(request, etag, stat_result.st_mtime):
+        headers["last-modified"] = formatdate(stat_result.st_mtime, usegmt=True)
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result)
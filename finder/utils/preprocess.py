@@ -1,13 +1,78 @@
 import asyncio
+import io
 import os
-from typing import Tuple, List
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Tuple, List, Literal, Optional, Union
 
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from finder.config import config
+from finder.utils.derivatives import DerivativeFormat, encode_derivative
+from finder.utils.hashing import phash_pixels
 
 IMG_SIZE = 224
 CLIP_MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
 CLIP_STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+# Shorter side of the intermediate thumbnail that both the CLIP input and the pHash are derived from
+THUMBNAIL_MIN_SIDE = IMG_SIZE * 2
+
+
+class ImageTooLargeError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class ImageHeader:
+    width: int
+    height: int
+    mode: str
+    format: Optional[str]
+    # Pixels the decoder materializes after `draft`, i.e. the reduced DCT scale for JPEGs
+    decoded_pixels: int
+
+    @property
+    def pixels(self) -> int:
+        return self.width * self.height
+
+
+def probe_image(
+        source: Union[bytes, Path],
+        draft_size: Tuple[int, int] = (THUMBNAIL_MIN_SIDE, THUMBNAIL_MIN_SIDE)
+) -> ImageHeader:
+    # Parses only the header; nothing is decoded
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as image:
+        width, height = image.size
+        header = (width, height, image.mode, image.format)
+        image.draft("RGB", draft_size)
+        return ImageHeader(*header, decoded_pixels=image.width * image.height)
+
+
+def check_image(
+        source: Union[bytes, Path],
+        name: Optional[str] = None,
+        max_pixels: int = config.MAX_IMAGE_PIXELS,
+        draft_size: Tuple[int, int] = (THUMBNAIL_MIN_SIDE, THUMBNAIL_MIN_SIDE)
+) -> ImageHeader:
+    # Cheap rejection of unreadable or oversized images from the header alone
+    try:
+        header = probe_image(source, draft_size)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(f"Image exceeds max pixel count: '{name}'") from e
+    except FileNotFoundError:
+        raise
+    except (UnidentifiedImageError, OSError, SyntaxError) as e:
+        raise UnidentifiedImageError(name) from e
+
+    if header.pixels > max_pixels:
+        raise ImageTooLargeError(f"Image exceeds max pixel count: '{name}'")
+
+    return header
+
+
+def check_images(sources: List[Union[bytes, Path]], names: List[Optional[str]]) -> List[ImageHeader]:
+    return [check_image(source, name) for source, name in zip(sources, names)]
 
 
 def preprocess_image(image: Image.Image, img_size: Tuple[int, int] = (IMG_SIZE, IMG_SIZE)) -> np.ndarray:
@@ -19,7 +84,75 @@ def preprocess_image(image: Image.Image, img_size: Tuple[int, int] = (IMG_SIZE,
     return arr
 
 
-async def preprocess_many(images: List[Image.Image]) -> np.ndarray[np.float32]:
+def preprocess_image_uint8(image: Image.Image, img_size: Tuple[int, int] = (IMG_SIZE, IMG_SIZE)) -> np.ndarray:
+    # Same resized pixels as `preprocess_image`, left as HWC uint8 for models that normalize in-graph
+    image = image.convert("RGB")
+    img = image.resize(img_size, Image.Resampling.BICUBIC)
+    return np.asarray(img, dtype=np.uint8)
+
+
+def _downscale_thumbnail(image: Image.Image) -> Image.Image:
+    scale = THUMBNAIL_MIN_SIDE / min(image.size)
+    if scale < 1:
+        size = (max(round(image.width * scale), 1), max(round(image.height * scale), 1))
+        image = image.resize(size, Image.Resampling.BICUBIC, reducing_gap=3.0)
+
+    return image
+
+
+def decode_thumbnail(content: bytes, keep_alpha: bool = False) -> Tuple[Image.Image, Optional[Image.Image]]:
+    # Returns the RGB thumbnail and, with `keep_alpha` and a source with transparency, an RGBA one as well
+    with Image.open(io.BytesIO(content)) as image:
+        # JPEGs are decoded at the smallest DCT scale still covering the thumbnail, other formats in full
+        image.draft("RGB", (THUMBNAIL_MIN_SIDE, THUMBNAIL_MIN_SIDE))
+        rgb = image.convert("RGB")
+        rgba = image.convert("RGBA") if keep_alpha and image.has_transparency_data else None
+
+    # Resized separately: RGBA is resampled with premultiplied alpha, which would change the CLIP and pHash input
+    return _downscale_thumbnail(rgb), _downscale_thumbnail(rgba) if rgba is not None else None
+
+
+def write_pixels(img: Image.Image, out: np.ndarray) -> None:
+    # Writes into a slot of a preallocated batch: HWC for uint8, normalized CHW (in place) for float32
+    pixels = np.asarray(img)
+    if out.dtype == np.uint8:
+        out[...] = pixels
+        return
+
+    out[...] = pixels.transpose(2, 0, 1)
+    out /= 255.0
+    out -= CLIP_MEAN[:, None, None]
+    out /= CLIP_STD[:, None, None]
+
+
+def preprocess_into(
+        content: bytes,
+        out: np.ndarray,
+        img_size: Tuple[int, int] = (IMG_SIZE, IMG_SIZE),
+        derivative: Optional[Tuple[int, DerivativeFormat, int]] = None
+) -> Tuple[np.ndarray, Optional[bytes]]:
+    # Decodes once and derives the CLIP input (written to `out`), the pHash input (see `phash_batch`) and,
+    # when `derivative` (width, format, quality) is given, an encoded thumbnail from the same intermediate image.
+    # The derivative width must not exceed THUMBNAIL_MIN_SIDE.
+    thumbnail, transparent = decode_thumbnail(content, keep_alpha=derivative is not None)
+    write_pixels(thumbnail.resize(img_size, Image.Resampling.BICUBIC), out)
+
+    encoded = None
+    if derivative is not None:
+        # Keeps the alpha channel like `render_derivative`, since both are stored under the same key
+        encoded = encode_derivative(ImageOps.exif_transpose(transparent or thumbnail), *derivative)
+
+    return phash_pixels(thumbnail), encoded
+
+
+async def preprocess_many(
+        images: List[Image.Image],
+        input_format: Literal["float32", "uint8"] = "float32"
+) -> np.ndarray:
+    if input_format == "uint8":
+        tasks = [asyncio.to_thread(preprocess_image_uint8, img) for img in images]
+        return np.stack(await asyncio.gather(*tasks), axis=0)
+
     tasks = [asyncio.to_thread(preprocess_image, img) for img in images]
     arrays = await asyncio.gather(*tasks)
     return np.stack(arrays, axis=0).astype(np.float32)
@@ -0,0 +1,34 @@
+import uuid
+from pathlib import Path
+
+from finder.config import config
+from finder.db.models.image import Image
+
+
+def collection_path(owner_id: uuid.UUID, collection_id: uuid.UUID) -> Path:
+    return config.STORAGE_PATH / "collections" / str(owner_id) / str(collection_id)
+
+
+def image_path(owner_id: uuid.UUID, collection_id: uuid.UUID, stored_filename: str) -> Path:
+    return collection_path(owner_id, collection_id) / stored_filename
+
+
+def blob_path(sha256: str) -> Path:
+    # Two fan-out levels keep directories small with millions of blobs
+    return config.STORAGE_PATH / "blobs" / sha256[:2] / sha256[2:4] / sha256
+
+
+def stored_path(image: Image) -> Path:
+    if image.blob_sha256 is not None:
+        return blob_path(image.blob_sha256)
+
+    return image_path(image.owner_id, image.collection_id, image.stored_filename)
+
+
+def job_path(job_id: uuid.UUID) -> Path:
+    return config.STORAGE_PATH / "jobs" / str(job_id)
+
+
+def spool_path() -> Path:
+    # Kept on the storage volume so committing a spooled file is an atomic rename
+    return config.STORAGE_PATH / "spool" / f"{uuid.uuid4()}.part"
@@ -1,16 +1,31 @@
 import contextlib
 
 from fastapi import FastAPI
-from fastapi.concurrency import run_in_threadpool
 
+from finder.config import config
 from finder.routers import register_routers
 from finder.services.embedding_service import EmbeddingService
+from finder.services.garbage_collector import GarbageCollector
+from finder.services.ingestion_service import IngestionService
+from finder.services.preprocess_service import PreprocessService
 
 
 @contextlib.asynccontextmanager
 async def lifespan(_app: FastAPI):
-    await run_in_threadpool(EmbeddingService.get_instance)
+    embedder = EmbeddingService.get_instance()
+    embedder.start_health_monitor()
+    PreprocessService.get_instance().start()
+    ingestion = IngestionService.get_instance()
+    if config.INGESTION_WORKER_ENABLED:
+        ingestion.start_worker()
+    garbage_collector = GarbageCollector.get_instance()
+    if config.GC_ENABLED:
+        garbage_collector.start()
     yield
+    await garbage_collector.close()
+    await ingestion.close()
+    await embedder.close()
+    PreprocessService.get_instance().close()
 
 app = FastAPI(lifespan=lifespan)
 register_routers(app)
@@ -0,0 +1,68 @@
+"""content addressed blobs
+
+Revision ID: 3e8f5a2c7b19
+Revises: 9d41c6b2e8a7
+Create Date: 2026-10-17 09:41:52.318406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3e8f5a2c7b19'
+down_revision: Union[str, Sequence[str], None] = '9d41c6b2e8a7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('blobs',
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('size_bytes', sa.BigInteger(), nullable=False),
+    sa.Column('ref_count', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('sha256')
+    )
+    op.add_column('images', sa.Column('blob_sha256', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_images_blob_sha256'), 'images', ['blob_sha256'], unique=False)
+    op.create_foreign_key('images_blob_sha256_fkey', 'images', 'blobs', ['blob_sha256'], ['sha256'])
+
+    # BEFORE so the blob row exists when the foreign key is checked; cascaded deletes fire it too
+    op.execute("""
+        CREATE FUNCTION images_blob_ref_count() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.blob_sha256 IS NOT NULL THEN
+                UPDATE blobs SET ref_count = ref_count - 1 WHERE sha256 = OLD.blob_sha256;
+            END IF;
+
+            IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.blob_sha256 IS NOT NULL THEN
+                INSERT INTO blobs (sha256, size_bytes, ref_count) VALUES (NEW.blob_sha256, NEW.size_bytes, 1)
+                ON CONFLICT (sha256) DO UPDATE SET ref_count = blobs.ref_count + 1;
+            END IF;
+
+            IF TG_OP = 'DELETE' THEN
+                RETURN OLD;
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER images_blob_ref_count
+        BEFORE INSERT OR DELETE OR UPDATE OF blob_sha256 ON images
+        FOR EACH ROW EXECUTE FUNCTION images_blob_ref_count()
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER images_blob_ref_count ON images")
+    op.execute("DROP FUNCTION images_blob_ref_count()")
+    op.drop_constraint('images_blob_sha256_fkey', 'images', type_='foreignkey')
+    op.drop_index(op.f('ix_images_blob_sha256'), table_name='images')
+    op.drop_column('images', 'blob_sha256')
+    op.drop_table('blobs')
@@ -0,0 +1,35 @@
+"""embedding hnsw index
+
+Revision ID: 5b7e0d93a1f4
+Revises: c1af82f264df
+Create Date: 2026-10-16 10:12:41.208113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b7e0d93a1f4'
+down_revision: Union[str, Sequence[str], None] = 'c1af82f264df'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_image_fingerprints_embedding_hnsw',
+        'image_fingerprints',
+        ['embedding'],
+        unique=False,
+        postgresql_using='hnsw',
+        postgresql_with={'m': 16, 'ef_construction': 64},
+        postgresql_ops={'embedding': 'vector_cosine_ops'},
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_image_fingerprints_embedding_hnsw', table_name='image_fingerprints')
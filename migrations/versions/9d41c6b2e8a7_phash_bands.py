@@ -0,0 +1,46 @@
+"""phash bands
+
+Revision ID: 9d41c6b2e8a7
+Revises: 5b7e0d93a1f4
+Create Date: 2026-10-16 11:03:17.554092
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d41c6b2e8a7'
+down_revision: Union[str, Sequence[str], None] = '5b7e0d93a1f4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Must match `finder.utils.hashing.PHASH_BAND_WIDTHS` at the time of this revision
+BAND_WIDTHS = (11, 11, 11, 11, 10, 10)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for i in range(len(BAND_WIDTHS)):
+        op.add_column('image_fingerprints', sa.Column(f'phash_band_{i}', sa.SmallInteger(), nullable=True))
+
+    # `>>` on bigint is an arithmetic shift; masking keeps only the band's own bits
+    assignments = []
+    shift = 64
+    for i, width in enumerate(BAND_WIDTHS):
+        shift -= width
+        assignments.append(f"phash_band_{i} = (phash >> {shift}) & {(1 << width) - 1}")
+    op.execute(f"UPDATE image_fingerprints SET {', '.join(assignments)}")
+
+    for i in range(len(BAND_WIDTHS)):
+        op.alter_column('image_fingerprints', f'phash_band_{i}', nullable=False)
+        op.create_index(op.f(f'ix_image_fingerprints_phash_band_{i}'), 'image_fingerprints', [f'phash_band_{i}'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for i in range(len(BAND_WIDTHS)):
+        op.drop_index(op.f(f'ix_image_fingerprints_phash_band_{i}'), table_name='image_fingerprints')
+        op.drop_column('image_fingerprints', f'phash_band_{i}')
@@ -0,0 +1,69 @@
+"""file tombstones
+
+Revision ID: b62f0c8d4e13
+Revises: 7a4d2e9c1f60
+Create Date: 2026-10-17 16:05:39.902417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b62f0c8d4e13'
+down_revision: Union[str, Sequence[str], None] = '7a4d2e9c1f60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('file_tombstones',
+    sa.Column('id', sa.BigInteger(), sa.Identity(always=False), nullable=False),
+    sa.Column('path', sa.Text(), nullable=True),
+    sa.Column('blob_sha256', sa.String(length=64), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    # Fires for cascades from collections and users too. The path must match `finder.utils.storage.image_path`.
+    op.execute("""
+        CREATE FUNCTION images_file_tombstone() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO file_tombstones (path)
+            VALUES ('collections/' || OLD.owner_id || '/' || OLD.collection_id || '/' || OLD.stored_filename);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER images_file_tombstone
+        AFTER DELETE ON images
+        FOR EACH ROW WHEN (OLD.blob_sha256 IS NULL) EXECUTE FUNCTION images_file_tombstone()
+    """)
+
+    # Blobs are shared, so they are only tombstoned once their last reference is gone
+    op.execute("""
+        CREATE FUNCTION blobs_file_tombstone() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO file_tombstones (blob_sha256) VALUES (NEW.sha256);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER blobs_file_tombstone
+        AFTER UPDATE OF ref_count ON blobs
+        FOR EACH ROW WHEN (NEW.ref_count = 0 AND OLD.ref_count > 0) EXECUTE FUNCTION blobs_file_tombstone()
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER blobs_file_tombstone ON blobs")
+    op.execute("DROP FUNCTION blobs_file_tombstone()")
+    op.execute("DROP TRIGGER images_file_tombstone ON images")
+    op.execute("DROP FUNCTION images_file_tombstone()")
+    op.drop_table('file_tombstones')
@@ -0,0 +1,32 @@
+"""images keyset indexes
+
+Revision ID: d4a9e7b31c58
+Revises: b62f0c8d4e13
+Create Date: 2026-10-17 18:22:47.160385
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4a9e7b31c58'
+down_revision: Union[str, Sequence[str], None] = 'b62f0c8d4e13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_images_owner_id_created_at_id', 'images', ['owner_id', 'created_at', 'id'], unique=False)
+    op.create_index('ix_images_collection_id_created_at_id', 'images', ['collection_id', 'created_at', 'id'], unique=False)
+    # Covered by the leading column of ix_images_collection_id_created_at_id
+    op.drop_index(op.f('ix_images_collection_id'), table_name='images')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index(op.f('ix_images_collection_id'), 'images', ['collection_id'], unique=False)
+    op.drop_index('ix_images_collection_id_created_at_id', table_name='images')
+    op.drop_index('ix_images_owner_id_created_at_id', table_name='images')
@@ -0,0 +1,74 @@
+import argparse
+import asyncio
+import time
+from typing import List
+
+import numpy as np
+
+from finder.services.embedding_backends import BACKENDS
+
+
+async def benchmark(backend_names: List[str], batch_size: int, iterations: int, concurrency: int) -> None:
+    rng = np.random.default_rng(0)
+
+    for name in backend_names:
+        backend = BACKENDS[name]()
+        input_format = backend.input_format
+        batch = rng.integers(0, 256, (batch_size, *input_format.shape)).astype(input_format.dtype)
+        if not await backend.is_running():
+            print(f"[benchmark] backend={name} is not running, skipped")
+            continue
+
+        # Warm-up: loads sessions / opens the channel outside of the measurement
+        await backend.infer(batch)
+
+        latencies: List[float] = []
+
+        async def run_one() -> None:
+            start = time.perf_counter()
+            await backend.infer(batch)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        for _ in range(0, iterations, concurrency):
+            await asyncio.gather(*(run_one() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        await backend.close()
+
+        print(
+            f"[benchmark] backend={name} input_format={input_format.name} batch_size={batch_size} concurrency={concurrency} "
+            f"p50_ms={np.percentile(latencies, 50):.1f} p95_ms={np.percentile(latencies, 95):.1f} "
+            f"images_per_s={len(latencies) * batch_size / elapsed:.1f}"
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare inference latency of the embedding backends.")
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        choices=sorted(BACKENDS),
+        default=sorted(BACKENDS),
+        help="Backends to benchmark."
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=32,
+        help="Images per inference call."
+    )
+    parser.add_argument(
+        "--iterations",
+        type=int,
+        default=20,
+        help="Number of inference calls per backend."
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Inference calls issued at the same time."
+    )
+    args = parser.parse_args()
+
+    asyncio.run(benchmark(args.backends, args.batch_size, args.iterations, args.concurrency))
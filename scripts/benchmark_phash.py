@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from finder.utils.files import load_images_from_bytes, read_files
+from finder.utils.hashing import phash_batch, phash_many, phash_pixels
+
+
+def regression_corpus(rng: np.random.Generator, count: int) -> List[Image.Image]:
+    # Includes degenerate inputs (flat colours, constant rows, tiny images) where DCT coefficients tie
+    images = [
+        Image.new("RGB", (64, 64), (0, 0, 0)),
+        Image.new("RGB", (640, 480), (255, 255, 255)),
+        Image.new("L", (300, 200), 128),
+        Image.fromarray(np.tile(np.arange(256, dtype=np.uint8), (64, 1))),
+        Image.fromarray(np.tile(np.arange(256, dtype=np.uint8)[:, None], (1, 64))),
+        Image.new("RGB", (1, 1), (10, 20, 30)),
+    ]
+    while len(images) < count:
+        width, height = (int(v) for v in rng.integers(16, 1200, 2))
+        kind = len(images) % 3
+        if kind == 0:
+            images.append(Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8)))
+            continue
+
+        image = Image.new("RGB", (width, height), tuple(int(v) for v in rng.integers(0, 256, 3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(int(rng.integers(1, 20))):
+            x0, y0 = int(rng.integers(0, width)), int(rng.integers(0, height))
+            box = [x0, y0, x0 + int(rng.integers(1, width)), y0 + int(rng.integers(1, height))]
+            fill = tuple(int(v) for v in rng.integers(0, 256, 3))
+            if kind == 1:
+                draw.rectangle(box, fill=fill)
+            else:
+                draw.text((x0, y0), "finder", fill=fill)
+        images.append(image)
+
+    return images
+
+
+async def per_image(images: List[Image.Image]) -> np.ndarray:
+    phashes = await phash_many(images, hash_size=8)
+    return np.array([int.from_bytes(value, signed=True) for value in phashes], dtype=np.int64)
+
+
+async def batched(images: List[Image.Image]) -> np.ndarray:
+    return phash_batch(await asyncio.gather(*(asyncio.to_thread(phash_pixels, image) for image in images)))
+
+
+async def benchmark(images_dir: Optional[Path], count: int, batch_size: int, rounds: int) -> None:
+    if images_dir is not None:
+        paths = sorted(path for path in images_dir.iterdir() if path.is_file())[:count]
+        images = await load_images_from_bytes(await read_files(paths))
+    else:
+        images = regression_corpus(np.random.default_rng(0), count)
+
+    expected = await per_image(images)
+    actual = await batched(images)
+    mismatches = int(np.count_nonzero(expected != actual))
+    print(f"[phash] corpus={len(images)} mismatches_vs_imagehash={mismatches}")
+
+    batch = images[:batch_size]
+    # Hash step alone, on the 32x32 grayscale inputs both implementations reduce every image to
+    pixels = [phash_pixels(image) for image in batch]
+    thumbnails = [Image.fromarray(value) for value in pixels]
+
+    async def hash_only_batched(_images: List[Image.Image]) -> np.ndarray:
+        return phash_batch(pixels)
+
+    for name, run, inputs in (
+            ("imagehash per-image threads (resize + hash)", per_image, batch),
+            ("phash_batch (resize + hash)", batched, batch),
+            ("imagehash per-image threads (hash only)", per_image, thumbnails),
+            ("phash_batch (hash only)", hash_only_batched, thumbnails),
+    ):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            await run(inputs)
+        elapsed = time.perf_counter() - start
+        print(f"[phash] {name}: batch_size={len(batch)} ms_per_batch={elapsed * 1000 / rounds:.2f}")
+
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Check phash_batch against imagehash.phash and compare their speed on one batch."
+    )
+    parser.add_argument(
+        "--images_dir",
+        type=Path,
+        help="Directory of images used as the corpus. A synthetic corpus is generated when omitted."
+    )
+    parser.add_argument(
+        "--count",
+        type=int,
+        default=1000,
+        help="Number of corpus images."
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=64,
+        help="Images per timed batch."
+    )
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=20,
+        help="Timed rounds per implementation."
+    )
+    args = parser.parse_args()
+
+    asyncio.run(benchmark(args.images_dir, args.count, args.batch_size, args.rounds))
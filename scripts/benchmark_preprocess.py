@@ -0,0 +1,116 @@
+import argparse
+import asyncio
+import io
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from finder.services.preprocess_service import PreprocessService
+from finder.utils.files import load_images_from_bytes, read_files
+from finder.utils.hashing import phash_many
+from finder.utils.preprocess import preprocess_many
+
+
+def synthetic_photo(rng: np.random.Generator, size: tuple[int, int], quality: int) -> bytes:
+    # Smooth gradients plus sensor-like noise, which compresses about as poorly as a phone photo
+    width, height = size
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    base = np.stack([x * 255 + y * 0, y * 255 + x * 0, (x + y) * 127], axis=-1)
+    pixels = np.clip(base + rng.normal(0, 24, (height, width, 3)), 0, 255).astype(np.uint8)
+
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+async def baseline(contents: List[bytes]) -> Tuple[np.ndarray, List[bytes]]:
+    # Previous pipeline: full decode, then pHash and CLIP input from the full-resolution image
+    images = await load_images_from_bytes(contents)
+    return await preprocess_many(images), await phash_many(images, hash_size=8)
+
+
+async def measure(
+        name: str,
+        run,
+        contents: List[bytes],
+        rounds: int,
+        reference: Optional[Tuple[np.ndarray, List[bytes]]]
+) -> Tuple[np.ndarray, List[bytes]]:
+    result = await run(contents)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = await run(contents)
+    elapsed = time.perf_counter() - start
+
+    images = len(contents) * rounds
+    message = f"[benchmark] {name}: images_per_s={images / elapsed:.2f} ms_per_image={elapsed * 1000 / images:.1f}"
+    if reference is not None:
+        batch, phashes = result[:2]
+        bits = [
+            (int.from_bytes(a) ^ int.from_bytes(b)).bit_count() for a, b in zip(phashes, reference[1])
+        ]
+        message += (
+            f" max_abs_diff_vs_full_decode={np.abs(batch - reference[0]).max():.4f}"
+            f" phash_bits_changed_max={max(bits)}"
+        )
+    print(message)
+    return result
+
+
+async def benchmark(images_dir: Optional[Path], count: int, workers: List[int], rounds: int) -> None:
+    if images_dir is not None:
+        contents = await read_files(sorted(path for path in images_dir.iterdir() if path.is_file())[:count])
+    else:
+        rng = np.random.default_rng(0)
+        contents = [synthetic_photo(rng, (6000, 4000), quality=95) for _ in range(count)]
+
+    print(
+        f"[benchmark] images={len(contents)} "
+        f"avg_size_mb={sum(map(len, contents)) / len(contents) / 1024 / 1024:.1f}"
+    )
+
+    reference = await measure("full decode + phash_many + preprocess_many", baseline, contents, rounds, None)
+
+    service = PreprocessService.get_instance()
+    for worker_count in workers:
+        service.close()
+        service.workers = worker_count
+        await measure(
+            f"PreprocessService workers={worker_count}", service.preprocess, contents, rounds, reference
+        )
+    service.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure preprocessing throughput for large photos.")
+    parser.add_argument(
+        "--images_dir",
+        type=Path,
+        help="Directory of photos to use. Synthetic 24 MP JPEGs are generated when omitted."
+    )
+    parser.add_argument(
+        "--count",
+        type=int,
+        default=8,
+        help="Number of images per round."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[0, 4],
+        help="PreprocessService worker counts to evaluate (0 uses threads)."
+    )
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=3,
+        help="Measured rounds after one warm-up round."
+    )
+    args = parser.parse_args()
+
+    asyncio.run(benchmark(args.images_dir, args.count, args.workers, args.rounds))
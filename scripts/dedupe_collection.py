@@ -0,0 +1,76 @@
+import argparse
+import asyncio
+import json
+import sys
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import sqlalchemy as sa
+
+from finder.db.models.collection import Collection
+from finder.db.session import SessionLocal
+from finder.utils.duplicate_sweep import sweep_collection
+
+
+async def dedupe_collection(collection_id: uuid.UUID, output: Optional[Path], page_size: int = 500) -> None:
+    print("[sweep] start", file=sys.stderr)
+
+    async with SessionLocal() as db:
+        collection: Collection = await db.scalar(
+            sa.select(Collection).where(Collection.id == collection_id)
+        )
+        if collection is None:
+            print("[db] collection not found -> abort", file=sys.stderr)
+            raise ValueError(f"Collection with id `{collection_id}` not found.")
+
+        owner_id = collection.owner_id
+        await db.rollback()
+
+        total_groups = 0
+        total_images = 0
+        out = output.open("w", encoding="utf-8") if output else sys.stdout
+        try:
+            async for image_ids in sweep_collection(
+                db, owner_id, collection_id, page_size=page_size,
+                log=lambda message: print(message, file=sys.stderr)
+            ):
+                out.write(json.dumps({"image_ids": [str(image_id) for image_id in image_ids]}) + "\n")
+                total_groups += 1
+                total_images += len(image_ids)
+        finally:
+            if output:
+                out.close()
+
+    print(f"[sweep] done groups={total_groups} images_in_groups={total_images}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Cluster the images of an existing collection into duplicate groups using SHA256, "
+                    "pHash and embedding similarity. Groups are written as NDJSON, one per line."
+    )
+    parser.add_argument(
+        "--collection_id",
+        required=True,
+        help="UUID of the collection to sweep."
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=None,
+        help="NDJSON file to write the groups to. Defaults to stdout."
+    )
+    parser.add_argument(
+        "--page_size",
+        type=int,
+        default=500,
+        help="Number of images per embedding nearest-neighbour query."
+    )
+    args = parser.parse_args()
+
+    asyncio.run(dedupe_collection(
+        uuid.UUID(args.collection_id),
+        output=args.output,
+        page_size=args.page_size
+    ))
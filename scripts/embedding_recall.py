@@ -0,0 +1,145 @@
+import argparse
+import asyncio
+import time
+import uuid
+from typing import List
+
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from finder.config import config
+from finder.db.models.collection import Collection
+from finder.db.models.image import Image
+from finder.db.models.image_fingerprint import ImageFingerprint
+from finder.db.session import SessionLocal
+from finder.utils.duplicates import set_embedding_search_params
+
+
+async def nearest_neighbours(
+    db: AsyncSession,
+    collection: Collection,
+    image_id: uuid.UUID,
+    embedding: np.ndarray,
+    k: int
+) -> List[tuple[uuid.UUID, float]]:
+    distance = ImageFingerprint.embedding.cosine_distance(embedding)
+    result = await db.execute(
+        sa.select(Image.id, distance)
+        .join(ImageFingerprint, ImageFingerprint.image_id == Image.id)
+        .where(
+            Image.owner_id == collection.owner_id,
+            Image.collection_id == collection.id,
+            Image.id != image_id,
+        )
+        .order_by(distance)
+        .limit(k)
+    )
+    return [(row[0], row[1]) for row in result.all()]
+
+
+def is_duplicate(neighbours: List[tuple[uuid.UUID, float]], threshold: float) -> bool:
+    return bool(neighbours) and 1.0 - neighbours[0][1] >= threshold
+
+
+async def measure_recall(
+    collection_id: uuid.UUID,
+    samples: int,
+    k: int,
+    ef_search_values: List[int],
+    threshold: float = config.EMBEDDING_SIMILARITY_THRESHOLD
+) -> None:
+    async with SessionLocal() as db:
+        collection: Collection = await db.scalar(
+            sa.select(Collection).where(Collection.id == collection_id)
+        )
+        if collection is None:
+            raise ValueError(f"Collection with id `{collection_id}` not found.")
+
+        collection_size = await db.scalar(
+            sa.select(sa.func.count()).select_from(Image).where(Image.collection_id == collection.id)
+        )
+        sample_rows = (await db.execute(
+            sa.select(ImageFingerprint.image_id, ImageFingerprint.embedding)
+            .join(Image, ImageFingerprint.image_id == Image.id)
+            .where(Image.collection_id == collection.id)
+            .order_by(sa.func.random())
+            .limit(samples)
+        )).all()
+        print(f"[recall] collection_size={collection_size} samples={len(sample_rows)} k={k} threshold={threshold}")
+
+        # Exact search: forbid index scans so the planner falls back to a sequential scan + sort
+        await db.execute(sa.text("SET LOCAL enable_indexscan = off"))
+        start = time.perf_counter()
+        exact = {
+            image_id: await nearest_neighbours(db, collection, image_id, embedding, k)
+            for image_id, embedding in sample_rows
+        }
+        exact_ms = (time.perf_counter() - start) * 1000 / max(len(sample_rows), 1)
+        await db.rollback()
+        print(f"[recall] exact avg_ms={exact_ms:.2f}")
+
+        for ef_search in ef_search_values:
+            await set_embedding_search_params(db, ef_search=ef_search)
+            start = time.perf_counter()
+            approximate = {
+                image_id: await nearest_neighbours(db, collection, image_id, embedding, k)
+                for image_id, embedding in sample_rows
+            }
+            ann_ms = (time.perf_counter() - start) * 1000 / max(len(sample_rows), 1)
+            await db.rollback()
+
+            found = sum(
+                len({i for i, _ in approximate[image_id]} & {i for i, _ in exact[image_id]})
+                for image_id in exact
+            )
+            expected = sum(len(neighbours) for neighbours in exact.values())
+            agreement = sum(
+                is_duplicate(approximate[image_id], threshold) == is_duplicate(exact[image_id], threshold)
+                for image_id in exact
+            )
+
+            print(
+                f"[recall] ef_search={ef_search} recall@{k}={found / max(expected, 1):.4f} "
+                f"duplicate_decision_agreement={agreement / max(len(exact), 1):.4f} "
+                f"avg_ms={ann_ms:.2f} speedup={exact_ms / max(ann_ms, 1e-9):.1f}x"
+            )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Measure the recall of the HNSW embedding index against exact search "
+                    "on a sample of images from a collection."
+    )
+    parser.add_argument(
+        "--collection_id",
+        required=True,
+        help="UUID of the collection to sample."
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=200,
+        help="Number of images used as queries."
+    )
+    parser.add_argument(
+        "--k",
+        type=int,
+        default=config.EMBEDDING_KNN_K,
+        help="Number of nearest neighbours compared per query."
+    )
+    parser.add_argument(
+        "--ef_search",
+        type=int,
+        nargs="+",
+        default=[config.EMBEDDING_HNSW_EF_SEARCH],
+        help="One or more hnsw.ef_search values to evaluate."
+    )
+    args = parser.parse_args()
+
+    asyncio.run(measure_recall(
+        uuid.UUID(args.collection_id),
+        samples=args.samples,
+        k=args.k,
+        ef_search_values=args.ef_search
+    ))
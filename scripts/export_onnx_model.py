@@ -1,15 +1,22 @@
+import argparse
 from pathlib import Path
 
+import numpy as np
+import onnxruntime as ort
 import torch
 import torch.nn as nn
 import clip
+from PIL import Image
 
-path = Path("./models/embedder/1/model.onnx")
+from finder.utils.preprocess import CLIP_MEAN, CLIP_STD, preprocess_image, preprocess_image_uint8
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model, preprocess = clip.load("ViT-B/32", device=device)
-model.float()
-model.eval()
+# Minimum cosine similarity between float32 and uint8 variant embeddings of the same image
+UINT8_MIN_COSINE = 0.9999
+
+PATHS = {
+    "float32": Path("./models/embedder/1/model.onnx"),
+    "uint8": Path("./models/embedder_uint8/1/model.onnx"),
+}
 
 
 class ClipModel(nn.Module):
@@ -21,21 +28,87 @@ class ClipModel(nn.Module):
         return self.clip_model.encode_image(x)
 
 
-wrapper = ClipModel(model)
+class ClipUint8Model(nn.Module):
+    # Takes raw NHWC uint8 pixels and does the scaling, normalization and transpose of `preprocess_image` in-graph
+    def __init__(self, clip_model: nn.Module):
+        super().__init__()
+        self.clip_model = clip_model
+        self.register_buffer("mean", torch.from_numpy(CLIP_MEAN).view(1, 3, 1, 1))
+        self.register_buffer("std", torch.from_numpy(CLIP_STD).view(1, 3, 1, 1))
+
+    def forward(self, x: torch.Tensor):
+        x = x.permute(0, 3, 1, 2).float() / 255.0
+        x = (x - self.mean) / self.std
+        return self.clip_model.encode_image(x)
+
+
+def _run_onnx(path: Path, batch: np.ndarray) -> np.ndarray:
+    session = ort.InferenceSession(str(path), providers=["CPUExecutionProvider"])
+    return session.run(["EMBEDDING"], {"INPUT": batch})[0]
+
+
+def check_uint8_tolerance(samples: int = 8) -> float:
+    # Runs the exported graphs themselves, so differences introduced by the export are caught as well
+    rng = np.random.default_rng(0)
+    images = [
+        Image.fromarray(rng.integers(0, 256, (rng.integers(200, 800), rng.integers(200, 800), 3), dtype=np.uint8))
+        for _ in range(samples)
+    ]
+    expected = _run_onnx(PATHS["float32"], np.stack([preprocess_image(img) for img in images]))
+    actual = _run_onnx(PATHS["uint8"], np.stack([preprocess_image_uint8(img) for img in images]))
+
+    cosine = np.sum(expected * actual, axis=1) / (
+        np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1) + 1e-12
+    )
+    return float(cosine.min())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export the CLIP image encoder to ONNX.")
+    parser.add_argument(
+        "--input_format",
+        choices=sorted(PATHS),
+        default="float32",
+        help="float32: normalized NCHW input. uint8: raw NHWC pixels, normalized inside the model."
+    )
+    args = parser.parse_args()
+
+    path = PATHS[args.input_format]
+    if args.input_format == "uint8" and not PATHS["float32"].is_file():
+        raise RuntimeError("Export the float32 model first; the uint8 variant is checked against it.")
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model, preprocess = clip.load("ViT-B/32", device=device)
+    model.float()
+    model.eval()
+
+    if args.input_format == "uint8":
+        wrapper = ClipUint8Model(model).to(device)
+        dummy = torch.randint(0, 256, (1, 224, 224, 3), dtype=torch.uint8).to(device=device)
+    else:
+        wrapper = ClipModel(model)
+        dummy = torch.randn(1, 3, 224, 224, dtype=torch.float32).to(device=device)
 
-dummy = torch.randn(1, 3, 224, 224, dtype=torch.float32).to(device=device)
+    torch.onnx.export(
+        wrapper,
+        (dummy, ),
+        path,
+        input_names=["INPUT"],
+        output_names=["EMBEDDING"],
+        dynamic_axes={
+            "INPUT": {0: "batch"},
+            "EMBEDDING": {0: "batch"},
+        },
+        opset_version=17
+    )
 
-torch.onnx.export(
-    wrapper,
-    (dummy, ),
-    path,
-    input_names=["INPUT"],
-    output_names=["EMBEDDING"],
-    dynamic_axes={
-        "INPUT": {0: "batch"},
-        "EMBEDDING": {0: "batch"},
-    },
-    opset_version=17
-)
+    if args.input_format == "uint8":
+        min_cosine = check_uint8_tolerance()
+        print(f"Minimum cosine similarity against the float32 model: {min_cosine:.6f}")
+        if min_cosine < UINT8_MIN_COSINE:
+            # Removed so Triton never loads a diverging model
+            path.unlink()
+            raise RuntimeError(f"uint8 variant diverges from the float32 model (< {UINT8_MIN_COSINE}).")
 
-print(f"Saved `{wrapper.__class__.__name__}` model to {path.absolute()}")
+    print(f"Saved `{wrapper.__class__.__name__}` model to {path.absolute()}")
@@ -1,5 +1,6 @@
 import argparse
 import asyncio
+import contextlib
 import uuid
 from pathlib import Path
 from typing import List, Generator, TypeVar
@@ -11,10 +12,12 @@ from finder.db.models.collection import Collection
 from finder.db.models.image import Image
 from finder.db.models.image_fingerprint import ImageFingerprint
 from finder.db.session import SessionLocal
+from finder.services.derivative_cache import DerivativeCache
 from finder.services.embedding_service import EmbeddingService
-from finder.utils.duplicates import detect_duplicate_sha256, detect_duplicate_phash, detect_duplicate_embedding
-from finder.utils.files import get_mime_types, read_files, load_images_from_bytes, write_files_bytes, delete_files
-from finder.utils.hashing import sha256_many, phash_many
+from finder.services.preprocess_service import PreprocessService
+from finder.utils.duplicates import detect_duplicates_many, detect_batch_duplicates
+from finder.utils.files import get_mime_types, read_files_with_sha256, write_blobs, write_files_bytes, delete_files
+from finder.utils.storage import blob_path, image_path
 
 T = TypeVar('T')
 
@@ -28,161 +31,186 @@ async def import_images(
     target_collection_id: uuid.UUID,
     prevent_duplicates: bool,
     embedder: EmbeddingService = EmbeddingService.get_instance(),
+    preprocessor: PreprocessService = PreprocessService.get_instance(),
+    derivative_cache: DerivativeCache = DerivativeCache.get_instance(),
     files_per_batch: int = 10
 ) -> None:
     print("[import] start")
     print(f"[import] target_collection_id set")
     print(f"[import] prevent_duplicates={prevent_duplicates}, files_per_batch={files_per_batch}")
 
-    if not embedder.is_running():
-        raise RuntimeError("Embedder is not running!")
+    try:
+        if not await embedder.is_running():
+            raise RuntimeError("Embedder is not running!")
 
-    config.IMPORTS_PATH.mkdir(exist_ok=True, parents=True)
-    print(f"[import] imports_dir={config.IMPORTS_PATH}")
+        config.IMPORTS_PATH.mkdir(exist_ok=True, parents=True)
+        print(f"[import] imports_dir={config.IMPORTS_PATH}")
 
-    async with SessionLocal() as db:
-        collection: Collection = (
-            await db.scalar(
-                sa.select(Collection).where(Collection.id == target_collection_id)
+        async with SessionLocal() as db:
+            collection: Collection = (
+                await db.scalar(
+                    sa.select(Collection).where(Collection.id == target_collection_id)
+                )
             )
-        )
-
-        if collection is None:
-            print("[db] collection not found -> abort")
-            raise ValueError(f"Collection with id `{target_collection_id}` not found.")
-
-        print("[db] collection loaded")
-
-    file_paths = [path for path in config.IMPORTS_PATH.iterdir() if path.is_file()]
-    print(f"[scan] files_found={len(file_paths)} in {config.IMPORTS_PATH}")
-
-    valid_files: List[Path] = []
-    valid_file_mimes: List[str] = []
-    mime_list = await get_mime_types(file_paths)
-    allowed = set(config.ALLOWED_MIME_TYPES)
-    for path, mime in zip(file_paths, mime_list):
-        if mime not in allowed:
-            continue
-        valid_files.append(path)
-        valid_file_mimes.append(mime)
-
-    print(f"[filter] valid_files={len(valid_files)}")
-
-    total_processed = 0
-    total_written = 0
-    total_deleted = 0
-    total_duplicates = 0
-
-    batches_files = list(batch_list(valid_files, files_per_batch))
-    batches_mimes = list(batch_list(valid_file_mimes, files_per_batch))
-    print(f"[batch] batches={len(batches_files)} size~{files_per_batch}")
-
-    for idx, (paths, mimes) in enumerate(zip(batches_files, batches_mimes), start=1):
-        print(f"[batch {idx}/{len(batches_files)}] size={len(paths)} -> load bytes")
-        file_contents = await read_files(paths)
-        pil_images = await load_images_from_bytes(file_contents)
-        print(f"[batch {idx}] images_loaded={len(pil_images)} -> hashing")
-
-        sha256_list = await sha256_many(file_contents)
-        phash_list = await phash_many(pil_images, hash_size=8)
-        print(f"[batch {idx}] hashes_done -> embeddings")
-        embeddings = await embedder.embed(pil_images)
-        print(f"[batch {idx}] embeddings_done")
-
-        images: List[Image] = []
-        fingerprints: List[ImageFingerprint] = []
-        for path, mime, file_content, sha256, phash, embedding in zip(
-            paths, mimes, file_contents, sha256_list, phash_list, embeddings
-        ):
-            uuid_ = uuid.uuid4()
-            images.append(Image(
-                id=uuid_,
-                owner_id=collection.owner_id,
-                collection_id=collection.id,
-                original_filename=path.name,
-                stored_filename=f"{uuid_}{path.suffix}",
-                mime_type=mime,
-                size_bytes=len(file_content)
-            ))
-
-            fingerprints.append(ImageFingerprint(
-                image_id=uuid_,
-                sha256=sha256,
-                phash=int.from_bytes(phash, signed=True),
-                embedding=embedding
-            ))
-
-        print(f"[batch {idx}] stage_db images={len(images)} fingerprints={len(fingerprints)}")
-
-        try:
-            db.add_all(images)
-            db.add_all(fingerprints)
-            await db.flush()
-            print(f"[batch {idx}] db_flush_ok")
-
-            duplicates: List[Path] = []
-            if prevent_duplicates:
-                print(f"[batch {idx}] duplicate_check start")
-                for path, image, fingerprint in zip(paths, images, fingerprints):
-                    dupe = await detect_duplicate_sha256(db, image.owner_id, image.collection_id, image.id)
-                    dupe_type = "sha256" if dupe else None
 
-                    if not dupe:
-                        dupe = await detect_duplicate_phash(db, image.owner_id, image.collection_id, image.id)
-                        dupe_type = "phash" if dupe else None
-
-                    if not dupe:
-                        dupe = await detect_duplicate_embedding(db, image.owner_id, image.collection_id, image.id)
-                        dupe_type = "embedding" if dupe else None
+            if collection is None:
+                print("[db] collection not found -> abort")
+                raise ValueError(f"Collection with id `{target_collection_id}` not found.")
+
+            print("[db] collection loaded")
+
+        file_paths = [path for path in config.IMPORTS_PATH.iterdir() if path.is_file()]
+        print(f"[scan] files_found={len(file_paths)} in {config.IMPORTS_PATH}")
+
+        valid_files: List[Path] = []
+        valid_file_mimes: List[str] = []
+        mime_list = await get_mime_types(file_paths)
+        allowed = set(config.ALLOWED_MIME_TYPES)
+        for path, mime in zip(file_paths, mime_list):
+            if mime not in allowed:
+                continue
+            valid_files.append(path)
+            valid_file_mimes.append(mime)
+
+        print(f"[filter] valid_files={len(valid_files)}")
+
+        total_processed = 0
+        total_written = 0
+        total_deleted = 0
+        total_duplicates = 0
+
+        batches_files = list(batch_list(valid_files, files_per_batch))
+        batches_mimes = list(batch_list(valid_file_mimes, files_per_batch))
+        print(f"[batch] batches={len(batches_files)} size~{files_per_batch}")
+
+        for idx, (paths, mimes) in enumerate(zip(batches_files, batches_mimes), start=1):
+            print(f"[batch {idx}/{len(batches_files)}] size={len(paths)} -> load bytes")
+            reads = await read_files_with_sha256(paths)
+            file_contents = [content for content, _ in reads]
+            sha256_list = [sha256 for _, sha256 in reads]
+            batch, phash_list, thumbnails = await preprocessor.preprocess(
+                file_contents,
+                embedder.backend.input_format.name,
+                [path.name for path in paths],
+                derivative=derivative_cache.eager
+            )
+            print(f"[batch {idx}] images_decoded={len(batch)} hashes_done -> embeddings")
+            embeddings = await embedder.embed_batch(batch)
+            print(f"[batch {idx}] embeddings_done")
 
-                    if dupe:
+            batch_duplicates = {}
+            if prevent_duplicates:
+                batch_duplicates = detect_batch_duplicates(
+                    sha256_list, phash_list, embeddings
+                )
+                for later, (earlier, dupe_type) in batch_duplicates.items():
+                    print(f"[duplicate] {dupe_type} match detected within batch for {paths[later].name}: {paths[earlier].name}")
+                print(f"[batch {idx}] batch_duplicate_check done dupes={len(batch_duplicates)}")
+
+            kept = [i for i in range(len(paths)) if i not in batch_duplicates]
+            kept_paths = [paths[i] for i in kept]
+            kept_contents = [file_contents[i] for i in kept]
+
+            images: List[Image] = []
+            fingerprints: List[ImageFingerprint] = []
+            for path, mime, file_content, sha256, phash, embedding in (
+                (paths[i], mimes[i], file_contents[i], sha256_list[i], phash_list[i], embeddings[i]) for i in kept
+            ):
+                uuid_ = uuid.uuid4()
+                images.append(Image(
+                    id=uuid_,
+                    owner_id=collection.owner_id,
+                    collection_id=collection.id,
+                    original_filename=path.name,
+                    stored_filename=f"{uuid_}{path.suffix}",
+                    mime_type=mime,
+                    size_bytes=len(file_content),
+                    blob_sha256=sha256 if config.STORAGE_LAYOUT == "blobs" else None
+                ))
+
+                fingerprints.append(ImageFingerprint(
+                    image_id=uuid_,
+                    sha256=sha256,
+                    phash=int(phash),
+                    embedding=embedding
+                ))
+
+            print(f"[batch {idx}] stage_db images={len(images)} fingerprints={len(fingerprints)}")
+
+            try:
+                db.add_all(images)
+                db.add_all(fingerprints)
+                await db.flush()
+                print(f"[batch {idx}] db_flush_ok")
+
+                duplicates: List[Path] = [paths[i] for i in batch_duplicates]
+                if prevent_duplicates:
+                    print(f"[batch {idx}] duplicate_check start")
+                    matches = await detect_duplicates_many(
+                        db, collection.owner_id, collection.id, [image.id for image in images]
+                    )
+                    for path, image, fingerprint in zip(kept_paths, images, fingerprints):
+                        if image.id not in matches:
+                            continue
+
+                        dupe, dupe_type = matches[image.id]
                         print(f"[duplicate] {dupe_type} match detected for {image.original_filename}: {dupe}")
 
-                    if dupe is not None:
                         duplicates.append(path)
                         await db.delete(image)
                         await db.delete(fingerprint)
 
-                print(f"[batch {idx}] duplicate_check done dupes={len(duplicates)}")
-                total_duplicates += len(duplicates)
-
-            to_write = [
-                (
-                    content,
-                    config.STORAGE_PATH
-                    / "collections"
-                    / str(collection.owner_id)
-                    / str(collection.id)
-                    / image.stored_filename
-                )
-                for content, path, image
-                in zip(file_contents, paths, images)
-                if path not in duplicates
-            ]
-            await write_files_bytes(to_write)
-            written_count = len(to_write)
-            total_written += written_count
-            print(f"[batch {idx}] wrote_files={written_count}")
-
-            to_delete = [path for path in paths if path not in duplicates]
-            await delete_files(to_delete)
-            deleted_count = len(to_delete)
-            total_deleted += deleted_count
-            print(f"[batch {idx}] deleted_from_imports={deleted_count}")
-
-            await db.commit()
-            print(f"[batch {idx}] db_commit_ok")
-
-            total_processed += len(paths)
-
-        except Exception as e:
-            await db.rollback()
-            name = e.__class__.__name__
-            msg = str(e)
-            if len(msg) > 200:
-                msg = msg[:200] + "...(truncated)"
-            print(f"[batch {idx}] ERROR {name}: {msg}")
-            raise
+                    print(f"[batch {idx}] duplicate_check done dupes={len(duplicates)}")
+                    total_duplicates += len(duplicates)
+
+                to_write = [
+                    (content, image)
+                    for content, path, image
+                    in zip(kept_contents, kept_paths, images)
+                    if path not in duplicates
+                ]
+                if config.STORAGE_LAYOUT == "blobs":
+                    await write_blobs([(content, blob_path(image.blob_sha256)) for content, image in to_write])
+                else:
+                    await write_files_bytes([
+                        (content, image_path(collection.owner_id, collection.id, image.stored_filename))
+                        for content, image in to_write
+                    ])
+                written_count = len(to_write)
+                total_written += written_count
+                print(f"[batch {idx}] wrote_files={written_count}")
+
+                to_delete = [path for path in paths if path not in duplicates]
+                await delete_files(to_delete)
+                deleted_count = len(to_delete)
+                total_deleted += deleted_count
+                print(f"[batch {idx}] deleted_from_imports={deleted_count}")
+
+                await db.commit()
+                print(f"[batch {idx}] db_commit_ok")
+
+                if derivative_cache.eager is not None:
+                    width, format_, _quality = derivative_cache.eager
+                    # Only a cache, and the batch is already committed: a failed write is regenerated on first request
+                    with contextlib.suppress(OSError):
+                        await derivative_cache.put_many([
+                            (sha256_list[i], width, format_, thumbnails[i]) for i in kept if paths[i] not in duplicates
+                        ])
+                        print(f"[batch {idx}] thumbnails_cached")
+
+                total_processed += len(paths)
+
+            except Exception as e:
+                await db.rollback()
+                name = e.__class__.__name__
+                msg = str(e)
+                if len(msg) > 200:
+                    msg = msg[:200] + "...(truncated)"
+                print(f"[batch {idx}] ERROR {name}: {msg}")
+                raise
+    finally:
+        await embedder.close()
+        preprocessor.close()
 
     print("[import] done")
     print(f"[import] totals processed={total_processed} written={total_written} deleted={total_deleted} duplicates={total_duplicates}")
@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+import uuid
+from typing import Optional
+
+import numpy as np
+import sqlalchemy as sa
+
+from finder.db.models.image import Image
+from finder.db.models.image_fingerprint import ImageFingerprint
+from finder.db.session import SessionLocal
+from finder.utils.files import read_files
+from finder.utils.hashing import phash_batch, phash_pixels
+from finder.utils.preprocess import decode_thumbnail
+from finder.utils.storage import stored_path
+
+
+def thumbnail_phash_pixels(content: bytes) -> np.ndarray:
+    # Same derivation as `preprocess_into`: the pHash input of the shared decode thumbnail
+    thumbnail, _ = decode_thumbnail(content)
+    return phash_pixels(thumbnail)
+
+
+async def rehash(collection_id: Optional[uuid.UUID], batch_size: int, dry_run: bool) -> None:
+    print(f"[rehash] start collection_id={collection_id} batch_size={batch_size} dry_run={dry_run}")
+
+    total = 0
+    changed = 0
+    missing = 0
+    last_id: Optional[uuid.UUID] = None
+    async with SessionLocal() as db:
+        while True:
+            stmt = (
+                sa.select(Image, ImageFingerprint)
+                .join(ImageFingerprint, ImageFingerprint.image_id == Image.id)
+                .order_by(Image.id)
+                .limit(batch_size)
+            )
+            if collection_id is not None:
+                stmt = stmt.where(Image.collection_id == collection_id)
+            if last_id is not None:
+                stmt = stmt.where(Image.id > last_id)
+
+            rows = (await db.execute(stmt)).all()
+            if not rows:
+                break
+            last_id = rows[-1][0].id
+
+            paths = [stored_path(image) for image, _ in rows]
+            present = [(row, path) for row, path in zip(rows, paths) if path.is_file()]
+            missing += len(rows) - len(present)
+
+            contents = await read_files([path for _, path in present])
+            phashes = phash_batch(await asyncio.gather(*(
+                asyncio.to_thread(thumbnail_phash_pixels, content) for content in contents
+            )))
+
+            for ((_, fingerprint), _), value in zip(present, phashes.tolist()):
+                if value != fingerprint.phash:
+                    changed += 1
+                    # Assigning through the ORM lets the fingerprint listener recompute the band columns
+                    fingerprint.phash = value
+
+            total += len(rows)
+            if dry_run:
+                await db.rollback()
+            else:
+                await db.commit()
+            print(f"[rehash] processed={total} changed={changed} missing_files={missing}")
+
+    print(f"[rehash] done processed={total} changed={changed} missing_files={missing}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Recompute stored pHashes with the thumbnail-based pipeline used for new uploads."
+    )
+    parser.add_argument(
+        "--collection_id",
+        help="UUID of a single collection to rehash. All images are rehashed when omitted."
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=200,
+        help="Images read and committed per batch."
+    )
+    parser.add_argument(
+        "--dry_run",
+        action="store_true",
+        help="Only report how many pHashes would change."
+    )
+    args = parser.parse_args()
+
+    asyncio.run(rehash(
+        uuid.UUID(args.collection_id) if args.collection_id else None,
+        batch_size=args.batch_size,
+        dry_run=args.dry_run
+    ))